@@ -177,6 +177,16 @@ def party_fights_and_clears_dungeon(execution_times):
             print(f"Attack Hero: {exec_time:.2f} ms")
             execution_times.append((f"/monster/attack_hero/{monster_id}", exec_time))
 
+    # The same fight resolved as a single combat round
+    actions = []
+    for monster in monsters:
+        if isinstance(monster, dict):
+            actions.append({"attacker_type": "hero", "attacker_id": 1, "target_id": monster.get('id')})
+            actions.append({"attacker_type": "monster", "attacker_id": monster.get('id'), "target_id": 1})
+    exec_time, response = hit_endpoint("POST", "/dungeon/1/combat_round", data=actions)
+    print(f"Combat Round: {exec_time:.2f} ms")
+    execution_times.append(("/dungeon/1/combat_round", exec_time))
+
     # After the battle, heroes check their XP and level up if possible
     exec_time, response = hit_endpoint("GET", f"/hero/check_xp/1")
     print(f"Check XP: {exec_time:.2f} ms")
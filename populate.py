@@ -24,10 +24,14 @@ fake = Faker()
 with engine.begin() as conn:
     conn.execute(sqlalchemy.text("""
     DROP TABLE IF EXISTS targeting;
+    DROP TABLE IF EXISTS targeting_rollup;
+    DROP TABLE IF EXISTS hero_battle_summary;
     DROP TABLE IF EXISTS recruitment;
+    DROP TABLE IF EXISTS guild_stats;
     DROP TABLE IF EXISTS hero;
     DROP TABLE IF EXISTS guild;
     DROP TABLE IF EXISTS monster;
+    DROP TABLE IF EXISTS dungeon_clear;
     DROP TABLE IF EXISTS dungeon;
     DROP TABLE IF EXISTS world;
 
@@ -35,7 +39,12 @@ with engine.begin() as conn:
         id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
         name TEXT NOT NULL,
         dungeon_capacity INT,
-        guild_capacity INT
+        guild_capacity INT,
+        dungeon_count INT NOT NULL DEFAULT 0,
+        guild_count INT NOT NULL DEFAULT 0,
+        tick BIGINT NOT NULL DEFAULT 0,
+        last_tick_at TIMESTAMP WITH TIME ZONE,
+        tick_after_id BIGINT
     );
 
     CREATE TABLE dungeon (
@@ -46,7 +55,8 @@ with engine.begin() as conn:
         level INT,
         gold_reward INT,
         world_id BIGINT REFERENCES world(id),
-        status TEXT DEFAULT 'open'
+        status TEXT DEFAULT 'open',
+        monster_count INT NOT NULL DEFAULT 0
     );
 
     CREATE TABLE monster (
@@ -58,6 +68,13 @@ with engine.begin() as conn:
         dungeon_id BIGINT REFERENCES dungeon(id)
     );
 
+    CREATE TABLE dungeon_clear (
+        dungeon_id BIGINT PRIMARY KEY REFERENCES dungeon(id) ON DELETE CASCADE,
+        clear_at TIMESTAMPTZ NOT NULL
+    );
+
+    CREATE INDEX dungeon_clear_clear_at_idx ON dungeon_clear (clear_at);
+
     CREATE TABLE guild (
         id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
         name TEXT NOT NULL,
@@ -90,13 +107,21 @@ with engine.begin() as conn:
         notes TEXT
     );
 
+    CREATE UNIQUE INDEX recruitment_pending_hero_guild_idx ON recruitment (hero_id, guild_id) WHERE status = 'pending';
+    CREATE INDEX recruitment_pending_request_date_idx ON recruitment (request_date) WHERE status = 'pending';
+    CREATE INDEX recruitment_answered_response_date_idx ON recruitment (response_date) WHERE status <> 'pending';
+
     CREATE TABLE targeting (
-        id SERIAL PRIMARY KEY,
-        hero_id INT REFERENCES hero(id),
-        monster_id INT REFERENCES monster(id),
+        id BIGSERIAL,
+        hero_id BIGINT REFERENCES hero(id),
+        monster_id BIGINT REFERENCES monster(id),
         damage INT NOT NULL DEFAULT 0,
-        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+
+    CREATE TABLE targeting_default PARTITION OF targeting DEFAULT;
+    CREATE INDEX targeting_hero_id_idx ON targeting (hero_id);
     """))
 
 # Generate fake data
@@ -207,6 +232,92 @@ with engine.begin() as conn:
     VALUES (:hero_id, :monster_id, :damage, :timestamp)
     """), targetings)
 
+# Build the maintained leaderboard aggregates and capacity counters
+with engine.begin() as conn:
+    conn.execute(sqlalchemy.text("""
+    CREATE INDEX monster_dungeon_id_idx ON monster (dungeon_id);
+    CREATE INDEX hero_dungeon_id_idx ON hero (dungeon_id);
+    CREATE INDEX hero_unguilded_world_id_idx ON hero (world_id, id) WHERE guild_id IS NULL;
+    CREATE INDEX hero_guild_id_idx ON hero (guild_id);
+    CREATE INDEX hero_world_id_idx ON hero (world_id, id);
+
+    CREATE TABLE guild_stats (
+        guild_id BIGINT PRIMARY KEY REFERENCES guild(id) ON DELETE CASCADE,
+        world_id BIGINT REFERENCES world(id),
+        gold INT NOT NULL DEFAULT 0,
+        hero_count INT NOT NULL DEFAULT 0,
+        power_sum BIGINT NOT NULL DEFAULT 0,
+        avg_hero_power NUMERIC GENERATED ALWAYS AS (
+            CASE WHEN hero_count > 0 THEN power_sum::NUMERIC / hero_count ELSE 0 END
+        ) STORED
+    );
+
+    CREATE INDEX guild_stats_rank_idx ON guild_stats (gold DESC, avg_hero_power DESC, hero_count DESC, guild_id DESC);
+    CREATE INDEX guild_stats_world_rank_idx ON guild_stats (world_id, gold DESC, avg_hero_power DESC, hero_count DESC, guild_id DESC);
+
+    INSERT INTO guild_stats (guild_id, world_id, gold, hero_count, power_sum)
+    SELECT g.id, g.world_id, COALESCE(g.gold, 0), COUNT(h.id), COALESCE(SUM(h.power), 0)
+    FROM guild g
+    LEFT JOIN hero h ON h.guild_id = g.id
+    GROUP BY g.id, g.world_id, g.gold;
+
+    UPDATE world w
+    SET dungeon_count = (SELECT COUNT(*) FROM dungeon d WHERE d.world_id = w.id),
+        guild_count = (SELECT COUNT(*) FROM guild g WHERE g.world_id = w.id);
+
+    UPDATE dungeon d
+    SET monster_count = c.monsters
+    FROM (SELECT dungeon_id, COUNT(*) AS monsters FROM monster WHERE health > 0 GROUP BY dungeon_id) c
+    WHERE c.dungeon_id = d.id;
+
+    CREATE INDEX dungeon_spawnable_idx ON dungeon (id) WHERE status = 'open' AND monster_count < monster_capacity;
+    """))
+
+# Split the targeting log into monthly partitions (ensure_targeting_partition
+# comes from the targeting partitions migration) and build its rollup
+with engine.begin() as conn:
+    conn.execute(sqlalchemy.text("""
+    SELECT ensure_targeting_partition(CAST(month AS DATE))
+    FROM generate_series(
+        date_trunc('month', (SELECT MIN(timestamp) FROM targeting)),
+        date_trunc('month', LOCALTIMESTAMP) + INTERVAL '3 months',
+        INTERVAL '1 month'
+    ) AS month;
+
+    CREATE TABLE targeting_rollup (
+        hero_id BIGINT REFERENCES hero(id) ON DELETE CASCADE,
+        monster_id BIGINT REFERENCES monster(id) ON DELETE CASCADE,
+        total_damage BIGINT NOT NULL DEFAULT 0,
+        attack_count INT NOT NULL DEFAULT 0,
+        first_attack TIMESTAMP NOT NULL,
+        last_attack TIMESTAMP NOT NULL,
+        defeated BOOLEAN NOT NULL DEFAULT FALSE,
+        PRIMARY KEY (hero_id, monster_id)
+    );
+
+    CREATE INDEX targeting_rollup_hero_recent_idx ON targeting_rollup (hero_id, last_attack DESC, monster_id DESC);
+    CREATE INDEX targeting_rollup_monster_id_idx ON targeting_rollup (monster_id);
+
+    INSERT INTO targeting_rollup (hero_id, monster_id, total_damage, attack_count, first_attack, last_attack, defeated)
+    SELECT t.hero_id, t.monster_id, SUM(t.damage), COUNT(*), MIN(t.timestamp), MAX(t.timestamp), BOOL_OR(m.health <= 0)
+    FROM targeting t
+    JOIN monster m ON m.id = t.monster_id
+    GROUP BY t.hero_id, t.monster_id;
+
+    CREATE TABLE hero_battle_summary (
+        hero_id BIGINT PRIMARY KEY REFERENCES hero(id) ON DELETE CASCADE,
+        total_battles INT NOT NULL DEFAULT 0,
+        monsters_defeated INT NOT NULL DEFAULT 0,
+        total_damage BIGINT NOT NULL DEFAULT 0,
+        last_battle TIMESTAMP NOT NULL
+    );
+
+    INSERT INTO hero_battle_summary (hero_id, total_battles, monsters_defeated, total_damage, last_battle)
+    SELECT hero_id, COUNT(*), COUNT(*) FILTER (WHERE defeated), SUM(total_damage), MAX(last_attack)
+    FROM targeting_rollup
+    GROUP BY hero_id;
+    """))
+
 # Output total rows generated
 print("Data generation completed:")
 print(f"Worlds: {num_worlds}")
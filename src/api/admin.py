@@ -0,0 +1,213 @@
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from typing import Optional
+from src.api import auth
+from src import background
+from src import cache
+from src import slow_queries
+from src import targeting_log
+from src import database as db
+from src import profiling
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(auth.get_api_key)],
+    route_class=profiling.ProfiledRoute,
+)
+
+# Models
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    coalesced: int
+    entries: int
+    in_flight: int
+
+class TargetingLogStats(BaseModel):
+    mode: str
+    buffered_rows: int
+    reserved_rows: int
+    rows_flushed: int
+    flushes: int
+    flush_failures: int
+    sync_fallbacks: int
+    rows_dropped: int
+
+class HistogramSnapshot(BaseModel):
+    buckets: dict[str, int]
+    count: int
+    sum: float
+
+class PoolStats(BaseModel):
+    size: int
+    max_overflow: int
+    timeout: float
+    recycle: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    checkout_timeouts: int
+    pre_ping_failures: int
+    checkout_wait_seconds: HistogramSnapshot
+
+class ReplicaStats(BaseModel):
+    configured: bool
+    usable: bool
+    lag_seconds: Optional[float]
+    max_lag_seconds: float
+    replica_reads: int
+    primary_reads: int
+    failures: int
+
+class PartitionMaintenanceResponse(BaseModel):
+    created: list[str]
+    dropped: list[str]
+
+class SlowQuery(BaseModel):
+    logged_at: str
+    route: str
+    duration_seconds: float
+    statement: str
+    fingerprint: str
+    parameters: str
+    plan: Optional[str]
+    plan_error: Optional[str]
+
+class SlowQueryLog(BaseModel):
+    threshold_seconds: float
+    explain_sample: float
+    captured: int
+    explained: int
+    explain_dropped: int
+    queries: list[SlowQuery]
+
+class RouteProfile(BaseModel):
+    method: str
+    route: str
+    requests: int
+    file: str
+
+class JobStats(BaseModel):
+    name: str
+    interval_seconds: float
+    running: bool
+    runs: int
+    failures: int
+    last_started: Optional[float]
+    last_duration_seconds: Optional[float]
+    last_result: Optional[dict]
+    last_error: Optional[str]
+
+MAX_SLOW_QUERIES_LIMIT = 200
+
+# Endpoints
+
+@router.get("/cache", response_model=CacheStats)
+def cache_stats():
+    """
+    Get hit, miss and coalesced counters for the read endpoint cache.
+
+    Returns:
+        CacheStats: The current cache counters.
+    """
+    return CacheStats(**cache.read_cache.stats())
+
+@router.get("/targeting_log", response_model=TargetingLogStats)
+def targeting_log_stats():
+    """
+    Get the state of the targeting log write-behind buffer.
+
+    Returns:
+        TargetingLogStats: Buffer occupancy and flush counters.
+    """
+    return TargetingLogStats(**targeting_log.buffer.stats())
+
+@router.get("/pool", response_model=dict[str, PoolStats])
+def pool_stats():
+    """
+    Get the occupancy and checkout metrics of each database connection pool.
+
+    Returns:
+        dict[str, PoolStats]: Pool stats keyed by pool name.
+    """
+    return {name: PoolStats(**status) for name, status in db.pool_statuses().items()}
+
+@router.get("/replica", response_model=ReplicaStats)
+def replica_stats():
+    """
+    Get the read replica's routing state and last measured replication lag.
+
+    Returns:
+        ReplicaStats: Whether reads currently go to the replica, and how many went where.
+    """
+    return ReplicaStats(**db.replica_router.stats())
+
+@router.post("/targeting_log/partitions", response_model=PartitionMaintenanceResponse)
+def maintain_targeting_partitions():
+    """
+    Create upcoming monthly targeting partitions and drop the ones past retention.
+
+    Returns:
+        PartitionMaintenanceResponse: The partitions created and dropped.
+    """
+    created, dropped = targeting_log.maintain_partitions()
+    return PartitionMaintenanceResponse(created=created, dropped=dropped)
+
+@router.get("/slow_queries", response_model=SlowQueryLog)
+def get_slow_queries(limit: int = 50):
+    """
+    Get the most recent statements that ran longer than SLOW_QUERY_SECONDS.
+
+    Args:
+        limit (int): The number of statements to return, newest first.
+
+    Returns:
+        SlowQueryLog: Capture counters and the captured statements, with a plan for the sampled ones.
+    """
+    if limit < 1 or limit > MAX_SLOW_QUERIES_LIMIT:
+        raise HTTPException(status_code=400, detail="Invalid Limit")
+    return SlowQueryLog(**slow_queries.log.stats(), queries=slow_queries.log.entries(limit))
+
+@router.post("/profiles", response_model=list[RouteProfile])
+def dump_profiles():
+    """
+    Write the aggregated cProfile stats of each profiled route to PROFILE_DIR.
+
+    Returns:
+        list[RouteProfile]: The pstats file written for each route.
+    """
+    return [RouteProfile(**dump) for dump in profiling.profiles.dump()]
+
+@router.get("/jobs", response_model=list[JobStats])
+def job_stats():
+    """
+    Get the schedule and last outcome of each background job.
+
+    Returns:
+        list[JobStats]: One entry per registered job.
+    """
+    return [JobStats(**job.stats()) for job in background.jobs.values()]
+
+@router.post("/jobs/{name}", response_model=JobStats)
+def run_job(name: str):
+    """
+    Run a background job now, outside its schedule.
+
+    Args:
+        name (str): The name of the job.
+
+    Returns:
+        JobStats: The job's stats after this run.
+
+    Raises:
+        HTTPException: If there is no such job, or it is already running.
+    """
+    job = background.jobs.get(name)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    try:
+        job.run_once()
+    except background.JobAlreadyRunning:
+        raise HTTPException(status_code=409, detail="Job is already running")
+    return JobStats(**job.stats())
@@ -3,12 +3,17 @@ from pydantic import BaseModel
 from src.api import auth
 import sqlalchemy
 from src import database as db
+from src import cache
+from src import battle
+from src import targeting_log
+from src import profiling
 from typing import List
 
 router = APIRouter(
     prefix="/dungeon",
     tags=["dungeon"],
     dependencies=[Depends(auth.get_api_key)],
+    route_class=profiling.ProfiledRoute,
 )
 
 # Models
@@ -35,11 +40,36 @@ class SuccessResponse(BaseModel):
     success: bool
     message: str = None
 
+class CreateMonstersResponse(SuccessResponse):
+    monster_ids: list[int] = []
+
 class GoldResponse(BaseModel):
     success: bool
     gold: int = None
     message: str = None
 
+class CombatAction(BaseModel):
+    attacker_type: str
+    attacker_id: int
+    target_id: int
+
+class CombatantHealth(BaseModel):
+    id: int
+    health: int
+
+class CombatRoundResponse(BaseModel):
+    success: bool
+    hero_attacks: int
+    monster_attacks: int
+    monsters: list[CombatantHealth]
+    heroes: list[CombatantHealth]
+
+class AutoResolveResponse(BaseModel):
+    success: bool
+    rounds: int
+    heroes_remaining: int
+    monsters_remaining: int
+
 # Endpoints
 
 @router.post("/create_dungeon/{world_id}", response_model=SuccessResponse)
@@ -66,21 +96,18 @@ def create_dungeon(world_id: int, dungeon: Dungeon):
     if world_id < 0:
         raise HTTPException(status_code = 400, detail = "Invalid World Id")
         
+    # Taking the slot locks the world row, and the capacity check is
+    # re-evaluated against any concurrent insert's count
     sql_to_execute = """
-    WITH dungeon_count AS (
-        SELECT COUNT(*) AS current_dungeon_count
-        FROM dungeon
-        WHERE world_id = :world_id
-    ),
-    capacity_check AS (
-        SELECT dungeon_capacity
-        FROM world
-        WHERE id = :world_id
+    WITH slot AS (
+        UPDATE world
+        SET dungeon_count = dungeon_count + 1
+        WHERE id = :world_id AND dungeon_count < dungeon_capacity
+        RETURNING id
     )
     INSERT INTO dungeon (name, level, party_capacity, monster_capacity, gold_reward, world_id)
-    SELECT :name, :level, :player_capacity, :monster_capacity, :reward, :world_id
-    FROM dungeon_count, capacity_check
-    WHERE dungeon_count.current_dungeon_count < capacity_check.dungeon_capacity
+    SELECT :name, :level, :player_capacity, :monster_capacity, :reward, slot.id
+    FROM slot
     RETURNING id
     """
 
@@ -101,66 +128,79 @@ def create_dungeon(world_id: int, dungeon: Dungeon):
         except sqlalchemy.exc.IntegrityError:
             raise HTTPException(status_code = 400, detail = "Dungeon name must be unique within specified world")
 
-@router.post("/create_monster/{dungeon_id}", response_model=SuccessResponse)
+@router.post("/create_monster/{dungeon_id}", response_model=CreateMonstersResponse)
 def create_monster(dungeon_id: int, monsters: List[Monster]):
     """
     Create new monsters in a specific dungeon.
 
+    Monsters are admitted in request order until the dungeon reaches its
+    monster capacity, and the rest are not created.
+
     Args:
         dungeon_id (int): The ID of the dungeon where the monsters will be created.
         monsters (List[Monster]): The list of monsters to be created.
 
     Returns:
-        SuccessResponse: Indicates whether the monsters creation was successful.
-    """
-
-    sql_to_execute = """
-    WITH monster_count AS (
-        SELECT COUNT(*) AS current_monster_count
-        FROM monster
-        WHERE dungeon_id = :dungeon_id
-    ),
-    capacity_check AS (
-        SELECT monster_capacity
-        FROM dungeon
-        WHERE id = :dungeon_id
-    )
-    INSERT INTO monster (type, health, dungeon_id, power, level)
-    SELECT :type, :health, :dungeon_id, :power, :level
-    FROM monster_count, capacity_check
-    WHERE monster_count.current_monster_count < capacity_check.monster_capacity;
+        CreateMonstersResponse: The IDs of the monsters created, in request order.
     """
 
     # Validate input
+    if dungeon_id < 0:
+        raise HTTPException(status_code = 400, detail = "Invalid Dungeon Id")
     for monster in monsters:
         if monster.health < 0:
             raise HTTPException(status_code = 400, detail = "Invalid Monster Health")
-        if dungeon_id < 0:
-            raise HTTPException(status_code = 400, detail = "Invalid Dungeon Id")
         if monster.power < 0:
             raise HTTPException(status_code = 400, detail = "Invalid Monster Power")
         if monster.level < 0:
             raise HTTPException(status_code = 400, detail = "Invalid Monster Level")
 
-    # Execute the query once with multiple rows
     with db.engine.begin() as connection:
-        result = connection.execute(sqlalchemy.text(sql_to_execute), [
-            {
-                "type": monster.type,
-                "health": monster.health,
-                "dungeon_id": dungeon_id,
-                "power": monster.power,
-                "level": monster.level
-            }
-            for monster in monsters
-        ])
-        
-        # Check if any rows were affected
-        if result.rowcount > 0:
-            return SuccessResponse(success=True, message="Monsters created successfully")
-        else:
+        # Concurrent spawns into the same dungeon wait here for the count
+        # the previous one left behind
+        free = connection.execute(sqlalchemy.text("""
+            SELECT monster_capacity - monster_count FROM dungeon WHERE id = :dungeon_id FOR UPDATE
+        """), {"dungeon_id": dungeon_id}).scalar_one_or_none()
+        if free is None:
             raise HTTPException(status_code = 400, detail = "Failed to create monsters")
 
+        # Admits monsters in request order until the dungeon is full
+        monster_ids = connection.execute(sqlalchemy.text("""
+            WITH new_monsters AS (
+                INSERT INTO monster (type, health, dungeon_id, power, level)
+                SELECT m.type, m.health, :dungeon_id, m.power, m.level
+                FROM unnest(
+                    CAST(:types AS TEXT[]), CAST(:healths AS INT[]), CAST(:powers AS INT[]), CAST(:levels AS INT[])
+                ) WITH ORDINALITY AS m(type, health, power, level, n)
+                WHERE m.n <= :free
+                ORDER BY m.n
+                RETURNING id, health
+            ),
+            counted AS (
+                UPDATE dungeon
+                SET monster_count = monster_count + (SELECT COUNT(*) FROM new_monsters WHERE health > 0)
+                WHERE id = :dungeon_id
+            )
+            SELECT id FROM new_monsters
+        """), {
+            "dungeon_id": dungeon_id,
+            "free": free,
+            "types": [monster.type for monster in monsters],
+            "healths": [monster.health for monster in monsters],
+            "powers": [monster.power for monster in monsters],
+            "levels": [monster.level for monster in monsters],
+        }).scalars().all()
+
+    if not monster_ids:
+        raise HTTPException(status_code = 400, detail = "Failed to create monsters")
+    # Identity values are assigned in insertion order, so this is request order
+    monster_ids.sort()
+    return CreateMonstersResponse(
+        success=True,
+        message=f"Created {len(monster_ids)} of {len(monsters)} monsters",
+        monster_ids=monster_ids,
+    )
+
 @router.post("/collect_bounty/{guild_id}", response_model=GoldResponse)
 def collect_bounty(guild_id: int, dungeon_id: int):
     """
@@ -174,18 +214,26 @@ def collect_bounty(guild_id: int, dungeon_id: int):
         GoldResponse: Indicates whether the bounty collection was successful.
 
     Raises:
-        HTTPException: If the dungeon status is not completed or attempting to collect bounty from a completed/open dungeon.
+        HTTPException: If the dungeon status is not completed, attempting to collect bounty from a completed/open dungeon,
+            or the party sent to it has not finished clearing it.
     """
 
-    # Check if the dungeon status is completed
+    # Check if the dungeon status is completed and no party is still clearing it
     with db.engine.begin() as connection:
-        dungeon_status = connection.execute(
-            sqlalchemy.text("SELECT status FROM dungeon WHERE id = :dungeon_id FOR UPDATE"),
+        dungeon = connection.execute(
+            sqlalchemy.text("""
+            SELECT status, EXISTS (SELECT 1 FROM dungeon_clear WHERE dungeon_id = :dungeon_id) AS clearing
+            FROM dungeon
+            WHERE id = :dungeon_id
+            FOR UPDATE
+            """),
             {"dungeon_id": dungeon_id}
-        ).scalar()
+        ).fetchone()
 
-    if dungeon_status == "completed" or dungeon_status == "open":
+    if dungeon is None or dungeon.status == "completed" or dungeon.status == "open":
         raise HTTPException(status_code=400, detail="Cannot collect bounty from a completed or open dungeon")
+    if dungeon.clearing:
+        raise HTTPException(status_code=400, detail="Party has not finished clearing the dungeon")
 
     # Proceed with the bounty collection if the dungeon status is not completed
     sql_to_execute = sqlalchemy.text("""
@@ -199,7 +247,13 @@ def collect_bounty(guild_id: int, dungeon_id: int):
         SET gold = gold + (SELECT gold_reward FROM dungeon WHERE id = :dungeon_id)
         WHERE id = :guild_id
         AND (SELECT count FROM monster_count) = 0
-        RETURNING gold
+        RETURNING id, gold
+    ),
+    stats_update AS (
+        UPDATE guild_stats
+        SET gold = guild_update.gold
+        FROM guild_update
+        WHERE guild_stats.guild_id = guild_update.id
     ),
     dungeon_update AS (
         UPDATE dungeon
@@ -214,16 +268,17 @@ def collect_bounty(guild_id: int, dungeon_id: int):
         WHERE dungeon_id = :dungeon_id AND health > 0
         RETURNING id
     )
-    SELECT * FROM guild_update;
+    SELECT gold FROM guild_update;
     """)
 
     with db.engine.begin() as connection:
         result = connection.execute(sql_to_execute, {"dungeon_id": dungeon_id, "guild_id": guild_id})
-        if result.rowcount > 0:
-            gold = result.fetchone()[0]
-            return GoldResponse(success=True, gold=gold, message="Bounty collected successfully")
-        else:
+        if result.rowcount == 0:
             raise HTTPException(status_code=400, detail="Cannot collect bounty")
+        gold = result.fetchone()[0]
+
+    cache.invalidate("leaderboard")
+    return GoldResponse(success=True, gold=gold, message="Bounty collected successfully")
 
 
 @router.get("/assess_damage/{dungeon_id}", response_model=list[Hero])
@@ -251,3 +306,130 @@ def assess_damage(guild_id: int, dungeon_id: int):
         Hero(hero_name=hero.name, level=hero.level, power=hero.power, health=hero.health)
         for hero in heroes
     ]
+
+@router.post("/{dungeon_id}/combat_round", response_model=CombatRoundResponse)
+def combat_round(dungeon_id: int, actions: List[CombatAction]):
+    """
+    Resolve a round of attacks between a party and the monsters of a dungeon.
+
+    Every attack in the round uses the health and power of the combatants at
+    the start of the round, so actions resolve simultaneously. Attacks by or
+    on combatants that are dead or not in the dungeon are skipped.
+
+    Args:
+        dungeon_id (int): The ID of the dungeon where the round is fought.
+        actions (List[CombatAction]): The attacks, each with an attacker_type
+            of "hero" (targeting a monster) or "monster" (targeting a hero).
+
+    Returns:
+        CombatRoundResponse: The attacks applied and the new health of every combatant hit.
+    """
+
+    hero_attacks = [action for action in actions if action.attacker_type == "hero"]
+    monster_attacks = [action for action in actions if action.attacker_type == "monster"]
+    if len(hero_attacks) + len(monster_attacks) != len(actions):
+        raise HTTPException(status_code = 400, detail = "Invalid Attacker Type")
+
+    sql_to_execute = sqlalchemy.text("""
+    WITH hero_actions AS (
+        SELECT *
+        FROM unnest(CAST(:hero_ids AS BIGINT[]), CAST(:hero_targets AS BIGINT[])) AS a(hero_id, monster_id)
+    ),
+    monster_actions AS (
+        SELECT *
+        FROM unnest(CAST(:monster_ids AS BIGINT[]), CAST(:monster_targets AS BIGINT[])) AS a(monster_id, hero_id)
+    ),
+    hero_hits AS (
+        SELECT a.hero_id, a.monster_id, h.power AS damage
+        FROM hero_actions a
+        JOIN hero h ON h.id = a.hero_id AND h.dungeon_id = :dungeon_id AND h.health > 0
+        JOIN monster m ON m.id = a.monster_id AND m.dungeon_id = :dungeon_id AND m.health > 0
+    ),
+    monster_hits AS (
+        SELECT a.hero_id, a.monster_id, m.power AS damage
+        FROM monster_actions a
+        JOIN monster m ON m.id = a.monster_id AND m.dungeon_id = :dungeon_id AND m.health > 0
+        JOIN hero h ON h.id = a.hero_id AND h.dungeon_id = :dungeon_id AND h.health > 0
+    ),
+    monster_update AS (
+        UPDATE monster
+        SET health = monster.health - hits.damage
+        FROM (SELECT monster_id, SUM(damage) AS damage FROM hero_hits GROUP BY monster_id) AS hits
+        WHERE monster.id = hits.monster_id
+        RETURNING monster.id, monster.health
+    ),
+    monster_deaths AS (
+        UPDATE dungeon
+        SET monster_count = monster_count - (SELECT COUNT(*) FROM monster_update WHERE health <= 0)
+        WHERE id = :dungeon_id
+    ),
+    hero_update AS (
+        UPDATE hero
+        SET health = hero.health - hits.damage
+        FROM (SELECT hero_id, SUM(damage) AS damage FROM monster_hits GROUP BY hero_id) AS hits
+        WHERE hero.id = hits.hero_id
+        RETURNING hero.id, hero.health
+    )
+    SELECT 'hero_hit' AS kind, hero_id, monster_id, damage, CAST(NULL AS INT) AS health FROM hero_hits
+    UNION ALL
+    SELECT 'monster_hit' AS kind, hero_id, monster_id, 0 AS damage, NULL AS health FROM monster_hits
+    UNION ALL
+    SELECT 'monster' AS kind, NULL AS hero_id, id AS monster_id, NULL AS damage, health FROM monster_update
+    UNION ALL
+    SELECT 'hero' AS kind, id AS hero_id, NULL AS monster_id, NULL AS damage, health FROM hero_update
+    """)
+
+    with db.engine.begin() as connection:
+        # Serialize rounds per dungeon so concurrent rounds cannot deadlock on combatant rows
+        dungeon = connection.execute(
+            sqlalchemy.text("SELECT id FROM dungeon WHERE id = :dungeon_id FOR UPDATE"),
+            {"dungeon_id": dungeon_id}
+        ).fetchone()
+        if not dungeon:
+            raise HTTPException(status_code = 404, detail = "Dungeon not found")
+
+        rows = connection.execute(sql_to_execute, {
+            "dungeon_id": dungeon_id,
+            "hero_ids": [action.attacker_id for action in hero_attacks],
+            "hero_targets": [action.target_id for action in hero_attacks],
+            "monster_ids": [action.attacker_id for action in monster_attacks],
+            "monster_targets": [action.target_id for action in monster_attacks]
+        }).fetchall()
+
+        hits = [row for row in rows if row.kind in ("hero_hit", "monster_hit")]
+        targeting_log.record(
+            connection,
+            [row.hero_id for row in hits],
+            [row.monster_id for row in hits],
+            [row.damage for row in hits]
+        )
+
+    return CombatRoundResponse(
+        success=len(hits) > 0,
+        hero_attacks=sum(1 for row in hits if row.kind == "hero_hit"),
+        monster_attacks=sum(1 for row in hits if row.kind == "monster_hit"),
+        monsters=[CombatantHealth(id=row.monster_id, health=row.health) for row in rows if row.kind == "monster"],
+        heroes=[CombatantHealth(id=row.hero_id, health=row.health) for row in rows if row.kind == "hero"]
+    )
+
+@router.post("/{dungeon_id}/auto_resolve", response_model=AutoResolveResponse)
+def auto_resolve(dungeon_id: int):
+    """
+    Simulate the battle in a dungeon on the server until the party or the monsters are wiped out.
+
+    Args:
+        dungeon_id (int): The ID of the dungeon to resolve.
+
+    Returns:
+        AutoResolveResponse: The rounds fought and the heroes and monsters left standing.
+            success is true when every monster was defeated.
+    """
+
+    with db.engine.begin() as connection:
+        results = battle.resolve_dungeons(connection, [dungeon_id])
+
+    if dungeon_id not in results:
+        raise HTTPException(status_code = 404, detail = "Dungeon not found")
+
+    result = results[dungeon_id]
+    return AutoResolveResponse(success=result["monsters_remaining"] == 0, **result)
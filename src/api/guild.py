@@ -1,20 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from src.api import auth
 import sqlalchemy
 from src import database as db
+from src import cache
+from src import dungeon_clear
+from src import streaming
+from src import profiling
 from sqlalchemy.exc import IntegrityError
+from typing import Optional
 
 router = APIRouter(
     prefix="/guild",
     tags=["guild"],
     dependencies=[Depends(auth.get_api_key)],
+    route_class=profiling.ProfiledRoute,
 )
 
 # Models
 class Hero(BaseModel):
     hero_name: str
 
+class RecruitHeroes(BaseModel):
+    hero_names: list[str] = []
+    hero_ids: list[int] = []
+
+class RecruitResult(BaseModel):
+    hero_id: Optional[int]
+    hero_name: Optional[str]
+    status: str
+
+class RecruitHeroesResponse(BaseModel):
+    invited: int
+    results: list[RecruitResult]
+
 class Guild(BaseModel):
     guild_name: str
     max_capacity: int
@@ -41,6 +60,86 @@ class LeaderboardEntry(BaseModel):
 class LeaderboardResponse(BaseModel):
     status: str
     leaderboard: list[LeaderboardEntry]
+    next_cursor: Optional[int] = None
+
+class GuildRankResponse(BaseModel):
+    status: str
+    guild_id: int
+    world_id: int
+    rank: int
+    leaderboard: list[LeaderboardEntry]
+
+MAX_LEADERBOARD_LIMIT = 1000
+MAX_RECRUIT_HEROES = 1000
+
+# Ranks a contiguous slice of the leaderboard ordering, provided by the caller
+# as a "leaderboard_slice" CTE. Rows tied with the first row of the slice share
+# its rank; every other row is ranked by the number of guilds ahead of the
+# slice plus its rank within the slice, so only two index-only counts are
+# needed no matter how deep the slice is.
+sql_rank_slice = """
+slice_ranked AS (
+    SELECT
+        *,
+        RANK() OVER (ORDER BY gold DESC, avg_hero_power DESC, hero_count DESC) AS slice_rank
+    FROM leaderboard_slice
+),
+slice_first AS (
+    SELECT gold, avg_hero_power, hero_count, guild_id
+    FROM leaderboard_slice
+    ORDER BY gold DESC, avg_hero_power DESC, hero_count DESC, guild_id DESC
+    LIMIT 1
+),
+ahead AS (
+    SELECT
+        (SELECT COUNT(*) FROM guild_stats s
+         WHERE (:world_id IS NULL OR s.world_id = :world_id)
+         AND (s.gold, s.avg_hero_power, s.hero_count) >
+             (SELECT gold, avg_hero_power, hero_count FROM slice_first)) AS tied_rank,
+        (SELECT COUNT(*) FROM guild_stats s
+         WHERE (:world_id IS NULL OR s.world_id = :world_id)
+         AND (s.gold, s.avg_hero_power, s.hero_count, s.guild_id) >
+             (SELECT gold, avg_hero_power, hero_count, guild_id FROM slice_first)) AS rows_ahead
+)
+SELECT
+    r.guild_id,
+    g.name AS guild_name,
+    r.gold AS guild_gold,
+    r.hero_count,
+    r.avg_hero_power,
+    CASE
+        WHEN (r.gold, r.avg_hero_power, r.hero_count) = (f.gold, f.avg_hero_power, f.hero_count)
+        THEN a.tied_rank + 1
+        ELSE a.rows_ahead + r.slice_rank
+    END AS rank
+FROM slice_ranked r
+JOIN guild g ON g.id = r.guild_id
+CROSS JOIN slice_first f
+CROSS JOIN ahead a
+ORDER BY r.gold DESC, r.avg_hero_power DESC, r.hero_count DESC, r.guild_id DESC;
+"""
+
+sql_leaderboard_page = """
+WITH leaderboard_slice AS (
+    SELECT s.guild_id, s.gold, s.avg_hero_power, s.hero_count
+    FROM guild_stats s
+    WHERE (:world_id IS NULL OR s.world_id = :world_id)
+    AND (:after_guild_id IS NULL OR (s.gold, s.avg_hero_power, s.hero_count, s.guild_id) <
+        (SELECT gold, avg_hero_power, hero_count, guild_id FROM guild_stats WHERE guild_id = :after_guild_id))
+    ORDER BY s.gold DESC, s.avg_hero_power DESC, s.hero_count DESC, s.guild_id DESC
+    LIMIT :limit
+),
+""" + sql_rank_slice
+
+def to_leaderboard_entry(row):
+    return LeaderboardEntry(
+        rank=row.rank,
+        guild_id=row.guild_id,
+        guild_name=row.guild_name,
+        guild_gold=row.guild_gold,
+        hero_count=row.hero_count,
+        avg_hero_power=row.avg_hero_power
+    )
 
 # Endpoints
 
@@ -65,23 +164,26 @@ def create_guild(world_id: int, guild: Guild):
     if guild.gold < 0:
         raise HTTPException(status_code=400, detail="Invalid Gold")
 
-    # Query to check guild capacity and insert guild
+    # Query to take a guild slot in the world and insert guild
     sql_to_execute = """
-    WITH guild_count AS (
-        SELECT COUNT(*) AS current_guild_count
-        FROM guild
-        WHERE world_id = :world_id
+    WITH slot AS (
+        UPDATE world
+        SET guild_count = guild_count + 1
+        WHERE id = :world_id AND guild_count < guild_capacity
+        RETURNING id
+    ),
+    new_guild AS (
+        INSERT INTO guild (name, player_capacity, gold, world_id)
+        SELECT :name, :max_capacity, :gold, slot.id
+        FROM slot
+        RETURNING id, gold, world_id
     ),
-    capacity_check AS (
-        SELECT guild_capacity
-        FROM world
-        WHERE id = :world_id
+    new_stats AS (
+        INSERT INTO guild_stats (guild_id, world_id, gold)
+        SELECT id, world_id, gold
+        FROM new_guild
     )
-    INSERT INTO guild (name, player_capacity, gold, world_id)
-    SELECT :name, :max_capacity, :gold, :world_id
-    FROM guild_count, capacity_check
-    WHERE guild_count.current_guild_count < capacity_check.guild_capacity
-    RETURNING id;
+    SELECT id FROM new_guild;
     """
 
     with db.engine.begin() as connection:
@@ -95,12 +197,15 @@ def create_guild(world_id: int, guild: Guild):
 
             # Check if guild creation was successful
             if result.rowcount > 0:
-                return SuccessResponse(success=True, message=f"guild id {result.fetchone().id} created")
+                guild_id = result.fetchone().id
             else:
                 return SuccessResponse(success=False, message="Failed to create guild")
         except IntegrityError:
             return HTTPException(status_code=400, detail="Guild name must be unique within specified world")
 
+    cache.invalidate("leaderboard")
+    return SuccessResponse(success=True, message=f"guild id {guild_id} created")
+
 @router.post("/recruit_hero/{guild_id}", response_model=SuccessResponse)
 def recruit_hero(guild_id: int, hero: Hero):
     """
@@ -118,38 +223,115 @@ def recruit_hero(guild_id: int, hero: Hero):
     INSERT INTO recruitment (hero_id, guild_id, status, request_date)
     SELECT id, :guild_id, 'pending', now() 
     FROM hero 
-    WHERE name = :hero_name AND guild_id IS NULL AND world_id = (SELECT world_id FROM guild WHERE id = :guild_id);
+    WHERE name = :hero_name AND guild_id IS NULL AND world_id = (SELECT world_id FROM guild WHERE id = :guild_id)
+    ON CONFLICT (hero_id, guild_id) WHERE status = 'pending' DO NOTHING;
     """)
     with db.engine.begin() as connection:
         result = connection.execute(sql_to_execute, {'hero_name': hero.hero_name, 'guild_id': guild_id})
         if result.rowcount > 0:
             return SuccessResponse(success=True, message=f"Invitation sent to {hero.hero_name} successfully")
         else:
-            raise HTTPException(status_code = 404, detail = "Hero not found or already in guild")
+            raise HTTPException(status_code = 404, detail = "Hero not found, already in guild or already invited")
+
+@router.post("/recruit_heroes/{guild_id}", response_model=RecruitHeroesResponse)
+def recruit_heroes(guild_id: int, recruits: RecruitHeroes):
+    """
+    Invite many heroes to a guild with a single insert.
+
+    Heroes can be given by name, by ID or both. Heroes that already have a
+    pending invite from this guild are skipped.
+
+    Args:
+        guild_id (int): The ID of the guild sending the invites.
+        recruits (RecruitHeroes): The names and IDs of up to MAX_RECRUIT_HEROES heroes.
+
+    Returns:
+        RecruitHeroesResponse: Per-hero results: invited, already_invited or not_eligible.
+    """
+    if not recruits.hero_names and not recruits.hero_ids:
+        raise HTTPException(status_code=400, detail="No Heroes Given")
+    if len(recruits.hero_names) + len(recruits.hero_ids) > MAX_RECRUIT_HEROES:
+        raise HTTPException(status_code=400, detail="Too Many Heroes")
+
+    # Eligible heroes are unguilded and in the guild's world
+    sql_to_execute = sqlalchemy.text("""
+    WITH requested AS (
+        SELECT id, name, guild_id, world_id FROM hero WHERE name = ANY(CAST(:hero_names AS TEXT[]))
+        UNION
+        SELECT id, name, guild_id, world_id FROM hero WHERE id = ANY(CAST(:hero_ids AS BIGINT[]))
+    ),
+    eligible AS (
+        SELECT r.id, r.name
+        FROM requested r
+        JOIN guild g ON g.id = :guild_id AND g.world_id = r.world_id
+        WHERE r.guild_id IS NULL
+    ),
+    invited AS (
+        INSERT INTO recruitment (hero_id, guild_id, status, request_date)
+        SELECT id, :guild_id, 'pending', now()
+        FROM eligible
+        ON CONFLICT (hero_id, guild_id) WHERE status = 'pending' DO NOTHING
+        RETURNING hero_id
+    )
+    SELECT e.id, e.name, i.hero_id IS NOT NULL AS invited
+    FROM eligible e
+    LEFT JOIN invited i ON i.hero_id = e.id
+    ORDER BY e.id
+    """)
+    with db.engine.begin() as connection:
+        if connection.execute(
+            sqlalchemy.text("SELECT 1 FROM guild WHERE id = :guild_id"), {"guild_id": guild_id}
+        ).first() is None:
+            raise HTTPException(status_code=404, detail="Guild not found")
+        rows = connection.execute(sql_to_execute, {
+            "guild_id": guild_id,
+            "hero_names": recruits.hero_names,
+            "hero_ids": recruits.hero_ids,
+        }).all()
+
+    results = [
+        RecruitResult(hero_id=row.id, hero_name=row.name, status="invited" if row.invited else "already_invited")
+        for row in rows
+    ]
+    found_names = {row.name for row in rows}
+    found_ids = {row.id for row in rows}
+    results += [
+        RecruitResult(hero_id=None, hero_name=name, status="not_eligible")
+        for name in dict.fromkeys(recruits.hero_names) if name not in found_names
+    ]
+    results += [
+        RecruitResult(hero_id=hero_id, hero_name=None, status="not_eligible")
+        for hero_id in dict.fromkeys(recruits.hero_ids) if hero_id not in found_ids
+    ]
+    return RecruitHeroesResponse(invited=sum(row.invited for row in rows), results=results)
 
 @router.get("/available_heroes/{guild_id}", response_model=list[HeroDetails])
-def available_heroes(guild_id: int):
+async def available_heroes(request: Request, guild_id: int):
     """
     Get available heroes in a guild.
 
     Args:
+        request (Request): The incoming request, checked for an NDJSON Accept header.
         guild_id (int): The ID of the guild to get available heroes from.
 
     Returns:
         List[HeroDetails]: List of available heroes in the specified guild.
     """
-    with db.engine.begin() as connection:
-        result = connection.execute(
-            sqlalchemy.text("""
-            SELECT name, power, health, level
-            FROM hero
-            WHERE guild_id = :guild_id AND dungeon_id IS NULL
-            """), {"guild_id": guild_id}
-        )
-        heroes = [
-            HeroDetails(hero_name=row['name'], power=row['power'], health=row['health'], level=row['level']) 
-            for row in result.mappings()
-        ]
+    sql_to_execute = """
+    SELECT name, power, health, level
+    FROM hero
+    WHERE guild_id = :guild_id AND dungeon_id IS NULL
+    """
+
+    def to_hero_details(row):
+        return HeroDetails(hero_name=row.name, power=row.power, health=row.health, level=row.level)
+
+    if streaming.wants_ndjson(request):
+        return streaming.stream_rows(sql_to_execute, {"guild_id": guild_id}, to_hero_details)
+
+    async with db.async_engine.begin() as connection:
+        result = await connection.execute(sqlalchemy.text(sql_to_execute), {"guild_id": guild_id})
+        heroes = [to_hero_details(row) for row in result]
     return heroes
 
 @router.post("/remove_dead_heroes/{guild_id}", response_model=SuccessResponse)
@@ -169,20 +351,35 @@ def remove_dead_heroes(guild_id: int, heroes: list[Hero]):
     with db.engine.begin() as connection:
         result = connection.execute(
             sqlalchemy.text("""
-            DELETE FROM hero
-            WHERE name = ANY(:hero_names) AND guild_id = :guild_id AND health <= 0
+            WITH removed AS (
+                DELETE FROM hero
+                WHERE name = ANY(:hero_names) AND guild_id = :guild_id AND health <= 0
+                RETURNING power
+            ),
+            stats_update AS (
+                UPDATE guild_stats
+                SET hero_count = hero_count - (SELECT COUNT(*) FROM removed),
+                    power_sum = power_sum - (SELECT COALESCE(SUM(power), 0) FROM removed)
+                WHERE guild_id = :guild_id AND EXISTS (SELECT 1 FROM removed)
+            )
+            SELECT 1 FROM removed
             """), {"hero_names": hero_names, "guild_id": guild_id}
         )
-        if result.rowcount > 0:
-            return SuccessResponse(success=True, message="Dead heroes removed")
-        else:
+        if result.rowcount == 0:
             return SuccessResponse(success=False, message="No dead heroes found")
 
+    cache.invalidate("leaderboard")
+    return SuccessResponse(success=True, message="Dead heroes removed")
+
 @router.post("/send_party/{guild_id}", response_model=SuccessResponse)
 def send_party(guild_id: int, party: list[Hero], dungeon_name: str):
     """
     Send a party of heroes to a dungeon.
 
+    The dungeon is closed and the party clears it after a time that grows
+    with the monsters' health and shrinks with the party's power. The battle
+    is resolved when the time is up, and the bounty can be collected after.
+
     Args:
         guild_id (int): The ID of the guild sending the party.
         party (list[Hero]): The list of heroes in the party.
@@ -199,74 +396,146 @@ def send_party(guild_id: int, party: list[Hero], dungeon_name: str):
         if not guild:
             raise HTTPException(status_code=404, detail="Guild not found")
         
+        # Dungeon names are only unique within a world
+        dungeon_query = sqlalchemy.text("""
+        SELECT id FROM dungeon
+        WHERE name = :dungeon_name AND world_id = :world_id AND status = 'open'
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE
+        """)
+        dungeon_id = connection.execute(dungeon_query, {"dungeon_name": dungeon_name, "world_id": guild.world_id}).scalar_one_or_none()
+        if dungeon_id is None:
+            raise HTTPException(status_code=404, detail="Dungeon not found or not open")
+
         # Update hero dungeon_id
         hero_names = [hero.hero_name for hero in party]
         update_hero = sqlalchemy.text("""
         UPDATE hero
-        SET dungeon_id = (SELECT id FROM dungeon WHERE name = :dungeon_name AND status = 'open')
+        SET dungeon_id = :dungeon_id
         WHERE name IN :hero_names AND guild_id = :guild_id
         """)
-        result = connection.execute(update_hero, {"hero_names": tuple(hero_names), "guild_id": guild_id, "dungeon_name": dungeon_name})
+        result = connection.execute(update_hero, {"hero_names": tuple(hero_names), "guild_id": guild_id, "dungeon_id": dungeon_id})
             
         if result.rowcount > 0:
-            connection.execute(sqlalchemy.text("""
-                                            UPDATE dungeon
-                                            SET status = 'closed'
-                                            WHERE name = :dungeon_name"""),
-                                            {"dungeon_name": dungeon_name})
+            dungeon_clear.schedule(connection, dungeon_id)
             return SuccessResponse(success=True, message="Party sent to dungeon")
         else:
             raise HTTPException(status_code = 404, detail = "Hero not found or already in a dungeon")
 
 @router.get("/leaderboard", response_model=LeaderboardResponse)
-def get_leaderboard():
+def get_leaderboard(request: Request, world_id: int = None, limit: int = 100, after_guild_id: int = None):
     """
-    Get the guild leaderboard.
+    Get a page of the guild leaderboard.
+
+    Rankings are read from the maintained guild_stats table rather than
+    aggregated from heroes on every call, and pages are fetched by keyset so
+    the cost scales with the page size rather than the number of guilds.
+    Clients that accept application/x-ndjson get the entries streamed
+    uncached, and limit is not capped.
+
+    Args:
+        request (Request): The incoming request, checked for an NDJSON Accept header.
+        world_id (int, optional): Only rank guilds in this world.
+        limit (int): The maximum number of guilds to return.
+        after_guild_id (int, optional): The next_cursor of the previous page.
 
     Returns:
-        LeaderboardResponse: The current leaderboard with guild rankings.
+        LeaderboardResponse: A page of the leaderboard with guild rankings.
     """
-    
-    sql_leaderboard = """
-    WITH guild_stats AS (
-        SELECT 
-            g.id AS guild_id,
-            g.name AS guild_name,
-            g.gold AS guild_gold,
-            COUNT(h.id) AS hero_count,
-            COALESCE(AVG(h.power), 0) AS avg_hero_power
-        FROM guild g
-        LEFT JOIN hero h ON g.id = h.guild_id
-        GROUP BY g.id, g.name, g.gold
-    ),
-    ranked_guilds AS (
-        SELECT
-            guild_id,
-            guild_name,
-            guild_gold,
-            hero_count,
-            avg_hero_power,
-            RANK() OVER (ORDER BY guild_gold DESC, avg_hero_power DESC, hero_count DESC) AS rank
-        FROM guild_stats
+
+    stream = streaming.wants_ndjson(request)
+    if limit < 1 or (limit > MAX_LEADERBOARD_LIMIT and not stream):
+        raise HTTPException(status_code=400, detail="Invalid Limit")
+
+    if stream:
+        return streaming.stream_rows(sql_leaderboard_page, {
+            "world_id": world_id,
+            "limit": limit,
+            "after_guild_id": after_guild_id
+        }, to_leaderboard_entry)
+    return leaderboard_page(world_id, limit, after_guild_id)
+
+@cache.cached("leaderboard")
+def leaderboard_page(world_id, limit, after_guild_id):
+    with db.read_connection() as connection:
+        leaderboard = connection.execute(sqlalchemy.text(sql_leaderboard_page), {
+            "world_id": world_id,
+            "limit": limit,
+            "after_guild_id": after_guild_id
+        }).fetchall()
+
+    return LeaderboardResponse(
+        status="success",
+        leaderboard=[to_leaderboard_entry(row) for row in leaderboard],
+        next_cursor=leaderboard[-1].guild_id if len(leaderboard) == limit else None
     )
-    SELECT *
-    FROM ranked_guilds
-    ORDER BY rank;
+
+@router.get("/leaderboard/{guild_id}/rank", response_model=GuildRankResponse)
+@cache.cached("leaderboard")
+def get_guild_rank(guild_id: int, neighbors: int = 5):
     """
-    with db.engine.begin() as connection:
-        leaderboard = connection.execute(sqlalchemy.text(sql_leaderboard)).fetchall()
+    Get the rank of a guild within its world along with the guilds around it.
 
-    return LeaderboardResponse(
+    Args:
+        guild_id (int): The ID of the guild.
+        neighbors (int): The number of guilds to include above and below it.
+
+    Returns:
+        GuildRankResponse: The guild's rank and the surrounding leaderboard slice.
+    """
+
+    if neighbors < 0 or neighbors > MAX_LEADERBOARD_LIMIT:
+        raise HTTPException(status_code=400, detail="Invalid Neighbors")
+
+    sql_neighbors = """
+    WITH target AS (
+        SELECT guild_id, world_id, gold, avg_hero_power, hero_count
+        FROM guild_stats
+        WHERE guild_id = :guild_id
+    ),
+    above AS (
+        SELECT s.guild_id, s.gold, s.avg_hero_power, s.hero_count
+        FROM guild_stats s, target t
+        WHERE s.world_id = t.world_id
+        AND (s.gold, s.avg_hero_power, s.hero_count, s.guild_id) > (t.gold, t.avg_hero_power, t.hero_count, t.guild_id)
+        ORDER BY s.gold, s.avg_hero_power, s.hero_count, s.guild_id
+        LIMIT :neighbors
+    ),
+    below AS (
+        SELECT s.guild_id, s.gold, s.avg_hero_power, s.hero_count
+        FROM guild_stats s, target t
+        WHERE s.world_id = t.world_id
+        AND (s.gold, s.avg_hero_power, s.hero_count, s.guild_id) < (t.gold, t.avg_hero_power, t.hero_count, t.guild_id)
+        ORDER BY s.gold DESC, s.avg_hero_power DESC, s.hero_count DESC, s.guild_id DESC
+        LIMIT :neighbors
+    ),
+    leaderboard_slice AS (
+        SELECT * FROM above
+        UNION ALL
+        SELECT guild_id, gold, avg_hero_power, hero_count FROM target
+        UNION ALL
+        SELECT * FROM below
+    ),
+    """ + sql_rank_slice
+    with db.read_connection() as connection:
+        world_id = connection.execute(
+            sqlalchemy.text("SELECT world_id FROM guild_stats WHERE guild_id = :guild_id"),
+            {"guild_id": guild_id}
+        ).scalar()
+        if world_id is None:
+            raise HTTPException(status_code=404, detail="Guild not found")
+
+        leaderboard = connection.execute(sqlalchemy.text(sql_neighbors), {
+            "guild_id": guild_id,
+            "world_id": world_id,
+            "neighbors": neighbors
+        }).fetchall()
+
+    return GuildRankResponse(
         status="success",
-        leaderboard=[
-            LeaderboardEntry(
-                rank=row.rank,
-                guild_id=row.guild_id,
-                guild_name=row.guild_name,
-                guild_gold=row.guild_gold,
-                hero_count=row.hero_count,
-                avg_hero_power=row.avg_hero_power
-            )
-            for row in leaderboard
-        ]
+        guild_id=guild_id,
+        world_id=world_id,
+        rank=next(row.rank for row in leaderboard if row.guild_id == guild_id),
+        leaderboard=[to_leaderboard_entry(row) for row in leaderboard]
     )
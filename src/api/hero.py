@@ -1,15 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from pydantic import BaseModel
 from src.api import auth
 import sqlalchemy
 from sqlalchemy import func
 from src import database as db
+from src import cache
+from src import targeting_log
+from src import streaming
+from src import profiling
 from typing import Optional
 
 router = APIRouter(
     prefix="/hero",
     tags=["hero"],
     dependencies=[Depends(auth.get_api_key)],
+    route_class=profiling.ProfiledRoute,
 )
 
 # Models
@@ -34,6 +39,13 @@ class Monster(BaseModel):
 class HealthResponse(BaseModel):
     health: int
 
+class HeroStatus(BaseModel):
+    id: int
+    health: int
+    xp: int
+    level: int
+    dungeon_id: Optional[int]
+
 class HeroMonsterInteraction(BaseModel):
     monster_id: int
     monster_type: str
@@ -52,6 +64,7 @@ class HeroMonsterInteractionsResponse(BaseModel):
     monsters_defeated: int
     total_damage_dealt: int
     battle_details: list[HeroMonsterInteraction]
+    next_cursor: Optional[int] = None
 
 class Hero(BaseModel):
     id: int
@@ -63,10 +76,13 @@ class UpdatedHero(BaseModel):
     updated_xp: Optional[int]
     updated_level: Optional[int]
 
+MAX_INTERACTIONS_LIMIT = 500
+MAX_STATUS_HEROES = 1000
+
 # Endpoints
 
 @router.get("/check_xp/{hero_id}", response_model=HeroXP)
-def check_xp(hero_id: int):
+async def check_xp(hero_id: int):
     """
     Check the experience points (XP) of a hero.
 
@@ -77,12 +93,12 @@ def check_xp(hero_id: int):
         HeroXP: The experience points of the hero.
     """
 
-    with db.engine.begin() as connection:
-        xp = connection.execute(sqlalchemy.text("""
+    async with db.async_engine.begin() as connection:
+        xp = (await connection.execute(sqlalchemy.text("""
             SELECT xp
             FROM hero
             WHERE id = :hero_id
-        """), {"hero_id": hero_id}).scalar_one()
+        """), {"hero_id": hero_id})).scalar_one()
     return {"xp": xp}
 
 @router.post("/raise_level/{hero_id}", response_model=SuccessResponse)
@@ -141,7 +157,7 @@ def raise_level(hero_id: int):
 @router.get("/view_pending_requests/{hero_id}", response_model=list[PendingRequest])
 def view_pending_requests(hero_id: int):
     """
-    View pending requests for a hero.
+    View pending requests for a hero, richest guild first.
 
     Args:
         hero_id (int): The ID of the hero.
@@ -155,58 +171,127 @@ def view_pending_requests(hero_id: int):
             SELECT name, gold 
             FROM recruitment 
             JOIN guild ON recruitment.guild_id = guild.id 
-            WHERE recruitment.hero_id = :id
+            WHERE recruitment.hero_id = :id AND recruitment.status = 'pending'
+            ORDER BY guild.gold DESC, recruitment.request_date
         """), {"id": hero_id})
         for request in recruit:
             requests.append({"guild_name": request.name, "gold": request.gold})
     return requests
 
-@router.post("/accept_request/{hero_id}", response_model=SuccessResponse)
-def accept_request(hero_id: int, guild_name: str):
+def join_guild(connection, guild_info_sql, params):
     """
-    Accept a pending request for a hero to join a guild.
+    Move a hero into the guild chosen by `guild_info_sql`, and answer all of its pending invites.
+
+    The invite from that guild is accepted and every other pending invite
+    is rejected in the same statement.
 
     Args:
-        hero_id (int): The ID of the hero.
-        guild_name (str): The name of the guild.
+        connection: The connection to run on, inside the caller's transaction.
+        guild_info_sql (str): A query for the chosen guild's guild_id and player_capacity.
+        params (dict): Its bind parameters, including :hero_id.
 
     Returns:
-        SuccessResponse: Indicates whether the request was accepted.
+        Row: The guild_id, guild_name and number of rejected invites, or None if the hero could not join.
     """
-    sql_to_execute = sqlalchemy.text("""
-    WITH guild_info AS (
-        SELECT g.id AS guild_id, g.player_capacity
-        FROM guild g
-        WHERE g.name = :guild_name
-        FOR UPDATE
+    # The guild_stats update takes the guild's hero slot; concurrent accepts
+    # wait on its row and re-check the count they left behind
+    return connection.execute(sqlalchemy.text(f"""
+    WITH guild_info AS ({guild_info_sql}),
+    candidate AS (
+        SELECT id, power
+        FROM hero
+        WHERE id = :hero_id AND guild_id IS NULL
     ),
-    current_hero_count AS (
-        SELECT COUNT(*) AS current_heroes
-        FROM hero h
-        WHERE h.guild_id IN (SELECT guild_id FROM guild_info)
+    slot AS (
+        UPDATE guild_stats s
+        SET hero_count = s.hero_count + 1,
+            power_sum = s.power_sum + COALESCE(c.power, 0)
+        FROM guild_info g, candidate c
+        WHERE s.guild_id = g.guild_id AND s.hero_count < g.player_capacity
+        RETURNING s.guild_id
     ),
     update_hero AS (
         UPDATE hero
-        SET guild_id = (SELECT guild_id FROM guild_info)
-        WHERE id = :hero_id AND guild_id IS NULL AND
-              (SELECT current_heroes FROM current_hero_count) < (SELECT player_capacity FROM guild_info)
+        SET guild_id = (SELECT guild_id FROM slot)
+        WHERE id = :hero_id AND guild_id IS NULL AND EXISTS (SELECT 1 FROM slot)
         RETURNING guild_id
+    ),
+    accepted AS (
+        UPDATE recruitment
+        SET status = 'accepted', response_date = now()
+        WHERE hero_id = :hero_id AND status = 'pending' AND guild_id IN (SELECT guild_id FROM update_hero)
+        RETURNING guild_id
+    ),
+    rejected AS (
+        UPDATE recruitment
+        SET status = 'rejected', response_date = now()
+        WHERE hero_id = :hero_id AND status = 'pending' AND EXISTS (SELECT 1 FROM accepted)
+        AND guild_id NOT IN (SELECT guild_id FROM accepted)
+        RETURNING id
     )
-    UPDATE recruitment
-    SET status = 'accepted', response_date = now()
-    WHERE hero_id = :hero_id AND guild_id IN (SELECT guild_id FROM update_hero)
-    RETURNING hero_id;
-    """)
+    SELECT a.guild_id, g.name AS guild_name, (SELECT COUNT(*) FROM rejected) AS rejected
+    FROM accepted a
+    JOIN guild g ON g.id = a.guild_id
+    """), params).first()
+
+@router.post("/accept_request/{hero_id}", response_model=SuccessResponse)
+def accept_request(hero_id: int, guild_name: str):
+    """
+    Accept a pending request for a hero to join a guild, and reject the hero's other requests.
+
+    Args:
+        hero_id (int): The ID of the hero.
+        guild_name (str): The name of the guild.
+
+    Returns:
+        SuccessResponse: Indicates whether the request was accepted.
+    """
     with db.engine.begin() as connection:
-        result = connection.execute(sql_to_execute, {"guild_name": guild_name, "hero_id": hero_id})
-        hero_updated = result.fetchone()
-        if hero_updated:
-            return SuccessResponse(success=True, message=f"Joined guild {guild_name} successfully")
-        else:
+        hero_updated = join_guild(connection, """
+            SELECT g.id AS guild_id, g.player_capacity
+            FROM guild g
+            WHERE g.name = :guild_name AND g.world_id = (SELECT world_id FROM hero WHERE id = :hero_id)
+        """, {"guild_name": guild_name, "hero_id": hero_id})
+        if not hero_updated:
             raise HTTPException(status_code=400, detail="Request not found or hero already in a guild or guild is full")
 
+    cache.invalidate("leaderboard")
+    return SuccessResponse(success=True, message=f"Joined guild {guild_name} successfully")
+
+@router.post("/accept_best_offer/{hero_id}", response_model=SuccessResponse)
+def accept_best_offer(hero_id: int):
+    """
+    Accept the pending request from the richest guild that has room, and reject the rest.
+
+    Ties go to the earliest request.
+
+    Args:
+        hero_id (int): The ID of the hero.
+
+    Returns:
+        SuccessResponse: The guild joined and how many other requests were rejected.
+    """
+    with db.engine.begin() as connection:
+        joined = join_guild(connection, """
+            SELECT g.id AS guild_id, g.player_capacity
+            FROM recruitment r
+            JOIN guild g ON g.id = r.guild_id
+            JOIN guild_stats s ON s.guild_id = g.id
+            WHERE r.hero_id = :hero_id AND r.status = 'pending' AND s.hero_count < g.player_capacity
+            ORDER BY g.gold DESC, r.request_date, g.id
+            LIMIT 1
+        """, {"hero_id": hero_id})
+        if not joined:
+            raise HTTPException(status_code=400, detail="No pending request from a guild with room or hero already in a guild")
+
+    cache.invalidate("leaderboard")
+    return SuccessResponse(
+        success=True,
+        message=f"Joined guild {joined.guild_name} successfully and rejected {joined.rejected} other requests",
+    )
+
 @router.post("/attack_monster/{hero_id}", response_model=SuccessResponse)
-def attack_monster(hero_id: int, monster_id: int):
+async def attack_monster(hero_id: int, monster_id: int):
     """
     Attack a monster with a hero.
 
@@ -217,14 +302,19 @@ def attack_monster(hero_id: int, monster_id: int):
     Returns:
         SuccessResponse: Indicates whether the attack was successful.
     """
-    with db.engine.begin() as connection:
-        result = connection.execute(sqlalchemy.text("""
+    async with db.async_engine.begin() as connection:
+        # A kill updates the dungeon's monster count, so the dungeon is locked
+        # before the combatants, in the same order as combat rounds
+        await connection.execute(sqlalchemy.text("""
+            SELECT id FROM dungeon WHERE id = (SELECT dungeon_id FROM monster WHERE id = :monster_id) FOR UPDATE
+        """), {"monster_id": monster_id})
+        result = (await connection.execute(sqlalchemy.text("""
             SELECT m.health AS monster_health, h.power AS hero_power, h.health AS hero_health
             FROM monster m
             JOIN hero h ON h.id = :hero_id
             WHERE m.id = :monster_id
             FOR UPDATE
-        """), {"monster_id": monster_id, "hero_id": hero_id}).fetchone()
+        """), {"monster_id": monster_id, "hero_id": hero_id})).fetchone()
         if not result:
             raise HTTPException(status_code=404, detail="Hero or Monster not found")
 
@@ -237,21 +327,25 @@ def attack_monster(hero_id: int, monster_id: int):
         new_health = monster_health - hero_power
         damage = hero_power
 
-        connection.execute(sqlalchemy.text("""
-            UPDATE monster
-            SET health = :new_health
-            WHERE id = :monster_id
-        """), {"new_health": new_health, "monster_id": monster_id})
+        await connection.execute(sqlalchemy.text("""
+            WITH attacked AS (
+                UPDATE monster
+                SET health = :new_health
+                WHERE id = :monster_id
+                RETURNING dungeon_id
+            )
+            UPDATE dungeon
+            SET monster_count = monster_count - 1
+            FROM attacked
+            WHERE dungeon.id = attacked.dungeon_id AND :killed
+        """), {"new_health": new_health, "monster_id": monster_id, "killed": monster_health > 0 and new_health <= 0})
 
-        connection.execute(sqlalchemy.text("""
-            INSERT INTO targeting (hero_id, monster_id, damage, timestamp)
-            VALUES (:hero_id, :monster_id, :damage, CURRENT_TIMESTAMP)
-        """), {"hero_id": hero_id, "monster_id": monster_id, "damage": damage})
+        await targeting_log.record_async(connection, [hero_id], [monster_id], [damage])
 
     return SuccessResponse(success=True, message="Monster attacked successfully")
 
 @router.get("/check_health/{hero_id}", response_model=HealthResponse)
-def check_health(hero_id: int):
+async def check_health(hero_id: int):
     """
     Check the health of a hero.
 
@@ -262,19 +356,67 @@ def check_health(hero_id: int):
         HealthResponse: The current health of the hero.
     """
 
-    with db.engine.begin() as connection:
-        health = connection.execute(sqlalchemy.text("""
+    async with db.async_engine.begin() as connection:
+        health = (await connection.execute(sqlalchemy.text("""
             SELECT health
             FROM hero
             WHERE id = :hero_id
-        """), {"hero_id": hero_id}).scalar_one()
+        """), {"hero_id": hero_id})).scalar_one()
     return HealthResponse(health=health)
 
+@router.get("/status", response_model=list[HeroStatus])
+async def hero_status(hero_ids: list[int] = Query(None), guild_id: int = None, dungeon_id: int = None):
+    """
+    Check the health, XP, level and dungeon of many heroes in one request.
+
+    Heroes are selected by any combination of hero_ids, guild_id and
+    dungeon_id; at least one is required and all given selectors must match.
+
+    Args:
+        hero_ids (list[int], optional): The IDs of the heroes.
+        guild_id (int, optional): Only heroes in this guild.
+        dungeon_id (int, optional): Only heroes in this dungeon.
+
+    Returns:
+        List[HeroStatus]: The status of each matching hero, in ID order.
+    """
+
+    if hero_ids is None and guild_id is None and dungeon_id is None:
+        raise HTTPException(status_code=400, detail="No Heroes Selected")
+    if hero_ids is not None and len(hero_ids) > MAX_STATUS_HEROES:
+        raise HTTPException(status_code=400, detail="Too Many Heroes")
+
+    # asyncpg prepares the statement, so NULL-checked parameters need a type
+    async with db.async_engine.begin() as connection:
+        heroes = (await connection.execute(sqlalchemy.text("""
+            SELECT id, health, xp, level, dungeon_id
+            FROM hero
+            WHERE (CAST(:hero_ids AS BIGINT[]) IS NULL OR id = ANY(CAST(:hero_ids AS BIGINT[])))
+            AND (CAST(:guild_id AS BIGINT) IS NULL OR guild_id = :guild_id)
+            AND (CAST(:dungeon_id AS BIGINT) IS NULL OR dungeon_id = :dungeon_id)
+            ORDER BY id
+            LIMIT :limit
+        """), {
+            "hero_ids": hero_ids,
+            "guild_id": guild_id,
+            "dungeon_id": dungeon_id,
+            "limit": MAX_STATUS_HEROES
+        })).fetchall()
+
+    return [
+        HeroStatus(id=row.id, health=row.health, xp=row.xp, level=row.level, dungeon_id=row.dungeon_id)
+        for row in heroes
+    ]
+
 @router.post("/run_away/{hero_id}", response_model=SuccessResponse)
 def run_away(hero_id: int):
     """
     Run away from a dungeon. Hero can only run away if they are not being targeted by a monster.
 
+    Targeting is read from targeting_rollup plus this process's targeting
+    buffer. In buffered mode, attacks committed by other workers reach the
+    rollup only once their buffer flushes, up to TARGETING_FLUSH_SECONDS later.
+
     Args:
         hero_id (int): The ID of the hero.
 
@@ -283,14 +425,15 @@ def run_away(hero_id: int):
     """
 
     sql_to_execute = """
-    SELECT COUNT(*) 
-    FROM targeting 
-    WHERE hero_id = :hero_id;
+    SELECT EXISTS (
+        SELECT 1
+        FROM targeting_rollup
+        WHERE hero_id = :hero_id
+    );
     """
     with db.engine.begin() as connection:
-        result = connection.execute(sqlalchemy.text(sql_to_execute), {"hero_id": hero_id})
-        row_count = result.fetchone()[0]
-        if row_count > 0:
+        targeted = connection.execute(sqlalchemy.text(sql_to_execute), {"hero_id": hero_id}).scalar_one()
+        if targeted or targeting_log.buffer.has_rows_for(hero_id):
             raise HTTPException(status_code=400, detail="Hero is being targeted by a monster. Cannot run away.")
         else:
             update_sql = """
@@ -305,11 +448,12 @@ def run_away(hero_id: int):
                 raise HTTPException(status_code=404, detail="Hero cannot run away")
 
 @router.get("/find_monsters/{dungeon_id}", response_model=list[Monster])
-def find_monsters(dungeon_id: int):
+async def find_monsters(request: Request, dungeon_id: int):
     """
     Find monsters in a specific dungeon.
 
     Args:
+        request (Request): The incoming request, checked for an NDJSON Accept header.
         dungeon_id (int): The ID of the dungeon.
 
     Returns:
@@ -321,78 +465,78 @@ def find_monsters(dungeon_id: int):
     FROM monster
     WHERE dungeon_id = :dungeon_id AND monster.health > 0
     """
-    with db.engine.begin() as connection:
-        monsters = connection.execute(sqlalchemy.text(sql_to_execute), {"dungeon_id": dungeon_id})
 
-    return [Monster(id=monster.id, name=monster.name, level=monster.level, health=monster.health, power=monster.power) for monster in monsters]
+    def to_monster(monster):
+        return Monster(id=monster.id, name=monster.name, level=monster.level, health=monster.health, power=monster.power)
+
+    if streaming.wants_ndjson(request):
+        return streaming.stream_rows(sql_to_execute, {"dungeon_id": dungeon_id}, to_monster)
+
+    async with db.async_engine.begin() as connection:
+        monsters = (await connection.execute(sqlalchemy.text(sql_to_execute), {"dungeon_id": dungeon_id})).fetchall()
+
+    return [to_monster(monster) for monster in monsters]
 
 @router.get("/{hero_id}/monster_interactions", response_model=HeroMonsterInteractionsResponse)
-def hero_monster_interactions(hero_id: int):
+def hero_monster_interactions(hero_id: int, limit: int = 50, after_monster_id: int = None):
     """
     Get the battle history of a hero.
 
+    Totals come from the maintained hero_battle_summary row, and the battle
+    details are paged newest first by keyset over targeting_rollup.
+
     Args:
         hero_id (int): The ID of the hero.
+        limit (int): The maximum number of battles to return.
+        after_monster_id (int, optional): The next_cursor of the previous page.
 
     Returns:
         HeroMonsterInteractionsResponse: The battle history details of the hero.
     """
 
-    sql_monster_interactions = """
-    WITH hero_battles AS (
-        SELECT
-            t.hero_id,
-            t.monster_id,
-            m.type AS monster_type,
-            m.level AS monster_level,
-            m.health AS monster_remaining_health,
-            m.power AS monster_power,
-            t.timestamp AS battle_time,
-            SUM(t.damage) OVER (PARTITION BY t.monster_id ORDER BY t.timestamp RANGE BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) + FIRST_VALUE(m.health) OVER (PARTITION BY t.monster_id ORDER BY t.timestamp ASC ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS initial_health,
-            SUM(t.damage) OVER (PARTITION BY t.monster_id ORDER BY t.timestamp ASC ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS damage_dealt,
-            CASE WHEN m.health <= 0 THEN 1 ELSE 0 END AS monster_defeated
-        FROM targeting t
-        JOIN monster m ON t.monster_id = m.id
-        WHERE t.hero_id = :hero_id
-    ),
-    battle_summary AS (
-        SELECT
-            hero_id,
-            COUNT(DISTINCT monster_id) AS total_battles,
-            SUM(monster_defeated::int) AS monsters_defeated,
-            SUM(damage_dealt) AS total_damage_dealt
-        FROM hero_battles
-        GROUP BY hero_id
-    )
+    if limit < 1 or limit > MAX_INTERACTIONS_LIMIT:
+        raise HTTPException(status_code=400, detail="Invalid Limit")
+
+    sql_summary = """
+    SELECT total_battles, monsters_defeated, total_damage
+    FROM hero_battle_summary
+    WHERE hero_id = :hero_id
+    """
+    sql_battle_details = """
     SELECT
-        hb.hero_id,
-        hb.monster_id,
-        hb.monster_type,
-        hb.monster_level,
-        hb.initial_health,
-        hb.monster_remaining_health AS remaining_health,
-        hb.damage_dealt,
-        hb.monster_power,
-        to_char(hb.battle_time, 'YYYY-MM-DD HH24:MI:SS') AS battle_time,  -- Convert timestamp to string format
-        bs.total_battles,
-        bs.monsters_defeated,
-        bs.total_damage_dealt
-    FROM hero_battles hb
-    JOIN battle_summary bs ON hb.hero_id = bs.hero_id
-    ORDER BY hb.battle_time DESC;
+        r.monster_id,
+        m.type AS monster_type,
+        m.level AS monster_level,
+        m.health + r.total_damage AS initial_health,
+        m.health AS remaining_health,
+        r.total_damage AS damage_dealt,
+        m.power AS monster_power,
+        to_char(r.last_attack, 'YYYY-MM-DD HH24:MI:SS') AS battle_time,
+        r.defeated
+    FROM targeting_rollup r
+    JOIN monster m ON r.monster_id = m.id
+    WHERE r.hero_id = :hero_id
+    AND (:after_monster_id IS NULL OR (r.last_attack, r.monster_id) <
+        (SELECT last_attack, monster_id FROM targeting_rollup WHERE hero_id = :hero_id AND monster_id = :after_monster_id))
+    ORDER BY r.last_attack DESC, r.monster_id DESC
+    LIMIT :limit
     """
-    with db.engine.begin() as connection:
-        interactions = connection.execute(sqlalchemy.text(sql_monster_interactions), {"hero_id": hero_id}).fetchall()
-
-    if not interactions:
-        raise HTTPException(status_code=404, detail="No interactions found for the specified hero")
+    with db.read_connection() as connection:
+        summary = connection.execute(sqlalchemy.text(sql_summary), {"hero_id": hero_id}).fetchone()
+        if summary is None:
+            raise HTTPException(status_code=404, detail="No interactions found for the specified hero")
+        battles = connection.execute(sqlalchemy.text(sql_battle_details), {
+            "hero_id": hero_id,
+            "limit": limit,
+            "after_monster_id": after_monster_id
+        }).fetchall()
 
     return HeroMonsterInteractionsResponse(
         status="success",
-        hero_id=interactions[0].hero_id,
-        total_battles=interactions[0].total_battles,
-        monsters_defeated=interactions[0].monsters_defeated,
-        total_damage_dealt=interactions[0].total_damage_dealt,
+        hero_id=hero_id,
+        total_battles=summary.total_battles,
+        monsters_defeated=summary.monsters_defeated,
+        total_damage_dealt=summary.total_damage,
         battle_details=[
             HeroMonsterInteraction(
                 monster_id=row.monster_id,
@@ -403,8 +547,9 @@ def hero_monster_interactions(hero_id: int):
                 damage_dealt=row.damage_dealt,
                 monster_power=row.monster_power,
                 battle_time=row.battle_time,
-                monster_defeated=bool(row.remaining_health <= 0)
+                monster_defeated=row.defeated
             )
-            for row in interactions
-        ]
+            for row in battles
+        ],
+        next_cursor=battles[-1].monster_id if len(battles) == limit else None
     )
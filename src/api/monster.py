@@ -1,13 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from src.api import auth
 import sqlalchemy
 from src import database as db
+from src import targeting_log
+from src import streaming
+from src import profiling
 
 router = APIRouter(
     prefix="/monster",
     tags=["monster"],
     dependencies=[Depends(auth.get_api_key)],
+    route_class=profiling.ProfiledRoute,
 )
 
 # Models
@@ -24,35 +28,39 @@ class SuccessResponse(BaseModel):
 # Endpoints
 
 @router.get("/find_heroes/{dungeon_id}", response_model=list[HeroDetails])
-def find_heroes(dungeon_id: int):
+async def find_heroes(request: Request, dungeon_id: int):
     """
     Find heroes in a specific dungeon.
 
     Args:
+        request (Request): The incoming request, checked for an NDJSON Accept header.
         dungeon_id (int): The ID of the dungeon.
 
     Returns:
         List[HeroDetails]: List of heroes found in the specified dungeon.
     """
 
-    with db.engine.begin() as connection:
-        result = connection.execute(
-            sqlalchemy.text("""
-            SELECT hero.id, hero.name, hero.level, hero.power
-            FROM hero
-            JOIN guild ON hero.guild_id = guild.id
-            JOIN dungeon ON guild.world_id = dungeon.world_id AND dungeon.id = hero.dungeon_id
-            WHERE dungeon.id = :dungeon_id AND hero.health > 0
-            """), {"dungeon_id": dungeon_id}
-        )
-        heroes = [
-            HeroDetails(id=row['id'], name=row['name'], level=row['level'], power=row['power']) 
-            for row in result.mappings()
-        ]
+    sql_to_execute = """
+    SELECT hero.id, hero.name, hero.level, hero.power
+    FROM hero
+    JOIN guild ON hero.guild_id = guild.id
+    JOIN dungeon ON guild.world_id = dungeon.world_id AND dungeon.id = hero.dungeon_id
+    WHERE dungeon.id = :dungeon_id AND hero.health > 0
+    """
+
+    def to_hero_details(row):
+        return HeroDetails(id=row.id, name=row.name, level=row.level, power=row.power)
+
+    if streaming.wants_ndjson(request):
+        return streaming.stream_rows(sql_to_execute, {"dungeon_id": dungeon_id}, to_hero_details)
+
+    async with db.async_engine.begin() as connection:
+        result = await connection.execute(sqlalchemy.text(sql_to_execute), {"dungeon_id": dungeon_id})
+        heroes = [to_hero_details(row) for row in result]
     return heroes
 
 @router.post("/attack_hero/{monster_id}", response_model=SuccessResponse)
-def attack_hero(hero_id: int, monster_id: int):
+async def attack_hero(hero_id: int, monster_id: int):
     """
     Attack a hero with a monster.
 
@@ -64,20 +72,16 @@ def attack_hero(hero_id: int, monster_id: int):
         SuccessResponse: Indicates whether the attack was successful.
     """
     
-    with db.engine.begin() as connection:
-        result = connection.execute(sqlalchemy.text("""
+    async with db.async_engine.begin() as connection:
+        result = await connection.execute(sqlalchemy.text("""
             UPDATE hero
             SET health = (SELECT health FROM hero WHERE id = :hero_id) - 
             (SELECT power FROM monster WHERE id = :monster_id)
             WHERE id = :hero_id
         """), {"hero_id": hero_id, "monster_id": monster_id})
 
-        connection.execute(sqlalchemy.text("""
-            INSERT INTO targeting (hero_id, monster_id)
-            VALUES (:hero_id, :monster_id)
-        """), {"hero_id": hero_id, "monster_id": monster_id})
-
         if result.rowcount > 0:
+            await targeting_log.record_async(connection, [hero_id], [monster_id], [0])
             return SuccessResponse(success=True, message="Hero attacked successfully")
         else:
             raise HTTPException(status_code = 400, detail = "Failed to attack hero")
@@ -1,12 +1,23 @@
-from fastapi import FastAPI, exceptions
-from fastapi.responses import JSONResponse
+from fastapi import Depends, FastAPI, exceptions
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import ValidationError
 import json
 import logging
 import sys
 from starlette.middleware.cors import CORSMiddleware
 
-from src.api import dungeon, hero, monster, world, guild
+from src.api import auth, dungeon, hero, monster, world, guild, admin
+from src import background
+from src import dungeon_clear
+from src import instrumentation
+from src import profiling
+from src import recruitment
+from src import slow_queries
+from src import spawner
+from src import targeting_log
+from src import world_tick
+from src.metrics import registry
+from src import database as db
 
 description = """
 Some description.
@@ -28,7 +39,33 @@ app.include_router(dungeon.router)
 app.include_router(hero.router)
 app.include_router(monster.router)
 app.include_router(guild.router)
+app.include_router(admin.router)
 
+app.add_middleware(instrumentation.RequestMetricsMiddleware)
+
+background.register("recruitment_sweep", recruitment.RECRUITMENT_SWEEP_SECONDS, recruitment.sweep)
+background.register("world_tick", world_tick.WORLD_TICK_SECONDS, world_tick.tick)
+background.register("monster_spawner", spawner.MONSTER_SPAWN_SECONDS, spawner.spawn)
+
+
+@app.on_event("startup")
+def start_background_writers():
+    targeting_log.start()
+    slow_queries.start()
+    background.start()
+    dungeon_clear.start()
+
+@app.on_event("shutdown")
+def stop_background_writers():
+    background.stop()
+    dungeon_clear.stop()
+    targeting_log.stop()
+    slow_queries.stop()
+    profiling.profiles.dump()
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await db.async_engine.dispose()
 
 @app.exception_handler(exceptions.RequestValidationError)
 @app.exception_handler(ValidationError)
@@ -43,4 +80,11 @@ async def validation_exception_handler(request, exc):
 
 @app.get("/")
 async def root():
-    return {"message": "This is the web service of Arthur's Last Crusade"}
\ No newline at end of file
+    return {"message": "This is the web service of Arthur's Last Crusade"}
+
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(auth.get_api_key)])
+def metrics():
+    """
+    Get request latency, per-request SQL and connection pool metrics in Prometheus text format.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,14 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from src.api import auth
 import sqlalchemy
 from src import database as db
+from src import cache
+from src import streaming
+from src import profiling
 from sqlalchemy.exc import IntegrityError
+from typing import Optional
 
 router = APIRouter(
     prefix="/world",
     tags=["world"],
     dependencies=[Depends(auth.get_api_key)],
+    route_class=profiling.ProfiledRoute,
 )
 
 # Models
@@ -36,32 +41,81 @@ class SuccessResponse(BaseModel):
     success: bool
     message: str = None
 
+class HeroCreateResult(BaseModel):
+    index: int
+    hero_name: str
+    status: str
+    hero_id: Optional[int]
+    detail: Optional[str]
+
+class BulkCreateResponse(BaseModel):
+    created: int
+    failed: int
+    results: list[HeroCreateResult]
+
+MAX_VIEW_HEROES_LIMIT = 1000
+MAX_CREATE_HEROES = 5000
+
 # Endpoints
 
 @router.get("/view_heroes/{world_id}", response_model=list[HeroView])
-def view_heroes(world_id: int):
+def view_heroes(request: Request, world_id: int, limit: int = 100, after_id: int = None, hero_class: str = None,
+                min_power: int = None, min_level: int = None, max_level: int = None):
     """
     View heroes not in a guild in a specific world.
 
+    Heroes are returned in ID order a page at a time. Pass the ID of the last
+    hero of a page as after_id to get the next one. Clients that accept
+    application/x-ndjson get the heroes streamed, and limit is not capped.
+
     Args:
+        request (Request): The incoming request, checked for an NDJSON Accept header.
         world_id (int): The ID of the world.
+        limit (int): The maximum number of heroes to return.
+        after_id (int, optional): Only return heroes with a greater ID.
+        hero_class (str, optional): Only return heroes of this class.
+        min_power (int, optional): Only return heroes with at least this power.
+        min_level (int, optional): Only return heroes of at least this level.
+        max_level (int, optional): Only return heroes of at most this level.
 
     Returns:
         List[HeroView]: List of heroes in the specified world.
     """
-    heroes = []
-    with db.engine.begin() as connection:
-        sql_to_execute = """
-            SELECT id, name, power, health
-            FROM hero
-            WHERE guild_id IS NULL AND world_id = :world_id;
-        """
-        result = connection.execute(sqlalchemy.text(sql_to_execute), {"world_id": world_id})
-
-        heroes = [
-            HeroView(id=row.id, name=row.name, power=row.power, health=row.health) 
-            for row in result
-        ]
+    stream = streaming.wants_ndjson(request)
+    if limit < 1 or (limit > MAX_VIEW_HEROES_LIMIT and not stream):
+        raise HTTPException(status_code=400, detail="Invalid Limit")
+
+    sql_to_execute = """
+        SELECT id, name, power, health
+        FROM hero
+        WHERE guild_id IS NULL AND world_id = :world_id
+        AND (:after_id IS NULL OR id > :after_id)
+        AND (:hero_class IS NULL OR class = :hero_class)
+        AND (:min_power IS NULL OR power >= :min_power)
+        AND (:min_level IS NULL OR level >= :min_level)
+        AND (:max_level IS NULL OR level <= :max_level)
+        ORDER BY id
+        LIMIT :limit;
+    """
+    params = {
+        "world_id": world_id,
+        "limit": limit,
+        "after_id": after_id,
+        "hero_class": hero_class,
+        "min_power": min_power,
+        "min_level": min_level,
+        "max_level": max_level
+    }
+
+    def to_hero_view(row):
+        return HeroView(id=row.id, name=row.name, power=row.power, health=row.health)
+
+    if stream:
+        return streaming.stream_rows(sql_to_execute, params, to_hero_view)
+
+    with db.read_connection() as connection:
+        result = connection.execute(sqlalchemy.text(sql_to_execute), params)
+        heroes = [to_hero_view(row) for row in result]
 
     return heroes
 
@@ -138,6 +192,84 @@ def create_hero(world_id: int, hero: Hero):
         except IntegrityError:
             raise HTTPException(status_code=400, detail="Hero name must be unique within specified world")
 
+def hero_errors(hero):
+    for field in ("level", "age", "power", "health", "xp"):
+        if getattr(hero, field) < 0:
+            return f"Invalid Hero {field}"
+    return None
+
+@router.post("/create_heroes/{world_id}", response_model=BulkCreateResponse)
+def create_heroes(world_id: int, heroes: list[Hero]):
+    """
+    Create many heroes in a specific world with a single insert.
+
+    Each hero is checked on its own, so an invalid hero or a name that is
+    already taken is reported in its result without failing the rest of the
+    batch. Results are in the order the heroes were sent.
+
+    Args:
+        world_id (int): The ID of the world where the heroes will be created.
+        heroes (list[Hero]): The details of up to MAX_CREATE_HEROES heroes.
+
+    Returns:
+        BulkCreateResponse: Per-hero results: created, invalid, duplicate or name_taken.
+    """
+    if not heroes:
+        raise HTTPException(status_code=400, detail="No Heroes Given")
+    if len(heroes) > MAX_CREATE_HEROES:
+        raise HTTPException(status_code=400, detail="Too Many Heroes")
+
+    results = []
+    valid = {}
+    for index, hero in enumerate(heroes):
+        result = HeroCreateResult(index=index, hero_name=hero.hero_name, status="created")
+        error = hero_errors(hero)
+        if error is not None:
+            result.status, result.detail = "invalid", error
+        elif hero.hero_name in valid:
+            result.status, result.detail = "duplicate", "Hero name appears earlier in this batch"
+        else:
+            valid[hero.hero_name] = result
+        results.append(result)
+
+    with db.engine.begin() as connection:
+        if connection.execute(
+            sqlalchemy.text("SELECT 1 FROM world WHERE id = :world_id"), {"world_id": world_id}
+        ).first() is None:
+            raise HTTPException(status_code=404, detail="World not found")
+
+        inserted = []
+        if valid:
+            rows = [heroes[result.index] for result in valid.values()]
+            inserted = connection.execute(sqlalchemy.text("""
+                INSERT INTO hero (name, class, level, age, power, health, xp, world_id)
+                SELECT name, class, level, age, power, health, xp, :world_id
+                FROM unnest(
+                    CAST(:names AS TEXT[]), CAST(:classes AS TEXT[]), CAST(:levels AS INT[]),
+                    CAST(:ages AS INT[]), CAST(:powers AS INT[]), CAST(:healths AS INT[]), CAST(:xps AS INT[])
+                ) AS h(name, class, level, age, power, health, xp)
+                ON CONFLICT (name) DO NOTHING
+                RETURNING id, name
+            """), {
+                "world_id": world_id,
+                "names": [hero.hero_name for hero in rows],
+                "classes": [hero.classType for hero in rows],
+                "levels": [hero.level for hero in rows],
+                "ages": [hero.age for hero in rows],
+                "powers": [hero.power for hero in rows],
+                "healths": [hero.health for hero in rows],
+                "xps": [hero.xp for hero in rows],
+            }).all()
+
+    for row in inserted:
+        valid.pop(row.name).hero_id = row.id
+    # Whatever was not inserted lost to an existing hero's name
+    for result in valid.values():
+        result.status, result.detail = "name_taken", "Hero name must be unique"
+
+    created = len(inserted)
+    return BulkCreateResponse(created=created, failed=len(results) - created, results=results)
+
 @router.post("/age_hero/{hero_id}", response_model=SuccessResponse)
 def age_hero(hero_id: int):
     """
@@ -162,6 +294,7 @@ def age_hero(hero_id: int):
             raise HTTPException(status_code = 404, detail = "Failed to age hero")
         
 @router.get("/get_worlds", response_model=list[dict])
+@cache.cached("worlds")
 def get_worlds():
     """
     Get a list of all worlds.
@@ -169,7 +302,7 @@ def get_worlds():
     Returns:
         List[dict]: List of all worlds.
     """
-    with db.engine.begin() as connection:
+    with db.read_connection() as connection:
         result = connection.execute(sqlalchemy.text("SELECT id, name FROM world"))
         worlds = [{"id": row.id, "name": row.name} for row in result.fetchall()]
     return worlds
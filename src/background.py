@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+
+
+class JobAlreadyRunning(Exception):
+    """Raised by PeriodicJob.run_once while another run of the job is in progress."""
+
+
+class PeriodicJob:
+    """
+    Runs a function every `interval` seconds on its own daemon thread.
+
+    Runs never overlap: the next one is scheduled `interval` seconds after
+    the previous one finishes, and a run started on another thread while one
+    is in progress is refused. A scheduled run that finds one in progress is
+    skipped. A run that raises is logged and counted, and the job keeps its
+    schedule.
+    """
+
+    def __init__(self, name, interval, run):
+        self.name = name
+        self.interval = interval
+        self.run = run
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.failures = 0
+        self.last_started = None
+        self.last_duration = None
+        self.last_result = None
+        self.last_error = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._loop, name=f"job-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def run_once(self):
+        """
+        Run the job now, on the caller's thread, and record the outcome.
+
+        Raises:
+            JobAlreadyRunning: If the job is already running on another thread.
+        """
+        if not self._run_lock.acquire(blocking=False):
+            raise JobAlreadyRunning(self.name)
+        try:
+            return self._run()
+        finally:
+            self._run_lock.release()
+
+    def _run(self):
+        started = time.time()
+        start = time.perf_counter()
+        result, error = None, None
+        try:
+            result = self.run()
+        except Exception as e:
+            logging.exception(f"Background job {self.name} failed")
+            error = str(e).strip()
+        with self._lock:
+            self.runs += 1
+            self.failures += error is not None
+            self.last_started = started
+            self.last_duration = time.perf_counter() - start
+            self.last_result = result
+            self.last_error = error
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "interval_seconds": self.interval,
+                "running": self._thread is not None,
+                "runs": self.runs,
+                "failures": self.failures,
+                "last_started": self.last_started,
+                "last_duration_seconds": self.last_duration,
+                "last_result": self.last_result,
+                "last_error": self.last_error,
+            }
+
+    def _loop(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.run_once()
+            except JobAlreadyRunning:
+                logging.info(f"Skipping background job {self.name}, which is already running")
+
+
+jobs = {}
+
+
+def register(name, interval, run):
+    """
+    Add a job that start() will run every `interval` seconds.
+
+    Args:
+        name (str): Unique name the job is reported under.
+        interval (float): Seconds between runs; 0 or less disables the job.
+        run (callable): Called with no arguments; its return value is kept as
+            the job's last result and should be JSON serializable.
+
+    Returns:
+        PeriodicJob: The registered job.
+    """
+    if name in jobs:
+        raise ValueError(f"Background job {name} is already registered")
+    job = jobs[name] = PeriodicJob(name, interval, run)
+    return job
+
+
+def start():
+    for job in jobs.values():
+        job.start()
+
+
+def stop():
+    for job in jobs.values():
+        job.stop()
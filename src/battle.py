@@ -0,0 +1,165 @@
+import numpy as np
+import sqlalchemy
+from src import targeting_log
+
+# Upper bound on rounds so parties and monsters with no power cannot loop forever
+MAX_ROUNDS = 1000
+
+
+def round_robin(attacker_groups, targets, target_groups, n_groups):
+    """
+    Pair each attacker with a target from its own group.
+
+    Attackers and targets must be sorted by group. The k-th attacker of a group
+    hits the (k mod n)-th of the group's n targets, so attacks are spread over
+    every survivor instead of piling onto one.
+    """
+    attacker_counts = np.bincount(attacker_groups, minlength=n_groups)
+    target_counts = np.bincount(target_groups, minlength=n_groups)
+    attacker_starts = np.cumsum(attacker_counts) - attacker_counts
+    target_starts = np.cumsum(target_counts) - target_counts
+    position = np.arange(len(attacker_groups)) - attacker_starts[attacker_groups]
+    return targets[target_starts[attacker_groups] + position % target_counts[attacker_groups]]
+
+
+def simulate(n_groups, hero_groups, hero_health, hero_power, monster_groups, monster_health, monster_power, max_rounds=MAX_ROUNDS):
+    """
+    Fight many dungeons at once until one side of each is wiped out.
+
+    Heroes and monsters are given as flat arrays sorted by their group, a dense
+    dungeon index below n_groups. Every round, each living hero hits a living
+    monster and each living monster hits a living hero in the same group, and
+    all damage lands simultaneously, the same as a combat round.
+
+    Returns:
+        tuple: Final hero health, final monster health, rounds fought per group,
+            and the (hero index, monster index, damage) of every attack with
+            monster attacks recorded as zero damage.
+    """
+    hero_health = hero_health.astype(np.int64)
+    monster_health = monster_health.astype(np.int64)
+    rounds = np.zeros(n_groups, dtype=np.int64)
+    log_heroes, log_monsters, log_damage = [], [], []
+
+    for _ in range(max_rounds):
+        hero_alive = hero_health > 0
+        monster_alive = monster_health > 0
+        fighting = (np.bincount(hero_groups[hero_alive], minlength=n_groups) > 0) & \
+            (np.bincount(monster_groups[monster_alive], minlength=n_groups) > 0)
+        if not fighting.any():
+            break
+        rounds += fighting
+
+        heroes = np.flatnonzero(hero_alive & fighting[hero_groups])
+        monsters = np.flatnonzero(monster_alive & fighting[monster_groups])
+        hero_targets = round_robin(hero_groups[heroes], monsters, monster_groups[monsters], n_groups)
+        monster_targets = round_robin(monster_groups[monsters], heroes, hero_groups[heroes], n_groups)
+
+        monster_health -= np.bincount(hero_targets, weights=hero_power[heroes], minlength=len(monster_health)).astype(np.int64)
+        hero_health -= np.bincount(monster_targets, weights=monster_power[monsters], minlength=len(hero_health)).astype(np.int64)
+
+        log_heroes += [heroes, monster_targets]
+        log_monsters += [hero_targets, monsters]
+        log_damage += [hero_power[heroes], np.zeros(len(monsters), dtype=np.int64)]
+
+    if log_heroes:
+        attacks = (np.concatenate(log_heroes), np.concatenate(log_monsters), np.concatenate(log_damage))
+    else:
+        attacks = (np.empty(0, dtype=np.int64),) * 3
+    return hero_health, monster_health, rounds, attacks
+
+
+def summarize_attacks(hero_index, monster_index, damage, n_monsters):
+    """Collapse an attack log into one (hero index, monster index, total damage) row per pair."""
+    pairs, inverse = np.unique(hero_index * n_monsters + monster_index, return_inverse=True)
+    totals = np.bincount(inverse, weights=damage, minlength=len(pairs)).astype(np.int64)
+    return pairs // n_monsters, pairs % n_monsters, totals
+
+
+def resolve_dungeons(connection, dungeon_ids):
+    """
+    Auto-resolve the battles in a set of dungeons and write the outcome back in bulk.
+
+    Loads every living hero and monster in the dungeons, simulates all of the
+    fights together, then writes final health values and one summarized
+    targeting row per hero/monster pair that fought.
+
+    Args:
+        connection: An open connection inside a transaction.
+        dungeon_ids (list[int]): The IDs of the dungeons to resolve.
+
+    Returns:
+        dict: Per dungeon ID, the rounds fought and the heroes and monsters left standing.
+    """
+    locked = connection.execute(sqlalchemy.text("""
+        SELECT id FROM dungeon WHERE id = ANY(CAST(:dungeon_ids AS BIGINT[])) ORDER BY id FOR UPDATE
+    """), {"dungeon_ids": list(dungeon_ids)}).scalars().all()
+    dungeons = np.array(locked, dtype=np.int64)
+
+    heroes = connection.execute(sqlalchemy.text("""
+        SELECT id, dungeon_id, health, COALESCE(power, 0) AS power
+        FROM hero
+        WHERE dungeon_id = ANY(CAST(:dungeon_ids AS BIGINT[])) AND health > 0
+        ORDER BY dungeon_id, id
+        FOR UPDATE
+    """), {"dungeon_ids": locked}).fetchall()
+    monsters = connection.execute(sqlalchemy.text("""
+        SELECT id, dungeon_id, health, COALESCE(power, 0) AS power
+        FROM monster
+        WHERE dungeon_id = ANY(CAST(:dungeon_ids AS BIGINT[])) AND health > 0
+        ORDER BY dungeon_id, id
+        FOR UPDATE
+    """), {"dungeon_ids": locked}).fetchall()
+
+    hero_rows = np.array([tuple(row) for row in heroes], dtype=np.int64).reshape(-1, 4)
+    monster_rows = np.array([tuple(row) for row in monsters], dtype=np.int64).reshape(-1, 4)
+    hero_groups = np.searchsorted(dungeons, hero_rows[:, 1])
+    monster_groups = np.searchsorted(dungeons, monster_rows[:, 1])
+
+    hero_health, monster_health, rounds, attacks = simulate(
+        len(dungeons),
+        hero_groups, hero_rows[:, 2], hero_rows[:, 3],
+        monster_groups, monster_rows[:, 2], monster_rows[:, 3],
+    )
+    pair_heroes, pair_monsters, pair_damage = summarize_attacks(*attacks, max(len(monster_rows), 1))
+
+    hero_changed = hero_health != hero_rows[:, 2]
+    monster_changed = monster_health != monster_rows[:, 2]
+    connection.execute(sqlalchemy.text("""
+        UPDATE hero
+        SET health = v.health
+        FROM unnest(CAST(:ids AS BIGINT[]), CAST(:healths AS INT[])) AS v(id, health)
+        WHERE hero.id = v.id
+    """), {"ids": hero_rows[hero_changed, 0].tolist(), "healths": hero_health[hero_changed].tolist()})
+    connection.execute(sqlalchemy.text("""
+        UPDATE monster
+        SET health = v.health
+        FROM unnest(CAST(:ids AS BIGINT[]), CAST(:healths AS INT[])) AS v(id, health)
+        WHERE monster.id = v.id
+    """), {"ids": monster_rows[monster_changed, 0].tolist(), "healths": monster_health[monster_changed].tolist()})
+    # Every monster loaded was alive, so those at 0 health died in this battle
+    monsters_killed = np.bincount(monster_groups[monster_health <= 0], minlength=len(dungeons))
+    killed = monsters_killed > 0
+    connection.execute(sqlalchemy.text("""
+        UPDATE dungeon
+        SET monster_count = dungeon.monster_count - v.killed
+        FROM unnest(CAST(:ids AS BIGINT[]), CAST(:killed AS INT[])) AS v(id, killed)
+        WHERE dungeon.id = v.id
+    """), {"ids": dungeons[killed].tolist(), "killed": monsters_killed[killed].tolist()})
+    targeting_log.record(
+        connection,
+        hero_rows[pair_heroes, 0].tolist(),
+        monster_rows[pair_monsters, 0].tolist(),
+        pair_damage.tolist(),
+    )
+
+    heroes_left = np.bincount(hero_groups[hero_health > 0], minlength=len(dungeons))
+    monsters_left = np.bincount(monster_groups[monster_health > 0], minlength=len(dungeons))
+    return {
+        int(dungeon_id): {
+            "rounds": int(rounds[i]),
+            "heroes_remaining": int(heroes_left[i]),
+            "monsters_remaining": int(monsters_left[i]),
+        }
+        for i, dungeon_id in enumerate(dungeons)
+    }
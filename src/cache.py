@@ -0,0 +1,136 @@
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+import dotenv
+from src import database as db
+
+dotenv.load_dotenv()
+
+CACHE_TTL_SECONDS = float(os.environ.get("READ_CACHE_TTL_SECONDS", 5))
+CACHE_MAX_ENTRIES = int(os.environ.get("READ_CACHE_MAX_ENTRIES", 1024))
+
+
+class _Flight:
+    """A load in progress that concurrent callers for the same key wait on."""
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ReadCache:
+    """
+    Bounded TTL/LRU cache for read endpoints with single-flight loading.
+
+    Concurrent misses for the same key share one load instead of each running
+    the query. Keys are tuples whose first element is a namespace, which is
+    what write paths invalidate. For `primary_window` seconds after an
+    invalidation, loads in that namespace read from the primary, so a lagging
+    replica cannot put the rows from before the write back in the cache.
+    """
+
+    def __init__(self, max_entries, ttl, primary_window=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.primary_window = primary_window
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._generations = {}
+        self._invalidated_at = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get_or_load(self, key, load):
+        namespace = key[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight(self._generations.get(namespace, 0))
+                invalidated_at = self._invalidated_at.get(namespace)
+                recently_written = invalidated_at is not None and time.monotonic() - invalidated_at < self.primary_window
+                self._in_flight[key] = flight
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            if recently_written:
+                with db.primary_reads():
+                    flight.value = load()
+            else:
+                flight.value = load()
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                if self._in_flight.get(key) is flight:
+                    del self._in_flight[key]
+                # A load that raced with an invalidation may have read stale rows
+                if flight.error is None and flight.generation == self._generations.get(namespace, 0):
+                    self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+        return flight.value
+
+    def invalidate(self, namespace):
+        """Drop every entry in a namespace. Call after the write has committed."""
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            self._invalidated_at[namespace] = time.monotonic()
+            for key in [key for key in self._entries if key[0] == namespace]:
+                del self._entries[key]
+            # Later callers must not join loads that started before the write
+            for key in [key for key in self._in_flight if key[0] == namespace]:
+                del self._in_flight[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "entries": len(self._entries),
+                "in_flight": len(self._in_flight),
+            }
+
+
+read_cache = ReadCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, db.REPLICA_MAX_LAG_SECONDS)
+
+
+def cached(namespace):
+    """Cache an endpoint's result in read_cache, keyed on its arguments."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (namespace, args, tuple(sorted(kwargs.items())))
+            return read_cache.get_or_load(key, lambda: fn(*args, **kwargs))
+        return wrapper
+
+    return decorator
+
+
+def invalidate(namespace):
+    read_cache.invalidate(namespace)
@@ -1,10 +1,333 @@
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 import dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from src.metrics import Counter, Histogram
 
 def database_connection_url():
     dotenv.load_dotenv()
 
     return os.environ.get("POSTGRES_URI")
 
-engine = create_engine(database_connection_url(), pool_pre_ping=True)
\ No newline at end of file
+def replica_connection_url():
+    dotenv.load_dotenv()
+
+    return os.environ.get("POSTGRES_REPLICA_URI")
+
+def async_database_connection_url():
+    # The same database through the asyncpg driver
+    return make_url(database_connection_url()).set(drivername="postgresql+asyncpg")
+
+dotenv.load_dotenv()
+
+# Each engine can hold up to DB_POOL_SIZE + DB_MAX_OVERFLOW connections per
+# worker process; size them against Postgres max_connections
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", -1))
+
+# Reads marked read-only go to the replica only while it is at most this far behind
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", 5))
+REPLICA_CHECK_SECONDS = float(os.environ.get("REPLICA_CHECK_SECONDS", 1))
+# How long to send reads to the primary after the replica could not be reached
+REPLICA_RETRY_SECONDS = float(os.environ.get("REPLICA_RETRY_SECONDS", 10))
+
+
+class PoolMetrics:
+    """Checkout wait times and failures for one connection pool."""
+
+    def __init__(self):
+        self.checkout_wait = Histogram()
+        self.checkout_timeouts = Counter()
+        self.pre_ping_failures = Counter()
+
+
+# Keyed by the pool's logging name, which survives pool.recreate()
+pool_metrics = {
+    "primary": PoolMetrics(),
+    "primary_async": PoolMetrics(),
+    "replica": PoolMetrics(),
+}
+
+
+class _TimedCheckout:
+    def _do_get(self):
+        metrics = pool_metrics[self._orig_logging_name]
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            metrics.checkout_timeouts.inc()
+            raise
+        finally:
+            metrics.checkout_wait.observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(name):
+    return {
+        "pool_pre_ping": True,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_logging_name": name,
+    }
+
+
+def count_pre_ping_failures(engine, name):
+    @event.listens_for(engine, "handle_error")
+    def _count(context):
+        if context.is_pre_ping:
+            pool_metrics[name].pre_ping_failures.inc()
+
+
+def pool_status(engine):
+    """
+    Returns:
+        dict: The pool's configuration, current occupancy and checkout metrics.
+    """
+    pool = engine.pool
+    metrics = pool_metrics[pool._orig_logging_name]
+    return {
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "timeout": pool.timeout(),
+        "recycle": pool._recycle,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        # QueuePool reports a negative overflow while below pool_size
+        "overflow": max(pool.overflow(), 0),
+        "checkout_timeouts": metrics.checkout_timeouts.value,
+        "pre_ping_failures": metrics.pre_ping_failures.value,
+        "checkout_wait_seconds": metrics.checkout_wait.snapshot(),
+    }
+
+
+# Per engine, the (committed, discarded) callbacks added with on_commit
+_commit_hooks = {}
+
+# Set in a connection's info between its commit event and the commit's outcome
+_COMMITTING_KEY = "committing"
+
+
+def on_commit(engine, committed, discarded):
+    """
+    Call back once each transaction on the engine ends, with the connection's info dict.
+
+    SQLAlchemy's commit event fires before the commit is sent, so it only
+    marks the connection. A commit that raises reaches handle_error while
+    the mark is set; otherwise the commit went through, which is known at
+    the connection's next begin, or when it is checked in or invalidated.
+
+    Args:
+        engine: The (sync) engine whose transactions to follow.
+        committed (callable): Called with the info dict once a commit has succeeded.
+        discarded (callable): Called with the info dict when a transaction rolls
+            back, its commit raises, or its connection is checked in without
+            a commit, to drop anything left in it.
+    """
+    hooks = _commit_hooks.get(engine)
+    if hooks is None:
+        hooks = _commit_hooks[engine] = []
+
+        def run_committed(info):
+            if info.pop(_COMMITTING_KEY, False):
+                for on_success, _ in hooks:
+                    on_success(info)
+
+        def run_discarded(info):
+            info.pop(_COMMITTING_KEY, None)
+            for _, on_discard in hooks:
+                on_discard(info)
+
+        @event.listens_for(engine, "commit")
+        def _committing(connection):
+            connection.info[_COMMITTING_KEY] = True
+
+        @event.listens_for(engine, "handle_error")
+        def _commit_failed(context):
+            connection = context.connection
+            if connection is not None and not connection.invalidated and connection.info.get(_COMMITTING_KEY):
+                run_discarded(connection.info)
+
+        @event.listens_for(engine, "begin")
+        def _begin(connection):
+            run_committed(connection.info)
+
+        @event.listens_for(engine, "rollback")
+        def _rollback(connection):
+            run_discarded(connection.info)
+
+        @event.listens_for(engine, "checkin")
+        @event.listens_for(engine, "invalidate")
+        def _returned(dbapi_connection, connection_record, *args):
+            run_committed(connection_record.info)
+            run_discarded(connection_record.info)
+
+    hooks.append((committed, discarded))
+
+
+engine = create_engine(database_connection_url(), poolclass=TimedQueuePool, **pool_options("primary"))
+count_pre_ping_failures(engine, "primary")
+
+# For async def endpoints, so waiting on the database does not hold a thread
+async_engine = create_async_engine(
+    async_database_connection_url(), poolclass=TimedAsyncAdaptedQueuePool, **pool_options("primary_async")
+)
+count_pre_ping_failures(async_engine.sync_engine, "primary_async")
+
+
+replica_engine = None
+if replica_connection_url():
+    replica_engine = create_engine(replica_connection_url(), poolclass=TimedQueuePool, **pool_options("replica"))
+    count_pre_ping_failures(replica_engine, "replica")
+
+
+class ReplicaRouter:
+    """
+    Decides whether read-only work can go to the replica.
+
+    Replication lag is checked at most every REPLICA_CHECK_SECONDS. A replica
+    that is too far behind or cannot be reached is skipped, and reads fall
+    back to the primary until the next check or REPLICA_RETRY_SECONDS later.
+    """
+
+    def __init__(self, primary, replica, max_lag, check_interval, retry_interval):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._usable = False
+        self.lag_seconds = None
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.failures = 0
+
+    def usable(self):
+        if self.replica is None:
+            return False
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return self._usable
+            # Other callers keep the last answer while this one checks
+            self._next_check = time.monotonic() + self.check_interval
+        # The replica's own receive and replay positions agree whenever its
+        # WAL receiver is disconnected, so it is compared with the primary
+        with self.primary.connect() as connection:
+            primary_lsn = connection.execute(text("SELECT pg_current_wal_lsn()")).scalar_one()
+        try:
+            with self.replica.connect() as connection:
+                replica = connection.execute(text("""
+                    SELECT
+                        pg_is_in_recovery() AS in_recovery,
+                        pg_last_wal_replay_lsn() >= CAST(:primary_lsn AS pg_lsn) AS caught_up,
+                        EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) AS replay_age
+                """), {"primary_lsn": primary_lsn}).one()
+        except OperationalError:
+            self.mark_down()
+            return False
+        with self._lock:
+            if not replica.in_recovery or replica.caught_up:
+                self.lag_seconds = 0.0
+            elif replica.replay_age is None:
+                # Behind, and nothing replayed since it started
+                self.lag_seconds = None
+            else:
+                self.lag_seconds = float(replica.replay_age)
+            self._usable = self.lag_seconds is not None and self.lag_seconds <= self.max_lag
+            return self._usable
+
+    def mark_down(self):
+        logging.exception("Read replica unavailable, reading from the primary")
+        with self._lock:
+            self.failures += 1
+            self._usable = False
+            self._next_check = time.monotonic() + self.retry_interval
+
+    def count(self, replica):
+        with self._lock:
+            if replica:
+                self.replica_reads += 1
+            else:
+                self.primary_reads += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "configured": self.replica is not None,
+                "usable": self._usable,
+                "lag_seconds": self.lag_seconds,
+                "max_lag_seconds": self.max_lag,
+                "replica_reads": self.replica_reads,
+                "primary_reads": self.primary_reads,
+                "failures": self.failures,
+            }
+
+
+replica_router = ReplicaRouter(engine, replica_engine, REPLICA_MAX_LAG_SECONDS, REPLICA_CHECK_SECONDS, REPLICA_RETRY_SECONDS)
+
+
+_read_from_primary = ContextVar("read_from_primary", default=False)
+
+
+@contextmanager
+def primary_reads():
+    """Send read_connection() to the primary inside the block, for reads that must see recent writes."""
+    token = _read_from_primary.set(True)
+    try:
+        yield
+    finally:
+        _read_from_primary.reset(token)
+
+
+@contextmanager
+def read_connection():
+    """
+    Open a connection for read-only work.
+
+    Uses the replica when one is configured, reachable and within
+    REPLICA_MAX_LAG_SECONDS of the primary, and the primary otherwise. Only
+    use it for reads that can tolerate that much staleness, or wrap it in
+    primary_reads().
+    """
+    connection = None
+    if not _read_from_primary.get() and replica_router.usable():
+        try:
+            connection = replica_engine.connect()
+        except OperationalError:
+            replica_router.mark_down()
+    replica_router.count(connection is not None)
+    if connection is None:
+        connection = engine.connect()
+    with connection:
+        yield connection
+
+
+def pool_statuses():
+    statuses = {
+        "primary": pool_status(engine),
+        "primary_async": pool_status(async_engine.sync_engine),
+    }
+    if replica_engine is not None:
+        statuses["replica"] = pool_status(replica_engine)
+    return statuses
@@ -0,0 +1,255 @@
+import heapq
+import logging
+import os
+import threading
+import time
+import dotenv
+import sqlalchemy
+from src import battle
+from src import database as db
+from src.metrics import Counter, registry
+
+dotenv.load_dotenv()
+
+# A party needs DUNGEON_CLEAR_BASE_SECONDS plus DUNGEON_CLEAR_SECONDS_PER_ROUND
+# for every round it takes to deal the monsters' remaining health, capped at
+# DUNGEON_CLEAR_MAX_SECONDS (also used for parties with no power)
+DUNGEON_CLEAR_BASE_SECONDS = float(os.environ.get("DUNGEON_CLEAR_BASE_SECONDS", 30))
+DUNGEON_CLEAR_SECONDS_PER_ROUND = float(os.environ.get("DUNGEON_CLEAR_SECONDS_PER_ROUND", 1))
+DUNGEON_CLEAR_MAX_SECONDS = float(os.environ.get("DUNGEON_CLEAR_MAX_SECONDS", 3600))
+# Clears fired per transaction
+DUNGEON_CLEAR_BATCH = int(os.environ.get("DUNGEON_CLEAR_BATCH", 500))
+# How often pending clears are reloaded from dungeon_clear, which picks up
+# clears scheduled by other workers or lost with a worker that stopped
+DUNGEON_CLEAR_RESYNC_SECONDS = float(os.environ.get("DUNGEON_CLEAR_RESYNC_SECONDS", 60))
+
+PENDING_KEY = "pending_dungeon_clears"
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 30, 60, 300)
+
+# Closes the dungeon the party was just sent to and schedules its clear.
+# Expects the party's heroes to be in the dungeon already. Every dungeon it
+# closes has heroes in it, so gets a clear, even if none of them are alive.
+sql_schedule_clear = """
+WITH closed AS (
+    UPDATE dungeon
+    SET status = 'closed'
+    WHERE id = :dungeon_id AND status = 'open'
+    RETURNING id
+),
+party AS (
+    SELECT h.dungeon_id, SUM(CASE WHEN h.health > 0 THEN COALESCE(h.power, 0) ELSE 0 END) AS power
+    FROM hero h
+    WHERE h.dungeon_id IN (SELECT id FROM closed)
+    GROUP BY h.dungeon_id
+),
+rounds AS (
+    SELECT p.dungeon_id, CASE
+        WHEN p.power > 0 THEN ceil(CAST(COALESCE(SUM(m.health), 0) AS NUMERIC) / p.power)
+        ELSE NULL
+    END AS rounds
+    FROM party p
+    LEFT JOIN monster m ON m.dungeon_id = p.dungeon_id AND m.health > 0
+    GROUP BY p.dungeon_id, p.power
+)
+INSERT INTO dungeon_clear (dungeon_id, clear_at)
+SELECT dungeon_id, now() + make_interval(secs => COALESCE(
+    LEAST(:base_seconds + :seconds_per_round * rounds, :max_seconds),
+    :max_seconds
+))
+FROM rounds
+ON CONFLICT (dungeon_id) DO NOTHING
+RETURNING dungeon_id, EXTRACT(EPOCH FROM clear_at) AS clear_at
+"""
+
+# Claims clears the heap says are due, so each one fires on exactly one worker
+sql_claim_clears = """
+DELETE FROM dungeon_clear
+WHERE dungeon_id = ANY(CAST(:dungeon_ids AS BIGINT[]))
+RETURNING dungeon_id, EXTRACT(EPOCH FROM now() - clear_at) AS lag
+"""
+
+sql_load_clears = """
+SELECT dungeon_id, EXTRACT(EPOCH FROM clear_at) AS clear_at
+FROM dungeon_clear
+WHERE clear_at <= now() + make_interval(secs => :horizon)
+"""
+
+clear_lag = registry.histogram(
+    "dungeon_clear_lag_seconds",
+    "Time from a dungeon clear being due to it firing.",
+    (),
+    LAG_BUCKETS,
+)
+clears_fired = Counter()
+
+
+class ClearScheduler:
+    """
+    Fires dungeon clears when they fall due.
+
+    Pending clears sit in a heap ordered by due time, and the scheduler
+    thread sleeps until the earliest one rather than polling the table.
+    Clears are persisted in dungeon_clear, and the heap holds those due
+    before the next resync, so every worker can fire any of them; the
+    DELETE that claims a clear decides which worker does. Claiming and
+    resolving a batch share a transaction, so a failed batch stays in the
+    table and is fired after the next resync.
+    """
+
+    def __init__(self, batch, resync_seconds):
+        self.batch = batch
+        self.resync_seconds = resync_seconds
+        self._condition = threading.Condition()
+        self._heap = []
+        # Due time of every clear in the heap, so stale and repeated entries are skipped
+        self._due = {}
+        self._stopping = False
+        self._thread = None
+        self.batches = 0
+        self.failures = 0
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="dungeon-clear", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+
+    def add(self, clears):
+        """Queue (dungeon_id, clear_at) pairs, with clear_at in epoch seconds."""
+        with self._condition:
+            for dungeon_id, clear_at in clears:
+                if self._due.get(dungeon_id) == clear_at:
+                    continue
+                self._due[dungeon_id] = clear_at
+                heapq.heappush(self._heap, (clear_at, dungeon_id))
+            self._condition.notify_all()
+
+    def pending(self):
+        with self._condition:
+            return len(self._due)
+
+    def _take_due(self):
+        due = []
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch:
+            clear_at, dungeon_id = heapq.heappop(self._heap)
+            if self._due.get(dungeon_id) == clear_at:
+                del self._due[dungeon_id]
+                due.append(dungeon_id)
+        return due
+
+    def _run(self):
+        next_resync = 0
+        while True:
+            if time.monotonic() >= next_resync:
+                self._resync()
+                next_resync = time.monotonic() + self.resync_seconds
+            with self._condition:
+                while not self._stopping:
+                    due = self._take_due()
+                    if due:
+                        break
+                    wait = next_resync - time.monotonic()
+                    if self._heap:
+                        wait = min(wait, self._heap[0][0] - time.time())
+                    if wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                if self._stopping:
+                    return
+            if due:
+                self._fire(due)
+
+    def _resync(self):
+        try:
+            with db.engine.begin() as connection:
+                rows = connection.execute(sqlalchemy.text(sql_load_clears), {
+                    "horizon": self.resync_seconds,
+                }).fetchall()
+        except Exception:
+            logging.exception("Failed to load pending dungeon clears")
+            return
+        self.add((row.dungeon_id, float(row.clear_at)) for row in rows)
+
+    def _fire(self, dungeon_ids):
+        try:
+            with db.engine.begin() as connection:
+                claimed = connection.execute(sqlalchemy.text(sql_claim_clears), {
+                    "dungeon_ids": dungeon_ids,
+                }).fetchall()
+                if claimed:
+                    battle.resolve_dungeons(connection, [row.dungeon_id for row in claimed])
+        except Exception:
+            self.failures += 1
+            logging.exception(f"Failed to fire {len(dungeon_ids)} dungeon clears")
+            return
+        self.batches += 1
+        clears_fired.inc(len(claimed))
+        for row in claimed:
+            clear_lag.labels().observe(max(float(row.lag), 0.0))
+
+
+scheduler = ClearScheduler(DUNGEON_CLEAR_BATCH, DUNGEON_CLEAR_RESYNC_SECONDS)
+
+
+@registry.collector
+def _clear_metrics():
+    yield "dungeon_clears_total", "counter", "Dungeon clears fired.", [((), clears_fired.value)]
+    yield "dungeon_clears_pending", "gauge", "Dungeon clears queued in this process.", [((), scheduler.pending())]
+
+
+def schedule(connection, dungeon_id):
+    """
+    Close the dungeon a party was sent to and schedule when the party clears it.
+
+    The clear is handed to the scheduler once the transaction commits, and
+    dropped if it rolls back.
+
+    Args:
+        connection: The connection of the transaction that sent the party.
+        dungeon_id (int): The ID of the dungeon.
+
+    Returns:
+        list: The dungeon ID and clear time (epoch seconds) of the clear
+            scheduled, empty if the dungeon was not open.
+    """
+    clears = [
+        (row.dungeon_id, float(row.clear_at))
+        for row in connection.execute(sqlalchemy.text(sql_schedule_clear), {
+            "dungeon_id": dungeon_id,
+            "base_seconds": DUNGEON_CLEAR_BASE_SECONDS,
+            "seconds_per_round": DUNGEON_CLEAR_SECONDS_PER_ROUND,
+            "max_seconds": DUNGEON_CLEAR_MAX_SECONDS,
+        })
+    ]
+    connection.info.setdefault(PENDING_KEY, []).extend(clears)
+    return clears
+
+
+def _queue_committed(info):
+    clears = info.pop(PENDING_KEY, None)
+    if clears:
+        scheduler.add(clears)
+
+
+def _discard(info):
+    info.pop(PENDING_KEY, None)
+
+
+db.on_commit(db.engine, _queue_committed, _discard)
+
+
+def start():
+    scheduler.start()
+
+
+def stop():
+    scheduler.stop()
@@ -0,0 +1,170 @@
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from src import database as db
+from src import slow_queries
+from src.metrics import registry
+
+# SQL statements per request, from single lookups up to bulk endpoints
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 25, 50, 100, 250)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response.",
+    ("method", "route", "status"),
+)
+sql_statements = registry.histogram(
+    "http_request_sql_statements",
+    "SQL statements executed while handling a request.",
+    ("route",),
+    STATEMENT_BUCKETS,
+)
+sql_duration = registry.histogram(
+    "http_request_sql_duration_seconds",
+    "Total time a request spent waiting on SQL statements.",
+    ("route",),
+)
+sql_slowest_duration = registry.histogram(
+    "http_request_sql_slowest_seconds",
+    "Duration of the slowest SQL statement in a request.",
+    ("route",),
+)
+
+
+class RequestStats:
+    """SQL activity of the request being handled, filled in by the engine hooks."""
+
+    __slots__ = ("scope", "statements", "sql_seconds", "slowest_seconds", "slowest_statement")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+
+# Set for the duration of each request. Worker threads and asyncpg greenlets
+# run with a copy of the context, so they share the same RequestStats.
+current_request: ContextVar[RequestStats] = ContextVar("current_request", default=None)
+
+# The slowest statement seen on each route: (seconds, fingerprint)
+slowest_statements = {}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Statements on one connection run one at a time
+    conn.info["query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"]
+    stats = current_request.get()
+    if 0 < slow_queries.SLOW_QUERY_SECONDS <= elapsed:
+        slow_queries.log.capture(statement, parameters, elapsed, _route_name(stats), conn.dialect.paramstyle)
+    if stats is None:
+        return
+    stats.statements += 1
+    stats.sql_seconds += elapsed
+    if elapsed > stats.slowest_seconds:
+        stats.slowest_seconds = elapsed
+        stats.slowest_statement = statement
+
+
+def _route_name(stats):
+    if stats is None:
+        return "background"
+    route = stats.scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+for _engine in (db.engine, db.async_engine.sync_engine, db.replica_engine):
+    if _engine is not None:
+        instrument_engine(_engine)
+
+
+def _record(method, route, status, elapsed, stats):
+    http_request_duration.labels(method, route, str(status)).observe(elapsed)
+    sql_statements.labels(route).observe(stats.statements)
+    sql_duration.labels(route).observe(stats.sql_seconds)
+    if stats.statements:
+        sql_slowest_duration.labels(route).observe(stats.slowest_seconds)
+        worst = slowest_statements.get(route)
+        if worst is None or stats.slowest_seconds > worst[0]:
+            slowest_statements[route] = (stats.slowest_seconds, slow_queries.fingerprint(stats.slowest_statement))
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency and SQL activity for every HTTP request, labeled by route.
+
+    Routes are labeled with their path template (e.g. /hero/{hero_id}) so
+    that ids in the URL do not each get their own series. Requests that match
+    no route are grouped under "unmatched". Timing stops at the last body
+    chunk, so streamed responses include the queries run while streaming.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        status = 500
+        recorded = False
+
+        def finish():
+            nonlocal recorded
+            if not recorded:
+                recorded = True
+                _record(scope["method"], _route_name(stats), status, time.perf_counter() - start, stats)
+
+        async def send_and_record(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            finish()
+            current_request.reset(token)
+
+
+@registry.collector
+def _slowest_statements():
+    yield (
+        "http_route_slowest_sql_seconds",
+        "gauge",
+        "Slowest SQL statement seen on each route since the process started.",
+        [
+            ((("route", route), ("fingerprint", statement_fingerprint)), seconds)
+            for route, (seconds, statement_fingerprint) in sorted(slowest_statements.copy().items())
+        ],
+    )
+
+
+@registry.collector
+def _pool_metrics():
+    statuses = db.pool_statuses()
+    for field, kind, help in (
+        ("checked_out", "gauge", "Connections currently checked out of the pool."),
+        ("checked_in", "gauge", "Idle connections held by the pool."),
+        ("overflow", "gauge", "Connections open beyond the pool size."),
+        ("checkout_timeouts", "counter", "Checkouts that gave up after the pool timeout."),
+        ("pre_ping_failures", "counter", "Pooled connections found dead by the pre-ping."),
+    ):
+        name = f"db_pool_{field}" + ("_total" if kind == "counter" else "")
+        yield name, kind, help, [((("pool", pool),), status[field]) for pool, status in statuses.items()]
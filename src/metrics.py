@@ -0,0 +1,127 @@
+import bisect
+import threading
+
+# Upper bounds in seconds, from sub-millisecond waits up to the pool timeout
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Thread-safe cumulative histogram with fixed bucket bounds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Cumulative counts keyed by upper bound ("+Inf" last), plus the count and sum.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        buckets = {}
+        running = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            running += count
+            buckets[str(bound)] = running
+        return {"buckets": buckets, "count": running, "sum": total}
+
+
+class Counter:
+    """Thread-safe monotonically increasing counter."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+class HistogramFamily:
+    """A Prometheus histogram with one Histogram per combination of label values."""
+
+    def __init__(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, Histogram(self.buckets))
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        # labels() can add children from other threads while this renders
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            labels = list(zip(self.labelnames, values))
+            snapshot = child.snapshot()
+            for bound, count in snapshot["buckets"].items():
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', bound)])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {snapshot['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {snapshot['count']}")
+        return lines
+
+
+class Registry:
+    """
+    Metric families and callbacks rendered together in Prometheus text format.
+
+    Collectors are called at scrape time and return (name, type, help,
+    [(labels, value)]) tuples, for values such as pool occupancy that are
+    read rather than recorded.
+    """
+
+    def __init__(self):
+        self._families = []
+        self._collectors = []
+
+    def histogram(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        family = HistogramFamily(name, help, labelnames, buckets)
+        self._families.append(family)
+        return family
+
+    def collector(self, collect):
+        self._collectors.append(collect)
+        return collect
+
+    def render(self):
+        lines = []
+        for family in self._families:
+            lines += family.render()
+        for collect in self._collectors:
+            for name, kind, help, samples in collect():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{_format_labels(labels)} {value}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
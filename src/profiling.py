@@ -0,0 +1,134 @@
+import asyncio
+import cProfile
+import functools
+import os
+import pstats
+import random
+import sys
+import threading
+from contextvars import ContextVar
+import dotenv
+from fastapi.routing import APIRoute
+
+dotenv.load_dotenv()
+
+# Fraction of requests to profile; 0 turns sampling off
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+# Comma-separated route templates profiled on every request, e.g. /hero/status
+PROFILE_ROUTES = {route.strip() for route in os.environ.get("PROFILE_ROUTES", "").split(",") if route.strip()}
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+# Before Python 3.12 cProfile hooks only the thread that enables it. From
+# 3.12 it uses sys.monitoring, which sees every thread and allows a single
+# profiler in the process, so enabling a second one raises ValueError.
+PROFILER_PER_THREAD = sys.version_info < (3, 12)
+
+
+class RouteProfiles:
+    """cProfile stats of the profiled requests, aggregated per route."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._requests = {}
+        # Every async part of every request runs on the event loop thread, and
+        # from 3.12 there is one profiler per process, so only one request is
+        # profiled at once
+        self.loop_busy = False
+
+    def add(self, key, profilers):
+        with self._lock:
+            for profiler in profilers:
+                stats = self._stats.get(key)
+                if stats is None:
+                    self._stats[key] = pstats.Stats(profiler)
+                else:
+                    stats.add(profiler)
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    def dump(self, directory=PROFILE_DIR):
+        """
+        Write one pstats file per profiled route, replacing earlier dumps.
+
+        Returns:
+            list[dict]: The route, request count and file of each dump.
+        """
+        dumps = []
+        with self._lock:
+            if self._stats:
+                os.makedirs(directory, exist_ok=True)
+            for (method, path), stats in sorted(self._stats.items()):
+                name = "_".join(part.strip("{}") for part in path.split("/") if part) or "root"
+                filename = os.path.join(directory, f"{method}_{name}.pstats")
+                stats.dump_stats(filename)
+                dumps.append(
+                    {"method": method, "route": path, "requests": self._requests[(method, path)], "file": filename}
+                )
+        return dumps
+
+
+profiles = RouteProfiles()
+
+# The profilers of the request being profiled; before 3.12 sync endpoints
+# add their worker thread's profiler here
+current_profilers: ContextVar[list] = ContextVar("current_profilers", default=None)
+
+
+def _profile_in_thread(call):
+    @functools.wraps(call)
+    def profiled(*args, **kwargs):
+        profilers = current_profilers.get()
+        if profilers is None:
+            return call(*args, **kwargs)
+        profiler = cProfile.Profile()
+        profilers.append(profiler)
+        return profiler.runcall(call, *args, **kwargs)
+
+    return profiled
+
+
+class ProfiledRoute(APIRoute):
+    """
+    Route that profiles a sample of its requests with cProfile.
+
+    Requests to routes in PROFILE_ROUTES are always profiled, and a
+    PROFILE_SAMPLE_RATE fraction of the others. The profile covers auth,
+    request validation, the endpoint, response model validation and JSON
+    encoding. Before Python 3.12, sync endpoints run on a worker thread
+    that gets a profiler of its own; from 3.12 the request's profiler sees
+    every thread, including work for other requests. Async endpoints share
+    the event loop, so their profiles can include other requests' work that
+    ran while they awaited. Routes that
+    are not profiled run the plain FastAPI handler.
+    """
+
+    def get_route_handler(self):
+        always = self.path in PROFILE_ROUTES
+        if not always and PROFILE_SAMPLE_RATE <= 0:
+            return super().get_route_handler()
+
+        if PROFILER_PER_THREAD and not asyncio.iscoroutinefunction(self.dependant.call):
+            self.dependant.call = _profile_in_thread(self.dependant.call)
+        handler = super().get_route_handler()
+        key = (",".join(sorted(self.methods)), self.path)
+
+        async def profiled_handler(request):
+            if not (always or random.random() < PROFILE_SAMPLE_RATE):
+                return await handler(request)
+            if profiles.loop_busy:
+                return await handler(request)
+
+            profiler = cProfile.Profile()
+            profilers = [profiler]
+            token = current_profilers.set(profilers)
+            profiles.loop_busy = True
+            profiler.enable()
+            try:
+                return await handler(request)
+            finally:
+                profiler.disable()
+                profiles.loop_busy = False
+                current_profilers.reset(token)
+                profiles.add(key, profilers)
+
+        return profiled_handler
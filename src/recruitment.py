@@ -0,0 +1,62 @@
+import os
+import dotenv
+import sqlalchemy
+from src import database as db
+
+dotenv.load_dotenv()
+
+# Pending invites older than this are withdrawn
+RECRUITMENT_EXPIRY_DAYS = float(os.environ.get("RECRUITMENT_EXPIRY_DAYS", 7))
+# Accepted and rejected invites are kept this long after their answer
+RECRUITMENT_RETENTION_DAYS = float(os.environ.get("RECRUITMENT_RETENTION_DAYS", 30))
+RECRUITMENT_SWEEP_SECONDS = float(os.environ.get("RECRUITMENT_SWEEP_SECONDS", 300))
+# Rows deleted per transaction, so a sweep never holds many locks at once
+RECRUITMENT_SWEEP_BATCH = int(os.environ.get("RECRUITMENT_SWEEP_BATCH", 1000))
+
+# Each statement deletes one batch through the partial indexes on
+# request_date (pending) and response_date (answered)
+sql_expire_pending = """
+DELETE FROM recruitment
+WHERE id IN (
+    SELECT id FROM recruitment
+    WHERE status = 'pending' AND request_date < now() - make_interval(secs => :max_age)
+    LIMIT :batch
+    FOR UPDATE SKIP LOCKED
+)
+"""
+
+sql_delete_answered = """
+DELETE FROM recruitment
+WHERE id IN (
+    SELECT id FROM recruitment
+    WHERE status <> 'pending' AND response_date < now() - make_interval(secs => :max_age)
+    LIMIT :batch
+    FOR UPDATE SKIP LOCKED
+)
+"""
+
+
+def _delete_in_batches(sql, max_age_days):
+    deleted = 0
+    while True:
+        with db.engine.begin() as connection:
+            count = connection.execute(sqlalchemy.text(sql), {
+                "max_age": max_age_days * 86400,
+                "batch": RECRUITMENT_SWEEP_BATCH,
+            }).rowcount
+        deleted += count
+        if count < RECRUITMENT_SWEEP_BATCH:
+            return deleted
+
+
+def sweep():
+    """
+    Delete expired pending invites and old answered ones, one batch per transaction.
+
+    Returns:
+        dict: The number of pending and answered invites deleted.
+    """
+    return {
+        "expired": _delete_in_batches(sql_expire_pending, RECRUITMENT_EXPIRY_DAYS),
+        "answered_deleted": _delete_in_batches(sql_delete_answered, RECRUITMENT_RETENTION_DAYS),
+    }
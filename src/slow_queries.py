@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+from collections import deque
+from datetime import datetime, timezone
+import dotenv
+from src import database as db
+
+dotenv.load_dotenv()
+
+# Statements at least this slow are captured; 0 or less turns capture off
+SLOW_QUERY_SECONDS = float(os.environ.get("SLOW_QUERY_SECONDS", 0.5))
+# Fraction of captured statements that also get an EXPLAIN plan
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.environ.get("SLOW_QUERY_EXPLAIN_SAMPLE", 0.1))
+SLOW_QUERY_EXPLAIN_TIMEOUT_SECONDS = float(os.environ.get("SLOW_QUERY_EXPLAIN_TIMEOUT_SECONDS", 30))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get("SLOW_QUERY_LOG_SIZE", 200))
+# Optional file that also gets one JSON line per captured statement
+SLOW_QUERY_LOG_FILE = os.environ.get("SLOW_QUERY_LOG_FILE")
+# Longest parameter text kept per statement, since some bind thousands of ids
+MAX_PARAMETERS_LENGTH = 2000
+
+_NUMBERED_PARAMETER = re.compile(r"\$(\d+)")
+# A list of placeholders, as SQLAlchemy expands IN parameters into
+_PLACEHOLDER_LIST = re.compile(r"(%\(\w+\)s|\$\d+)(\s*,\s*(%\(\w+\)s|\$\d+))+")
+_LOCKING_CLAUSE = re.compile(r"\bFOR\s+(NO\s+KEY\s+)?(UPDATE|SHARE)\b|\bFOR\s+KEY\s+SHARE\b", re.IGNORECASE)
+
+
+def fingerprint(statement):
+    """
+    Short hash identifying a statement, the same however many values an IN
+    parameter expanded to.
+    """
+    normalized = _PLACEHOLDER_LIST.sub("?", " ".join(statement.split()))
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+class SlowQueryLog:
+    """
+    Ring buffer of the most recent slow statements.
+
+    A sample of the captured statements are explained on a background
+    thread, over a separate connection to the primary, so capturing a plan
+    never adds latency to the request that ran the statement. Only plain
+    SELECTs are run with ANALYZE; anything that could write is explained
+    without running it.
+    """
+
+    def __init__(self, size, explain_sample):
+        self.explain_sample = explain_sample
+        self._lock = threading.Lock()
+        self._entries = deque(maxlen=size)
+        self._explain_queue = queue.Queue(maxsize=size)
+        self._thread = None
+        self.captured = 0
+        self.explained = 0
+        self.explain_dropped = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="slow-query-explain", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._explain_queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def capture(self, statement, parameters, seconds, route, paramstyle):
+        entry = {
+            "logged_at": datetime.now(timezone.utc).isoformat(),
+            "route": route,
+            "duration_seconds": seconds,
+            "statement": statement,
+            "fingerprint": fingerprint(statement),
+            "parameters": repr(parameters)[:MAX_PARAMETERS_LENGTH],
+            "plan": None,
+            "plan_error": None,
+        }
+        logging.warning(f"Slow query ({seconds:.3f}s) on {route}: {' '.join(statement.split())}")
+        with self._lock:
+            self._entries.append(entry)
+            self.captured += 1
+
+        if self._thread is not None and random.random() < self.explain_sample:
+            try:
+                self._explain_queue.put_nowait((entry, statement, parameters, paramstyle))
+                return
+            except queue.Full:
+                with self._lock:
+                    self.explain_dropped += 1
+        write_entry(entry)
+
+    def entries(self, limit):
+        """Returns the `limit` most recent entries, newest first."""
+        with self._lock:
+            return [dict(entry) for entry in reversed(self._entries)][:limit]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threshold_seconds": SLOW_QUERY_SECONDS,
+                "explain_sample": self.explain_sample,
+                "captured": self.captured,
+                "explained": self.explained,
+                "explain_dropped": self.explain_dropped,
+            }
+
+    def _run(self):
+        while True:
+            item = self._explain_queue.get()
+            if item is None:
+                return
+            entry, statement, parameters, paramstyle = item
+            try:
+                plan = explain(statement, parameters, paramstyle)
+                with self._lock:
+                    entry["plan"] = plan
+                    self.explained += 1
+            except Exception as e:
+                with self._lock:
+                    entry["plan_error"] = str(e).strip()
+            write_entry(entry)
+
+
+def explain(statement, parameters, paramstyle):
+    """
+    Get the plan of a captured statement.
+
+    Statements captured from the asyncpg engine use numbered parameters
+    ($1, $2, ...), which are rewritten to psycopg2's named style first.
+    Statements that depend on temporary tables or uncommitted rows of the
+    original transaction cannot be explained and raise instead.
+
+    Returns:
+        str: The text plan, with actual row counts and buffers for SELECTs.
+    """
+    if paramstyle == "numeric_dollar":
+        statement = _NUMBERED_PARAMETER.sub(r"%(p\1)s", statement.replace("%", "%%"))
+        parameters = {f"p{i}": value for i, value in enumerate(parameters or (), start=1)}
+    analyze = statement.lstrip().upper().startswith("SELECT") and not _LOCKING_CLAUSE.search(statement)
+    options = "ANALYZE, BUFFERS" if analyze else "COSTS"
+
+    # A raw DBAPI connection keeps the EXPLAIN itself out of the request
+    # metrics and out of the slow query log
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SET LOCAL statement_timeout = %s", (int(SLOW_QUERY_EXPLAIN_TIMEOUT_SECONDS * 1000),))
+        cursor.execute(f"EXPLAIN ({options}) {statement}", parameters)
+        return "\n".join(row[0] for row in cursor.fetchall())
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def write_entry(entry):
+    if not SLOW_QUERY_LOG_FILE:
+        return
+    try:
+        with open(SLOW_QUERY_LOG_FILE, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+    except OSError:
+        logging.exception("Could not write to the slow query log file")
+
+
+log = SlowQueryLog(SLOW_QUERY_LOG_SIZE, SLOW_QUERY_EXPLAIN_SAMPLE)
+
+
+def start():
+    if SLOW_QUERY_SECONDS > 0:
+        log.start()
+
+
+def stop():
+    log.stop()
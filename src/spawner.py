@@ -0,0 +1,109 @@
+import os
+import time
+import dotenv
+import sqlalchemy
+from src import database as db
+from src.metrics import Counter, registry
+
+dotenv.load_dotenv()
+
+MONSTER_SPAWN_SECONDS = float(os.environ.get("MONSTER_SPAWN_SECONDS", 60))
+# Dungeons refilled per tick and monsters added to each, which bound the
+# cost of a tick however many dungeons there are
+MONSTER_SPAWN_MAX_DUNGEONS = int(os.environ.get("MONSTER_SPAWN_MAX_DUNGEONS", 500))
+MONSTER_SPAWN_MAX_PER_DUNGEON = int(os.environ.get("MONSTER_SPAWN_MAX_PER_DUNGEON", 10))
+MONSTER_SPAWN_TYPES = [
+    monster_type.strip()
+    for monster_type in os.environ.get("MONSTER_SPAWN_TYPES", "Slime,Goblin,Skeleton,Orc,Troll").split(",")
+    if monster_type.strip()
+]
+# Spawned monsters take the dungeon's level, with health and power scaled by it
+MONSTER_SPAWN_HEALTH_PER_LEVEL = int(os.environ.get("MONSTER_SPAWN_HEALTH_PER_LEVEL", 3))
+MONSTER_SPAWN_POWER_PER_LEVEL = int(os.environ.get("MONSTER_SPAWN_POWER_PER_LEVEL", 1))
+
+# Refills the next :max_dungeons open dungeons with room after :after_id,
+# found through dungeon_spawnable_idx. Dungeons another transaction has
+# locked are left for the next tick.
+sql_spawn = """
+WITH due AS (
+    SELECT id, GREATEST(level, 1) AS level, monster_capacity - monster_count AS missing
+    FROM dungeon
+    WHERE status = 'open' AND monster_count < monster_capacity AND id > :after_id
+    ORDER BY id
+    LIMIT :max_dungeons
+    FOR UPDATE SKIP LOCKED
+),
+spawned AS (
+    INSERT INTO monster (type, level, health, power, dungeon_id)
+    SELECT
+        (CAST(:types AS TEXT[]))[1 + floor(random() * cardinality(CAST(:types AS TEXT[])))::INT],
+        due.level,
+        due.level * :health_per_level,
+        due.level * :power_per_level,
+        due.id
+    FROM due
+    CROSS JOIN LATERAL generate_series(1, LEAST(due.missing, :max_per_dungeon))
+    RETURNING dungeon_id
+),
+counted AS (
+    UPDATE dungeon d
+    SET monster_count = d.monster_count + s.spawned
+    FROM (SELECT dungeon_id, COUNT(*) AS spawned FROM spawned GROUP BY dungeon_id) s
+    WHERE d.id = s.dungeon_id
+)
+SELECT
+    (SELECT MAX(id) FROM due) AS last_dungeon_id,
+    (SELECT COUNT(*) FROM due) AS dungeons,
+    (SELECT COUNT(*) FROM spawned) AS monsters
+"""
+
+tick_duration = registry.histogram(
+    "monster_spawner_tick_seconds",
+    "Time taken by one monster spawner tick.",
+    (),
+)
+monsters_spawned = Counter()
+dungeons_refilled = Counter()
+
+
+@registry.collector
+def _spawner_metrics():
+    yield "monster_spawner_monsters_total", "counter", "Monsters spawned.", [((), monsters_spawned.value)]
+    yield "monster_spawner_dungeons_total", "counter", "Dungeon refills.", [((), dungeons_refilled.value)]
+
+
+# Where the next tick resumes, so every dungeon gets its turn when more
+# than MONSTER_SPAWN_MAX_DUNGEONS need monsters
+_next_after_id = 0
+
+
+def spawn():
+    """
+    Spawn the missing monsters of up to MONSTER_SPAWN_MAX_DUNGEONS open dungeons in one statement.
+
+    Returns:
+        dict: The dungeons refilled, monsters spawned and monsters per second.
+    """
+    global _next_after_id
+    start = time.perf_counter()
+    with db.engine.begin() as connection:
+        result = connection.execute(sqlalchemy.text(sql_spawn), {
+            "after_id": _next_after_id,
+            "max_dungeons": MONSTER_SPAWN_MAX_DUNGEONS,
+            "max_per_dungeon": MONSTER_SPAWN_MAX_PER_DUNGEON,
+            "types": MONSTER_SPAWN_TYPES,
+            "health_per_level": MONSTER_SPAWN_HEALTH_PER_LEVEL,
+            "power_per_level": MONSTER_SPAWN_POWER_PER_LEVEL,
+        }).one()
+    elapsed = time.perf_counter() - start
+
+    # Start over from the lowest id once the end has been reached
+    _next_after_id = result.last_dungeon_id if result.dungeons == MONSTER_SPAWN_MAX_DUNGEONS else 0
+    tick_duration.labels().observe(elapsed)
+    monsters_spawned.inc(result.monsters)
+    dungeons_refilled.inc(result.dungeons)
+    return {
+        "dungeons": result.dungeons,
+        "monsters": result.monsters,
+        "monsters_per_second": result.monsters / elapsed if elapsed > 0 else 0.0,
+    }
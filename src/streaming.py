@@ -0,0 +1,48 @@
+import os
+import dotenv
+import sqlalchemy
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from src import database as db
+
+dotenv.load_dotenv()
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Rows fetched from the server-side cursor per round trip
+STREAM_BATCH_ROWS = int(os.environ.get("STREAM_BATCH_ROWS", 1000))
+
+
+def wants_ndjson(request: Request):
+    """Whether the client asked for newline-delimited JSON in its Accept header."""
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def stream_rows(sql, params, to_item):
+    """
+    Stream a query's rows to the client as newline-delimited JSON.
+
+    Rows are read through a server-side cursor in batches of STREAM_BATCH_ROWS
+    and each batch is written out as it arrives, so memory use and time to
+    first byte do not depend on the size of the result. Queries must be
+    read-only, since they run on the read replica when it is usable. The
+    connection is held until the last row is sent or the client disconnects.
+
+    Args:
+        sql (str): The query to run.
+        params (dict): The query's bind parameters.
+        to_item (callable): Turns a row into the Pydantic model sent for it.
+
+    Returns:
+        StreamingResponse: One JSON object per line.
+    """
+
+    def generate():
+        with db.read_connection() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=STREAM_BATCH_ROWS).execute(
+                sqlalchemy.text(sql), params
+            )
+            # One chunk per batch keeps the per-write overhead off every row
+            for rows in result.partitions():
+                yield "".join(to_item(row).json() + "\n" for row in rows)
+
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,386 @@
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import chain, repeat
+import anyio
+import dotenv
+import sqlalchemy
+from src import database as db
+
+dotenv.load_dotenv()
+
+# "sync" writes targeting rows in the attacking transaction. "buffered" queues
+# them in process and flushes them in batches with COPY, trading up to
+# TARGETING_FLUSH_SECONDS (or TARGETING_BUFFER_ROWS rows) of history on a
+# crash for far fewer writes per attack.
+TARGETING_WRITE_MODE = os.environ.get("TARGETING_WRITE_MODE", "sync")
+TARGETING_BUFFER_ROWS = int(os.environ.get("TARGETING_BUFFER_ROWS", 50000))
+TARGETING_FLUSH_ROWS = int(os.environ.get("TARGETING_FLUSH_ROWS", 5000))
+TARGETING_FLUSH_SECONDS = float(os.environ.get("TARGETING_FLUSH_SECONDS", 1))
+TARGETING_ENQUEUE_TIMEOUT = float(os.environ.get("TARGETING_ENQUEUE_TIMEOUT", 0.5))
+# Months of raw targeting rows kept; the rollup keeps totals for good
+TARGETING_RETENTION_MONTHS = int(os.environ.get("TARGETING_RETENTION_MONTHS", 12))
+TARGETING_PARTITIONS_AHEAD = int(os.environ.get("TARGETING_PARTITIONS_AHEAD", 3))
+# Attempts at writing a batch before it is split up to find the rows that fail
+TARGETING_FLUSH_RETRIES = int(os.environ.get("TARGETING_FLUSH_RETRIES", 3))
+
+PENDING_KEY = "pending_targeting"
+
+
+class TargetingBuffer:
+    """
+    Bounded write-behind buffer for targeting rows.
+
+    Rows take capacity from the moment they are recorded until their batch has
+    been flushed, so the buffer never holds more than `capacity` rows. Callers
+    that cannot get capacity in time write synchronously instead. A batch that
+    still fails after `flush_retries` attempts is split in halves until the
+    rows that cannot be written are found, and those are dropped with a log
+    line, so one bad row cannot hold up the rows behind it.
+    """
+
+    def __init__(self, capacity, flush_rows, flush_seconds, flush_retries=TARGETING_FLUSH_RETRIES):
+        self.capacity = capacity
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.flush_retries = flush_retries
+        self._condition = threading.Condition()
+        self._rows = []
+        # The batch the flush thread is writing
+        self._flushing = []
+        self._used = 0
+        self._stopping = False
+        self._thread = None
+        self.rows_flushed = 0
+        self.flushes = 0
+        self.flush_failures = 0
+        self.sync_fallbacks = 0
+        self.rows_dropped = 0
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="targeting-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flush everything that has been committed and stop the flush thread."""
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+
+    def try_reserve(self, count):
+        """Reserve capacity only if it is free now, without counting a fallback."""
+        with self._condition:
+            if self._stopping or self._used + count > self.capacity:
+                return False
+            self._used += count
+            return True
+
+    def reserve(self, count, timeout):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._used + count > self.capacity:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopping:
+                    self.sync_fallbacks += 1
+                    return False
+                self._condition.wait(remaining)
+            self._used += count
+            return True
+
+    def release(self, count):
+        with self._condition:
+            self._used -= count
+            self._condition.notify_all()
+
+    def add(self, rows):
+        """Queue rows whose capacity was already reserved and whose transaction committed."""
+        with self._condition:
+            self._rows.extend(rows)
+            if len(self._rows) >= self.flush_rows:
+                self._condition.notify_all()
+
+    def has_rows_for(self, hero_id):
+        """Whether committed rows of the hero are still waiting to be written."""
+        with self._condition:
+            return any(row[0] == hero_id for row in chain(self._rows, self._flushing))
+
+    def stats(self):
+        with self._condition:
+            return {
+                "mode": TARGETING_WRITE_MODE,
+                "buffered_rows": len(self._rows),
+                "reserved_rows": self._used,
+                "rows_flushed": self.rows_flushed,
+                "flushes": self.flushes,
+                "flush_failures": self.flush_failures,
+                "sync_fallbacks": self.sync_fallbacks,
+                "rows_dropped": self.rows_dropped,
+            }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_seconds
+                while len(self._rows) < self.flush_rows and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch, self._rows = self._rows[:self.flush_rows], self._rows[self.flush_rows:]
+                self._flushing = batch
+                stopping = self._stopping
+            if batch:
+                self._flush_with_retry(batch, stopping)
+                with self._condition:
+                    self._flushing = []
+                self.release(len(batch))
+            elif stopping:
+                return
+
+    def _flush_with_retry(self, batch, stopping):
+        for attempt in range(self.flush_retries):
+            if attempt:
+                if stopping or self._stopping:
+                    self._drop(batch, "on shutdown")
+                    return
+                time.sleep(self.flush_seconds)
+            if self._try_flush(batch):
+                return
+        self._flush_split(batch)
+
+    def _flush_split(self, batch):
+        if len(batch) == 1:
+            self._drop(batch, "that cannot be written")
+            return
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            if not self._try_flush(half):
+                self._flush_split(half)
+
+    def _try_flush(self, batch):
+        try:
+            flush(batch)
+        except Exception:
+            self.flush_failures += 1
+            logging.exception(f"Failed to flush {len(batch)} targeting rows")
+            return False
+        self.rows_flushed += len(batch)
+        self.flushes += 1
+        return True
+
+    def _drop(self, rows, reason):
+        self.rows_dropped += len(rows)
+        logging.error(f"Dropping {len(rows)} targeting rows {reason}: {rows[:10]}")
+
+
+buffer = TargetingBuffer(TARGETING_BUFFER_ROWS, TARGETING_FLUSH_ROWS, TARGETING_FLUSH_SECONDS)
+
+# Expects the caller to define an `attacks` CTE of (hero_id, monster_id, damage, logged_at)
+sql_log_attacks = """
+    logged AS (
+        INSERT INTO targeting (hero_id, monster_id, damage, timestamp)
+        SELECT hero_id, monster_id, damage, logged_at
+        FROM attacks
+    ),
+    pairs AS (
+        INSERT INTO targeting_rollup AS r (hero_id, monster_id, total_damage, attack_count, first_attack, last_attack)
+        SELECT hero_id, monster_id, SUM(damage), COUNT(*), MIN(logged_at), MAX(logged_at)
+        FROM attacks
+        GROUP BY hero_id, monster_id
+        ORDER BY hero_id, monster_id
+        ON CONFLICT (hero_id, monster_id) DO UPDATE
+        SET total_damage = r.total_damage + EXCLUDED.total_damage,
+            attack_count = r.attack_count + EXCLUDED.attack_count,
+            first_attack = LEAST(r.first_attack, EXCLUDED.first_attack),
+            last_attack = GREATEST(r.last_attack, EXCLUDED.last_attack)
+        RETURNING r.hero_id, (r.xmax = 0) AS inserted
+    ),
+    new_battles AS (
+        SELECT hero_id, COUNT(*) AS battles
+        FROM pairs
+        WHERE inserted
+        GROUP BY hero_id
+    )
+    INSERT INTO hero_battle_summary AS s (hero_id, total_battles, total_damage, last_battle)
+    SELECT a.hero_id, COALESCE(MAX(n.battles), 0), SUM(a.damage), MAX(a.logged_at)
+    FROM attacks a
+    LEFT JOIN new_battles n ON n.hero_id = a.hero_id
+    GROUP BY a.hero_id
+    ORDER BY a.hero_id
+    ON CONFLICT (hero_id) DO UPDATE
+    SET total_battles = s.total_battles + EXCLUDED.total_battles,
+        total_damage = s.total_damage + EXCLUDED.total_damage,
+        last_battle = GREATEST(s.last_battle, EXCLUDED.last_battle)
+"""
+
+# Runs after sql_log_attacks so new pairs with an already dead monster are counted too
+sql_record_defeats = """
+    WITH defeats AS (
+        UPDATE targeting_rollup r
+        SET defeated = TRUE
+        FROM monster m
+        WHERE m.id = ANY(CAST(:monster_ids AS BIGINT[])) AND m.health <= 0
+            AND r.monster_id = m.id AND NOT r.defeated
+        RETURNING r.hero_id
+    )
+    UPDATE hero_battle_summary s
+    SET monsters_defeated = s.monsters_defeated + d.defeated
+    FROM (SELECT hero_id, COUNT(*) AS defeated FROM defeats GROUP BY hero_id) d
+    WHERE s.hero_id = d.hero_id
+"""
+
+
+def flush(rows):
+    """Write a batch of (hero_id, monster_id, damage, logged_at) rows with COPY."""
+    data = io.StringIO()
+    for hero_id, monster_id, damage, logged_at in rows:
+        data.write(f"{hero_id}\t{monster_id}\t{damage}\t{logged_at.isoformat()}\n")
+    data.seek(0)
+
+    with db.engine.begin() as connection:
+        cursor = connection.connection.cursor()
+        # Staging through timestamptz keeps the event time correct in the session's time zone
+        cursor.execute("""
+            CREATE TEMP TABLE targeting_staging (
+                hero_id BIGINT, monster_id BIGINT, damage INT, logged_at TIMESTAMPTZ
+            ) ON COMMIT DROP
+        """)
+        cursor.copy_expert("COPY targeting_staging FROM STDIN", data)
+        connection.execute(sqlalchemy.text("""
+            WITH attacks AS (
+                SELECT hero_id, monster_id, damage, CAST(logged_at AS TIMESTAMP) AS logged_at
+                FROM targeting_staging
+            ),
+        """ + sql_log_attacks))
+        connection.execute(sqlalchemy.text(sql_record_defeats), {
+            "monster_ids": list({monster_id for _, monster_id, _, _ in rows})
+        })
+
+
+def insert(connection, hero_ids, monster_ids, damages):
+    connection.execute(sqlalchemy.text("""
+        WITH attacks AS (
+            SELECT hero_id, monster_id, damage, LOCALTIMESTAMP AS logged_at
+            FROM unnest(CAST(:hero_ids AS BIGINT[]), CAST(:monster_ids AS BIGINT[]), CAST(:damages AS INT[]))
+                AS a(hero_id, monster_id, damage)
+        ),
+    """ + sql_log_attacks), {"hero_ids": hero_ids, "monster_ids": monster_ids, "damages": damages})
+    connection.execute(sqlalchemy.text(sql_record_defeats), {"monster_ids": list(set(monster_ids))})
+
+
+def record(connection, hero_ids, monster_ids, damages):
+    """
+    Record attacks in the targeting log as part of the caller's transaction.
+
+    In buffered mode the rows are handed to the flush thread only once the
+    transaction commits, and are dropped if it rolls back.
+
+    Args:
+        connection: The connection of the transaction making the attacks.
+        hero_ids (list[int]): The hero of each attack.
+        monster_ids (list[int]): The monster of each attack.
+        damages (list[int]): The damage each hero dealt, 0 for monster attacks.
+    """
+    if not hero_ids:
+        return
+    if buffer.running and buffer.reserve(len(hero_ids), TARGETING_ENQUEUE_TIMEOUT):
+        _defer(connection, hero_ids, monster_ids, damages)
+        return
+    insert(connection, hero_ids, monster_ids, damages)
+
+
+async def record_async(connection, hero_ids, monster_ids, damages):
+    """
+    Record attacks in the targeting log from an async def endpoint.
+
+    Like record(), but waiting for buffer capacity happens on a worker
+    thread, so a full buffer never blocks the event loop.
+
+    Args:
+        connection: The AsyncConnection of the transaction making the attacks.
+        hero_ids (list[int]): The hero of each attack.
+        monster_ids (list[int]): The monster of each attack.
+        damages (list[int]): The damage each hero dealt, 0 for monster attacks.
+    """
+    if not hero_ids:
+        return
+    if buffer.running:
+        count = len(hero_ids)
+        reserved = buffer.try_reserve(count) or await anyio.to_thread.run_sync(
+            buffer.reserve, count, TARGETING_ENQUEUE_TIMEOUT
+        )
+        if reserved:
+            _defer(connection, hero_ids, monster_ids, damages)
+            return
+    await connection.run_sync(insert, hero_ids, monster_ids, damages)
+
+
+def _defer(connection, hero_ids, monster_ids, damages):
+    # Reserved rows wait on the connection until its transaction commits
+    logged_at = datetime.now(timezone.utc)
+    connection.info.setdefault(PENDING_KEY, []).extend(
+        zip(hero_ids, monster_ids, damages, repeat(logged_at))
+    )
+
+
+def _queue_committed(info):
+    rows = info.pop(PENDING_KEY, None)
+    if rows:
+        buffer.add(rows)
+
+
+def _discard(info):
+    rows = info.pop(PENDING_KEY, None)
+    if rows:
+        buffer.release(len(rows))
+
+
+for _engine in (db.engine, db.async_engine.sync_engine):
+    db.on_commit(_engine, _queue_committed, _discard)
+
+
+def maintain_partitions():
+    """
+    Create the targeting partitions for the coming months and drop those past retention.
+
+    Returns:
+        tuple: The names of the partitions created and of those dropped.
+    """
+    with db.engine.begin() as connection:
+        created = connection.execute(sqlalchemy.text("""
+            SELECT partition_name
+            FROM generate_series(
+                date_trunc('month', LOCALTIMESTAMP),
+                date_trunc('month', LOCALTIMESTAMP) + make_interval(months => :months_ahead),
+                INTERVAL '1 month'
+            ) AS month,
+            ensure_targeting_partition(CAST(month AS DATE)) AS partition_name
+            WHERE partition_name IS NOT NULL
+        """), {"months_ahead": TARGETING_PARTITIONS_AHEAD}).scalars().all()
+        dropped = connection.execute(sqlalchemy.text("""
+            SELECT drop_targeting_partitions(
+                date_trunc('month', LOCALTIMESTAMP) - make_interval(months => :retention_months)
+            )
+        """), {"retention_months": TARGETING_RETENTION_MONTHS}).scalars().all()
+    return created, dropped
+
+
+def start():
+    if TARGETING_WRITE_MODE == "buffered":
+        buffer.start()
+
+
+def stop():
+    buffer.stop()
@@ -0,0 +1,165 @@
+import logging
+import os
+import dotenv
+import sqlalchemy
+from src import database as db
+
+dotenv.load_dotenv()
+
+# Seconds of real time per game tick in every world; 0 or less stops the clock
+WORLD_TICK_SECONDS = float(os.environ.get("WORLD_TICK_SECONDS", 0))
+# Heroes updated per statement (and per transaction)
+WORLD_TICK_CHUNK = int(os.environ.get("WORLD_TICK_CHUNK", 5000))
+WORLD_TICK_AGE_YEARS = int(os.environ.get("WORLD_TICK_AGE_YEARS", 1))
+# Health regained per tick by living heroes outside a dungeon, up to the cap
+WORLD_TICK_REGEN = int(os.environ.get("WORLD_TICK_REGEN", 5))
+WORLD_TICK_MAX_HEALTH = int(os.environ.get("WORLD_TICK_MAX_HEALTH", 100))
+
+# XP needed per level, as in /hero/raise_level
+XP_PER_LEVEL = 100
+
+# Claims the world's next tick unless another worker already took it within
+# the interval, so the tick rate does not depend on the number of workers.
+# tick_after_id tracks the heroes done until the tick is complete.
+sql_claim_tick = """
+UPDATE world
+SET tick = tick + 1, last_tick_at = now(), tick_after_id = 0
+WHERE id = :world_id
+AND tick_after_id IS NULL
+AND (last_tick_at IS NULL OR last_tick_at <= now() - make_interval(secs => :min_interval))
+RETURNING tick_after_id
+"""
+
+# Ages, heals and levels up the next chunk of a world's heroes, walking
+# hero_world_id_idx from :after_id, and records the progress in the same
+# transaction
+sql_tick_heroes = """
+WITH chunk AS (
+    SELECT id, xp
+    FROM hero
+    WHERE world_id = :world_id AND id > :after_id
+    ORDER BY id
+    LIMIT :chunk
+),
+updated AS (
+    UPDATE hero h
+    SET age = h.age + :age_years,
+        health = CASE
+            WHEN h.dungeon_id IS NULL AND h.health > 0 AND h.health < :max_health THEN LEAST(h.health + :regen, :max_health)
+            ELSE h.health
+        END,
+        level = h.level + h.xp / :xp_per_level,
+        xp = h.xp % :xp_per_level
+    -- An id array keeps the update on the primary key; joining the chunk
+    -- plans as a hash join over the whole table
+    WHERE h.id = ANY(ARRAY(SELECT id FROM chunk))
+    RETURNING h.id
+),
+progress AS (
+    UPDATE world
+    SET tick_after_id = CASE
+        WHEN (SELECT COUNT(*) FROM chunk) < :chunk THEN NULL
+        ELSE (SELECT MAX(id) FROM chunk)
+    END
+    WHERE id = :world_id
+)
+SELECT MAX(u.id) AS last_id, COUNT(*) AS heroes, COALESCE(SUM(c.xp / :xp_per_level), 0) AS levels_gained
+FROM updated u
+JOIN chunk c ON c.id = u.id
+"""
+
+
+def tick_world(connection, world_id, min_interval):
+    """
+    Advance one world by a tick, one chunk of heroes per transaction.
+
+    A session advisory lock on the world keeps two workers from ticking it
+    at once, and is held across the chunks. Each chunk commits the last hero
+    it did as world.tick_after_id, so a tick that fails part way is resumed
+    from there on the next run rather than skipped for the remaining heroes.
+
+    Args:
+        connection: A connection with no transaction in progress.
+        world_id (int): The world to advance.
+        min_interval (float): Skip the world if it was ticked more recently than this.
+
+    Returns:
+        dict: The heroes updated and levels gained, or None if the world was skipped.
+    """
+    # Advisory lock keys are world ids, which are BIGINT
+    locked = connection.execute(
+        sqlalchemy.text("SELECT pg_try_advisory_lock(CAST(:world_id AS BIGINT))"),
+        {"world_id": world_id},
+    ).scalar_one()
+    connection.commit()
+    if not locked:
+        return None
+    try:
+        with connection.begin():
+            after_id = connection.execute(
+                sqlalchemy.text("SELECT tick_after_id FROM world WHERE id = :world_id"),
+                {"world_id": world_id},
+            ).scalar()
+            if after_id is None:
+                after_id = connection.execute(sqlalchemy.text(sql_claim_tick), {
+                    "world_id": world_id,
+                    "min_interval": min_interval,
+                }).scalar()
+        if after_id is None:
+            return None
+
+        heroes, levels_gained = 0, 0
+        while True:
+            with connection.begin():
+                chunk = connection.execute(sqlalchemy.text(sql_tick_heroes), {
+                    "world_id": world_id,
+                    "after_id": after_id,
+                    "chunk": WORLD_TICK_CHUNK,
+                    "age_years": WORLD_TICK_AGE_YEARS,
+                    "regen": WORLD_TICK_REGEN,
+                    "max_health": WORLD_TICK_MAX_HEALTH,
+                    "xp_per_level": XP_PER_LEVEL,
+                }).one()
+            heroes += chunk.heroes
+            levels_gained += chunk.levels_gained
+            if chunk.heroes < WORLD_TICK_CHUNK:
+                return {"heroes": heroes, "levels_gained": levels_gained}
+            after_id = chunk.last_id
+    finally:
+        _unlock(connection, world_id)
+
+
+def _unlock(connection, world_id):
+    # Runs in a finally block, so it must not replace the tick's own error
+    try:
+        connection.execute(
+            sqlalchemy.text("SELECT pg_advisory_unlock(CAST(:world_id AS BIGINT))"),
+            {"world_id": world_id},
+        )
+        connection.commit()
+    except Exception:
+        logging.exception(f"Failed to release the world tick lock of world {world_id}")
+        # Closing the session releases its advisory locks
+        connection.invalidate()
+
+
+def tick():
+    """
+    Advance every world that is due a tick.
+
+    Returns:
+        dict: The number of worlds ticked, heroes updated and levels gained.
+    """
+    # Half the interval, so a tick is not skipped because of scheduling jitter
+    min_interval = WORLD_TICK_SECONDS / 2
+    worlds, heroes, levels_gained = 0, 0, 0
+    with db.engine.connect() as connection:
+        world_ids = connection.execute(sqlalchemy.text("SELECT id FROM world ORDER BY id")).scalars().all()
+        connection.commit()
+        for world_id in world_ids:
+            result = tick_world(connection, world_id, min_interval)
+            if result is not None:
+                worlds += 1
+                heroes += result["heroes"]
+                levels_gained += result["levels_gained"]
+    return {"worlds": worlds, "heroes": heroes, "levels_gained": levels_gained}
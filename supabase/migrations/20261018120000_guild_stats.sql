@@ -0,0 +1,20 @@
+-- Maintained per-guild aggregates backing the leaderboard
+CREATE TABLE guild_stats (
+    guild_id BIGINT PRIMARY KEY REFERENCES guild(id) ON DELETE CASCADE,
+    world_id BIGINT REFERENCES world(id),
+    gold INT NOT NULL DEFAULT 0,
+    hero_count INT NOT NULL DEFAULT 0,
+    power_sum BIGINT NOT NULL DEFAULT 0,
+    avg_hero_power NUMERIC GENERATED ALWAYS AS (
+        CASE WHEN hero_count > 0 THEN power_sum::NUMERIC / hero_count ELSE 0 END
+    ) STORED
+);
+
+CREATE INDEX guild_stats_rank_idx ON guild_stats (gold DESC, avg_hero_power DESC, hero_count DESC, guild_id DESC);
+
+-- Backfill from existing guilds and heroes
+INSERT INTO guild_stats (guild_id, world_id, gold, hero_count, power_sum)
+SELECT g.id, g.world_id, COALESCE(g.gold, 0), COUNT(h.id), COALESCE(SUM(h.power), 0)
+FROM guild g
+LEFT JOIN hero h ON h.guild_id = g.id
+GROUP BY g.id, g.world_id, g.gold;
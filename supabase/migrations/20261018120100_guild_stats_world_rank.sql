@@ -0,0 +1,2 @@
+-- Per-world leaderboard pages and rank lookups
+CREATE INDEX guild_stats_world_rank_idx ON guild_stats (world_id, gold DESC, avg_hero_power DESC, hero_count DESC, guild_id DESC);
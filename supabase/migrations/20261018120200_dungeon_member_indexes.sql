@@ -0,0 +1,3 @@
+-- Loading the heroes and monsters of a dungeon (find_monsters, find_heroes, auto-resolve)
+CREATE INDEX IF NOT EXISTS monster_dungeon_id_idx ON monster (dungeon_id);
+CREATE INDEX IF NOT EXISTS hero_dungeon_id_idx ON hero (dungeon_id);
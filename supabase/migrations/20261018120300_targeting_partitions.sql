@@ -0,0 +1,102 @@
+-- Partition the targeting log by month so old history can be dropped a partition at a time
+ALTER TABLE targeting RENAME TO targeting_unpartitioned;
+ALTER TABLE targeting_unpartitioned RENAME CONSTRAINT targeting_pkey TO targeting_unpartitioned_pkey;
+ALTER TABLE targeting_unpartitioned RENAME CONSTRAINT targeting_hero_id_fkey TO targeting_unpartitioned_hero_id_fkey;
+ALTER TABLE targeting_unpartitioned RENAME CONSTRAINT targeting_monster_id_fkey TO targeting_unpartitioned_monster_id_fkey;
+ALTER SEQUENCE targeting_id_seq OWNED BY NONE;
+ALTER SEQUENCE targeting_id_seq AS BIGINT;
+
+CREATE TABLE targeting (
+    id BIGINT NOT NULL DEFAULT nextval('targeting_id_seq'),
+    hero_id BIGINT REFERENCES hero(id),
+    monster_id BIGINT REFERENCES monster(id),
+    damage INT NOT NULL DEFAULT 0,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+ALTER SEQUENCE targeting_id_seq OWNED BY targeting.id;
+
+-- Catches rows for months that have no partition yet
+CREATE TABLE targeting_default PARTITION OF targeting DEFAULT;
+
+CREATE INDEX targeting_hero_id_idx ON targeting (hero_id);
+
+-- Create the partition for the month containing `month`, moving any rows for
+-- that month out of the default partition first so the attach succeeds
+CREATE FUNCTION ensure_targeting_partition(month DATE) RETURNS TEXT AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', month);
+    month_end TIMESTAMP := date_trunc('month', month) + INTERVAL '1 month';
+    partition_name TEXT := 'targeting_' || to_char(month, 'YYYY_MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE targeting INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM targeting_default WHERE timestamp >= $1 AND timestamp < $2 RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved', partition_name
+    ) USING month_start, month_end;
+    EXECUTE format(
+        'ALTER TABLE targeting ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, month_start, month_end
+    );
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Drop monthly partitions that end on or before `cutoff`, and default partition
+-- rows older than it
+CREATE FUNCTION drop_targeting_partitions(cutoff TIMESTAMP) RETURNS SETOF TEXT AS $$
+DECLARE
+    partition_name TEXT;
+BEGIN
+    FOR partition_name IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'targeting'
+            AND child.relname ~ '^targeting_[0-9]{4}_[0-9]{2}$'
+            AND to_date(substr(child.relname, 11), 'YYYY_MM') + INTERVAL '1 month' <= cutoff
+        ORDER BY child.relname
+    LOOP
+        EXECUTE format('DROP TABLE %I', partition_name);
+        RETURN NEXT partition_name;
+    END LOOP;
+
+    DELETE FROM targeting_default WHERE timestamp < cutoff;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_targeting_partition(CAST(month AS DATE))
+FROM generate_series(
+    date_trunc('month', COALESCE((SELECT MIN(timestamp) FROM targeting_unpartitioned), LOCALTIMESTAMP)),
+    date_trunc('month', LOCALTIMESTAMP) + INTERVAL '3 months',
+    INTERVAL '1 month'
+) AS month;
+
+INSERT INTO targeting (id, hero_id, monster_id, damage, timestamp)
+SELECT id, hero_id, monster_id, damage, COALESCE(timestamp, CURRENT_TIMESTAMP)
+FROM targeting_unpartitioned;
+
+-- Per hero/monster totals that outlive the partitions they were built from
+CREATE TABLE targeting_rollup (
+    hero_id BIGINT REFERENCES hero(id) ON DELETE CASCADE,
+    monster_id BIGINT REFERENCES monster(id) ON DELETE CASCADE,
+    total_damage BIGINT NOT NULL DEFAULT 0,
+    attack_count INT NOT NULL DEFAULT 0,
+    first_attack TIMESTAMP NOT NULL,
+    last_attack TIMESTAMP NOT NULL,
+    PRIMARY KEY (hero_id, monster_id)
+);
+
+INSERT INTO targeting_rollup (hero_id, monster_id, total_damage, attack_count, first_attack, last_attack)
+SELECT hero_id, monster_id, SUM(damage), COUNT(*), MIN(timestamp), MAX(timestamp)
+FROM targeting
+WHERE hero_id IS NOT NULL AND monster_id IS NOT NULL
+GROUP BY hero_id, monster_id;
+
+DROP TABLE targeting_unpartitioned;
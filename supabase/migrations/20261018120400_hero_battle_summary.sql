@@ -0,0 +1,25 @@
+-- Whether the monster of a rollup pair has been killed, flipped once when it dies
+ALTER TABLE targeting_rollup ADD COLUMN defeated BOOLEAN NOT NULL DEFAULT FALSE;
+
+UPDATE targeting_rollup r
+SET defeated = TRUE
+FROM monster m
+WHERE m.id = r.monster_id AND m.health <= 0;
+
+-- Newest-first battle details per hero, and the pairs to flip when a monster dies
+CREATE INDEX targeting_rollup_hero_recent_idx ON targeting_rollup (hero_id, last_attack DESC, monster_id DESC);
+CREATE INDEX targeting_rollup_monster_id_idx ON targeting_rollup (monster_id);
+
+-- Maintained per-hero battle totals backing /hero/{hero_id}/monster_interactions
+CREATE TABLE hero_battle_summary (
+    hero_id BIGINT PRIMARY KEY REFERENCES hero(id) ON DELETE CASCADE,
+    total_battles INT NOT NULL DEFAULT 0,
+    monsters_defeated INT NOT NULL DEFAULT 0,
+    total_damage BIGINT NOT NULL DEFAULT 0,
+    last_battle TIMESTAMP NOT NULL
+);
+
+INSERT INTO hero_battle_summary (hero_id, total_battles, monsters_defeated, total_damage, last_battle)
+SELECT hero_id, COUNT(*), COUNT(*) FILTER (WHERE defeated), SUM(total_damage), MAX(last_attack)
+FROM targeting_rollup
+GROUP BY hero_id;
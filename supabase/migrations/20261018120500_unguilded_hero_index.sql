@@ -0,0 +1,2 @@
+-- Pages of unguilded heroes per world for /world/view_heroes
+CREATE INDEX IF NOT EXISTS hero_unguilded_world_id_idx ON hero (world_id, id) WHERE guild_id IS NULL;
@@ -0,0 +1,2 @@
+-- Heroes by guild for /hero/status and /guild/available_heroes
+CREATE INDEX IF NOT EXISTS hero_guild_id_idx ON hero (guild_id);
@@ -0,0 +1,18 @@
+-- Maintained child counts, so capacity checks read one row instead of
+-- counting the child table. Guild hero counts are guild_stats.hero_count.
+ALTER TABLE world
+    ADD COLUMN dungeon_count INT NOT NULL DEFAULT 0,
+    ADD COLUMN guild_count INT NOT NULL DEFAULT 0;
+
+ALTER TABLE dungeon
+    ADD COLUMN monster_count INT NOT NULL DEFAULT 0;
+
+-- Backfill from existing rows
+UPDATE world w
+SET dungeon_count = (SELECT COUNT(*) FROM dungeon d WHERE d.world_id = w.id),
+    guild_count = (SELECT COUNT(*) FROM guild g WHERE g.world_id = w.id);
+
+UPDATE dungeon d
+SET monster_count = c.monsters
+FROM (SELECT dungeon_id, COUNT(*) AS monsters FROM monster GROUP BY dungeon_id) c
+WHERE c.dungeon_id = d.id;
@@ -0,0 +1,10 @@
+-- At most one pending invite per hero and guild, which also indexes the
+-- pending invites of a hero. Duplicates already sent are collapsed first,
+-- keeping the oldest.
+DELETE FROM recruitment r
+USING recruitment older
+WHERE r.status = 'pending' AND older.status = 'pending'
+  AND r.hero_id = older.hero_id AND r.guild_id = older.guild_id
+  AND older.id < r.id;
+
+CREATE UNIQUE INDEX recruitment_pending_hero_guild_idx ON recruitment (hero_id, guild_id) WHERE status = 'pending';
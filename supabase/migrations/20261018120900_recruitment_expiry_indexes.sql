@@ -0,0 +1,4 @@
+-- Let the recruitment sweep find expired pending invites and old answered
+-- ones without scanning the table
+CREATE INDEX recruitment_pending_request_date_idx ON recruitment (request_date) WHERE status = 'pending';
+CREATE INDEX recruitment_answered_response_date_idx ON recruitment (response_date) WHERE status <> 'pending';
@@ -0,0 +1,9 @@
+-- Game time per world, advanced by the world tick job
+ALTER TABLE world
+    ADD COLUMN tick BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN last_tick_at TIMESTAMP WITH TIME ZONE,
+    -- Last hero done by a tick still in progress, NULL between ticks
+    ADD COLUMN tick_after_id BIGINT;
+
+-- Walking a world's heroes in ID order, a chunk at a time
+CREATE INDEX hero_world_id_idx ON hero (world_id, id);
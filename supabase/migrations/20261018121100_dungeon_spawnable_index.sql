@@ -0,0 +1,2 @@
+-- Open dungeons with room for more monsters, for the monster spawner
+CREATE INDEX dungeon_spawnable_idx ON dungeon (id) WHERE status = 'open' AND monster_count < monster_capacity;
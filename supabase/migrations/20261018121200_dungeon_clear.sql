@@ -0,0 +1,7 @@
+-- When the party sent to each closed dungeon finishes clearing it
+CREATE TABLE dungeon_clear (
+    dungeon_id BIGINT PRIMARY KEY REFERENCES dungeon(id) ON DELETE CASCADE,
+    clear_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX dungeon_clear_clear_at_idx ON dungeon_clear (clear_at);
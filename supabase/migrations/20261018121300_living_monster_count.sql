@@ -0,0 +1,4 @@
+-- dungeon.monster_count counts living monsters only, so slots freed by
+-- monsters dying are refilled by create_monster and the spawner
+UPDATE dungeon d
+SET monster_count = (SELECT COUNT(*) FROM monster m WHERE m.dungeon_id = d.id AND m.health > 0);
@@ -94,8 +94,36 @@ INSERT INTO hero (name, power, health, guild_id, dungeon_id, world_id, level, xp
     ('Amelia', 10, 50, 1, 1, 1, 10, 100)
 ;
 
+-- Count the dungeons, guilds and living monsters above for the capacity checks
+UPDATE world w
+SET dungeon_count = (SELECT COUNT(*) FROM dungeon d WHERE d.world_id = w.id),
+    guild_count = (SELECT COUNT(*) FROM guild g WHERE g.world_id = w.id);
+
+UPDATE dungeon d
+SET monster_count = (SELECT COUNT(*) FROM monster m WHERE m.dungeon_id = d.id AND m.health > 0);
+
+-- Build the leaderboard stats of the guilds and heroes above
+INSERT INTO guild_stats (guild_id, world_id, gold, hero_count, power_sum)
+SELECT g.id, g.world_id, COALESCE(g.gold, 0), COUNT(h.id), COALESCE(SUM(h.power), 0)
+FROM guild g
+LEFT JOIN hero h ON h.guild_id = g.id
+GROUP BY g.id, g.world_id, g.gold;
+
 -- Insert test data into targeting table
 INSERT INTO targeting (hero_id, monster_id) VALUES
-    (28, 1),
-    (27, 2)
+    (25, 1),
+    (24, 2)
 ;
+
+-- Build the targeting rollups and battle summaries from the targeting rows
+INSERT INTO targeting_rollup (hero_id, monster_id, total_damage, attack_count, first_attack, last_attack, defeated)
+SELECT t.hero_id, t.monster_id, SUM(t.damage), COUNT(*), MIN(t.timestamp), MAX(t.timestamp), BOOL_OR(m.health <= 0)
+FROM targeting t
+JOIN monster m ON m.id = t.monster_id
+WHERE t.hero_id IS NOT NULL
+GROUP BY t.hero_id, t.monster_id;
+
+INSERT INTO hero_battle_summary (hero_id, total_battles, monsters_defeated, total_damage, last_battle)
+SELECT hero_id, COUNT(*), COUNT(*) FILTER (WHERE defeated), SUM(total_damage), MAX(last_attack)
+FROM targeting_rollup
+GROUP BY hero_id;
@@ -0,0 +1,81 @@
+import os
+import sys
+import pytest
+
+# Engines are created at import, without connecting; tests that need a
+# database skip when this one cannot be reached
+os.environ.setdefault("POSTGRES_URI", "postgresql://postgres@127.0.0.1:5432/postgres")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def engine():
+    """The engine for POSTGRES_URI, for tests that need to commit."""
+    import sqlalchemy
+    from src import database as db
+
+    try:
+        with db.engine.connect() as connection:
+            migrated = connection.execute(sqlalchemy.text("SELECT to_regclass('dungeon_clear') IS NOT NULL")).scalar_one()
+    except sqlalchemy.exc.OperationalError:
+        pytest.skip("database not available")
+    if not migrated:
+        pytest.skip("database has not been migrated")
+    return db.engine
+
+
+@pytest.fixture
+def connection(engine):
+    """A connection to POSTGRES_URI inside a transaction that is rolled back."""
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            yield connection
+        finally:
+            transaction.rollback()
+
+
+@pytest.fixture
+def client(engine, monkeypatch):
+    """A TestClient for the API with the key check off and no background jobs started."""
+    from fastapi.testclient import TestClient
+    from src.api import auth, server
+
+    app = server.app
+    monkeypatch.setattr(app.router, "on_startup", [])
+    # The async engine's connections belong to the client's event loop
+    monkeypatch.setattr(app.router, "on_shutdown", [server.close_async_engine])
+    app.dependency_overrides[auth.get_api_key] = lambda: None
+    try:
+        with TestClient(app) as client:
+            yield client
+    finally:
+        app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def world(engine):
+    """A new world, deleted along with everything in it after the test."""
+    import uuid
+    import sqlalchemy
+
+    with engine.begin() as connection:
+        world_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO world (name, dungeon_capacity, guild_capacity) VALUES (:name, 100, 100) RETURNING id
+        """), {"name": f"test world {uuid.uuid4().hex}"}).scalar_one()
+    yield world_id
+    with engine.begin() as connection:
+        for statement in (
+            "DELETE FROM targeting WHERE hero_id IN (SELECT id FROM hero WHERE world_id = :world_id)",
+            "DELETE FROM targeting_rollup WHERE hero_id IN (SELECT id FROM hero WHERE world_id = :world_id)",
+            "DELETE FROM hero_battle_summary WHERE hero_id IN (SELECT id FROM hero WHERE world_id = :world_id)",
+            "DELETE FROM recruitment WHERE hero_id IN (SELECT id FROM hero WHERE world_id = :world_id)",
+            "DELETE FROM dungeon_clear WHERE dungeon_id IN (SELECT id FROM dungeon WHERE world_id = :world_id)",
+            "DELETE FROM hero WHERE world_id = :world_id",
+            "DELETE FROM monster WHERE dungeon_id IN (SELECT id FROM dungeon WHERE world_id = :world_id)",
+            "DELETE FROM guild_stats WHERE world_id = :world_id",
+            "DELETE FROM guild WHERE world_id = :world_id",
+            "DELETE FROM dungeon WHERE world_id = :world_id",
+            "DELETE FROM world WHERE id = :world_id",
+        ):
+            connection.execute(sqlalchemy.text(statement), {"world_id": world_id})
@@ -0,0 +1,33 @@
+import asyncio
+import sqlalchemy
+from src import database as db
+from src import targeting_log
+
+
+def test_async_commit_queues_buffered_rows_only_once_committed(engine, monkeypatch):
+    buffer = targeting_log.TargetingBuffer(capacity=10, flush_rows=10, flush_seconds=10)
+    monkeypatch.setattr(targeting_log, "buffer", buffer)
+    monkeypatch.setattr(targeting_log, "flush", lambda rows: None)
+    buffer.start()
+
+    async def main():
+        try:
+            async with db.async_engine.begin() as connection:
+                assert (await connection.execute(sqlalchemy.text("SELECT 1"))).scalar_one() == 1
+                await targeting_log.record_async(connection, [1, 2], [3, 4], [5, 6])
+                queued_before_commit = buffer.stats()["buffered_rows"]
+            queued_after_commit = buffer.stats()["buffered_rows"]
+
+            async with db.async_engine.connect() as connection:
+                await targeting_log.record_async(connection, [7], [8], [9])
+                await connection.rollback()
+            return queued_before_commit, queued_after_commit
+        finally:
+            await db.async_engine.dispose()
+
+    try:
+        assert asyncio.run(main()) == (0, 2)
+        assert buffer.stats()["buffered_rows"] == 2
+        assert buffer.stats()["reserved_rows"] == 2
+    finally:
+        buffer.stop()
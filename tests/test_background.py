@@ -0,0 +1,49 @@
+import threading
+import pytest
+from src import background
+
+
+def test_run_once_refuses_to_overlap_a_run_in_progress():
+    started, release = threading.Event(), threading.Event()
+
+    def run():
+        started.set()
+        release.wait(5)
+        return "done"
+
+    job = background.PeriodicJob("test", 0, run)
+    thread = threading.Thread(target=job.run_once)
+    thread.start()
+    try:
+        assert started.wait(5)
+        with pytest.raises(background.JobAlreadyRunning):
+            job.run_once()
+    finally:
+        release.set()
+        thread.join()
+
+    assert job.stats()["runs"] == 1
+    assert job.run_once() == "done"
+    assert job.stats()["runs"] == 2
+
+
+def test_admin_run_returns_409_while_the_job_is_running(monkeypatch):
+    from fastapi.testclient import TestClient
+    from src.api import auth
+    from src.api.server import app
+
+    started, release = threading.Event(), threading.Event()
+    job = background.PeriodicJob("test", 0, lambda: (started.set(), release.wait(5)))
+    monkeypatch.setitem(background.jobs, "test", job)
+    app.dependency_overrides[auth.get_api_key] = lambda: None
+    thread = threading.Thread(target=job.run_once)
+    thread.start()
+    try:
+        assert started.wait(5)
+        response = TestClient(app).post("/admin/jobs/test")
+    finally:
+        release.set()
+        thread.join()
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 409
@@ -0,0 +1,44 @@
+import sqlalchemy
+
+
+def test_interactions_summary_matches_the_targeting_log(engine, client, world):
+    with engine.begin() as connection:
+        dungeon_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO dungeon (name, monster_capacity, monster_count, party_capacity, level, gold_reward, world_id, status)
+            VALUES ('summary test dungeon', 10, 3, 4, 1, 10, :world_id, 'closed')
+            RETURNING id
+        """), {"world_id": world}).scalar_one()
+        hero_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO hero (name, power, health, world_id, dungeon_id)
+            VALUES (:name, 10, 50, :world_id, :dungeon_id)
+            RETURNING id
+        """), {"name": f"summary test hero {world}", "world_id": world, "dungeon_id": dungeon_id}).scalar_one()
+        monsters = connection.execute(sqlalchemy.text("""
+            INSERT INTO monster (type, level, health, power, dungeon_id)
+            SELECT 'Slime', 1, health, 1, :dungeon_id FROM unnest(ARRAY[10, 25, 40]) AS health
+            RETURNING id
+        """), {"dungeon_id": dungeon_id}).scalars().all()
+
+    # Kills the first monster
+    for monster_id in (monsters[0], monsters[1], monsters[1], monsters[2]):
+        assert client.post(f"/hero/attack_monster/{hero_id}", params={"monster_id": monster_id}).status_code == 200
+
+    first = client.get(f"/hero/{hero_id}/monster_interactions", params={"limit": 2}).json()
+    second = client.get(f"/hero/{hero_id}/monster_interactions", params={
+        "limit": 2, "after_monster_id": first["next_cursor"],
+    }).json()
+
+    with engine.connect() as connection:
+        logged = connection.execute(sqlalchemy.text("""
+            SELECT COUNT(DISTINCT monster_id), SUM(damage) FROM targeting WHERE hero_id = :hero_id
+        """), {"hero_id": hero_id}).one()
+    assert (first["total_battles"], first["total_damage_dealt"]) == tuple(logged) == (3, 40)
+    assert first["monsters_defeated"] == 1
+
+    details = first["battle_details"] + second["battle_details"]
+    assert second["next_cursor"] is None
+    # Newest first
+    assert [battle["monster_id"] for battle in details] == monsters[::-1]
+    assert [(battle["damage_dealt"], battle["remaining_health"], battle["monster_defeated"]) for battle in details] == [
+        (10, 30, False), (20, 5, False), (10, 0, True),
+    ]
@@ -0,0 +1,70 @@
+import threading
+import time
+import sqlalchemy
+from src import cache
+
+
+def test_concurrent_misses_share_one_load():
+    read_cache = cache.ReadCache(max_entries=10, ttl=60)
+    release = threading.Event()
+    loads = []
+
+    def load():
+        loads.append(1)
+        release.wait(5)
+        return "rows"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(read_cache.get_or_load(("ns", 1), load)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    while read_cache.stats()["coalesced"] < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert loads == [1]
+    assert results == ["rows"] * 5
+    assert read_cache.get_or_load(("ns", 1), load) == "rows"
+    assert read_cache.stats()["hits"] == 1
+
+
+def test_load_racing_an_invalidation_is_not_cached():
+    read_cache = cache.ReadCache(max_entries=10, ttl=60)
+
+    def stale_load():
+        read_cache.invalidate("ns")
+        return "stale"
+
+    assert read_cache.get_or_load(("ns", 1), stale_load) == "stale"
+    assert read_cache.get_or_load(("ns", 1), lambda: "fresh") == "fresh"
+
+
+def test_leaderboard_is_cached_until_a_write_invalidates_it(engine, client, world):
+    def guild_names():
+        response = client.get("/guild/leaderboard", params={"world_id": world}).json()
+        return [entry["guild_name"] for entry in response["leaderboard"]]
+
+    assert guild_names() == []
+
+    # Written behind the API's back, so only seen once the entry is dropped
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("""
+            WITH g AS (
+                INSERT INTO guild (name, player_capacity, gold, world_id)
+                VALUES ('cache test direct', 10, 5, :world_id)
+                RETURNING id, gold
+            )
+            INSERT INTO guild_stats (guild_id, world_id, gold) SELECT id, :world_id, gold FROM g
+        """), {"world_id": world})
+    assert guild_names() == []
+
+    response = client.post(
+        f"/guild/create_guild/{world}", json={"guild_name": "cache test api", "max_capacity": 10, "gold": 10}
+    )
+    assert response.json()["success"]
+    assert guild_names() == ["cache test api", "cache test direct"]
@@ -0,0 +1,69 @@
+import sqlalchemy
+
+
+def add_party(engine, world_id):
+    """A dungeon with two heroes (one dead) and two monsters, plus a hero outside it."""
+    with engine.begin() as connection:
+        dungeon_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO dungeon (name, monster_capacity, monster_count, party_capacity, level, gold_reward, world_id, status)
+            VALUES ('combat test dungeon', 10, 2, 4, 1, 10, :world_id, 'closed')
+            RETURNING id
+        """), {"world_id": world_id}).scalar_one()
+        heroes = connection.execute(sqlalchemy.text("""
+            INSERT INTO hero (name, power, health, world_id, dungeon_id)
+            SELECT :prefix || name, power, health, :world_id, CASE WHEN inside THEN :dungeon_id END
+            FROM (VALUES ('a', 7, 20, TRUE), ('b', 5, 0, TRUE), ('c', 100, 20, FALSE)) AS h(name, power, health, inside)
+            RETURNING id
+        """), {"prefix": f"combat test {world_id} ", "world_id": world_id, "dungeon_id": dungeon_id}).scalars().all()
+        monsters = connection.execute(sqlalchemy.text("""
+            INSERT INTO monster (type, level, health, power, dungeon_id)
+            VALUES ('Slime', 1, 7, 3, :dungeon_id), ('Slime', 1, 30, 4, :dungeon_id)
+            RETURNING id
+        """), {"dungeon_id": dungeon_id}).scalars().all()
+    return dungeon_id, sorted(heroes), sorted(monsters)
+
+
+def test_round_uses_start_of_round_health_and_skips_invalid_attacks(engine, client, world):
+    dungeon_id, (alive, dead, outside), (weak, strong) = add_party(engine, world)
+
+    response = client.post(f"/dungeon/{dungeon_id}/combat_round", json=[
+        {"attacker_type": "hero", "attacker_id": alive, "target_id": weak},
+        # Dead and outside heroes do not attack
+        {"attacker_type": "hero", "attacker_id": dead, "target_id": strong},
+        {"attacker_type": "hero", "attacker_id": outside, "target_id": strong},
+        # Killed this round, but still attacks with its start-of-round health
+        {"attacker_type": "monster", "attacker_id": weak, "target_id": alive},
+        {"attacker_type": "monster", "attacker_id": strong, "target_id": alive},
+        {"attacker_type": "monster", "attacker_id": strong, "target_id": dead},
+    ])
+    body = response.json()
+
+    assert response.status_code == 200
+    assert (body["success"], body["hero_attacks"], body["monster_attacks"]) == (True, 1, 2)
+    assert body["monsters"] == [{"id": weak, "health": 0}]
+    assert body["heroes"] == [{"id": alive, "health": 13}]
+
+    with engine.connect() as connection:
+        monster_count = connection.execute(sqlalchemy.text(
+            "SELECT monster_count FROM dungeon WHERE id = :id"
+        ), {"id": dungeon_id}).scalar_one()
+        attacks = connection.execute(sqlalchemy.text("""
+            SELECT hero_id, monster_id, damage FROM targeting WHERE hero_id = :hero_id ORDER BY monster_id, damage
+        """), {"hero_id": alive}).fetchall()
+    assert monster_count == 1
+    assert [tuple(row) for row in attacks] == [(alive, weak, 0), (alive, weak, 7), (alive, strong, 0)]
+
+
+def test_round_with_invalid_attacker_type_is_rejected(engine, client, world):
+    dungeon_id, (alive, _, _), (weak, _) = add_party(engine, world)
+
+    response = client.post(f"/dungeon/{dungeon_id}/combat_round", json=[
+        {"attacker_type": "hero", "attacker_id": alive, "target_id": weak},
+        {"attacker_type": "wizard", "attacker_id": alive, "target_id": weak},
+    ])
+
+    assert response.status_code == 400
+    with engine.connect() as connection:
+        assert connection.execute(sqlalchemy.text(
+            "SELECT health FROM monster WHERE id = :id"
+        ), {"id": weak}).scalar_one() == 7
@@ -0,0 +1,48 @@
+import sqlalchemy
+
+
+def hero(name, **fields):
+    return {"hero_name": name, "classType": "Warrior", "level": 1, "age": 20, "power": 10, "health": 10, **fields}
+
+
+def test_bulk_create_reports_each_hero(engine, client, world):
+    prefix = f"bulk test {world} "
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO hero (name, class, power, health, world_id) VALUES (:name, 'Mage', 5, 5, :world_id)
+        """), {"name": prefix + "taken", "world_id": world})
+
+    response = client.post(f"/world/create_heroes/{world}", json=[
+        hero(prefix + "a"),
+        hero(prefix + "taken"),
+        hero(prefix + "a", power=99),
+        hero(prefix + "weak", power=-1),
+        hero(prefix + "b", xp=7),
+    ])
+    assert response.status_code == 200
+    body = response.json()
+
+    assert (body["created"], body["failed"]) == (2, 3)
+    results = [(result["index"], result["hero_name"], result["status"]) for result in body["results"]]
+    assert results == [
+        (0, prefix + "a", "created"),
+        (1, prefix + "taken", "name_taken"),
+        (2, prefix + "a", "duplicate"),
+        (3, prefix + "weak", "invalid"),
+        (4, prefix + "b", "created"),
+    ]
+    assert body["results"][3]["detail"] == "Invalid Hero power"
+
+    with engine.connect() as connection:
+        rows = connection.execute(sqlalchemy.text("""
+            SELECT id, name, class, power, xp FROM hero WHERE world_id = :world_id ORDER BY name
+        """), {"world_id": world}).all()
+    created = {result["hero_name"]: result["hero_id"] for result in body["results"] if result["status"] == "created"}
+    assert [tuple(row)[1:] for row in rows] == [
+        (prefix + "a", "Warrior", 10, 0), (prefix + "b", "Warrior", 10, 7), (prefix + "taken", "Mage", 5, 0),
+    ]
+    assert {row.name: row.id for row in rows if row.name in created} == created
+
+
+def test_bulk_create_in_unknown_world_is_not_found(client):
+    assert client.post("/world/create_heroes/-1", json=[hero("nowhere")]).status_code == 404
@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+import sqlalchemy
+from src.api import dungeon
+
+
+def add_dungeon(engine, world_id, capacity):
+    with engine.begin() as connection:
+        return connection.execute(sqlalchemy.text("""
+            INSERT INTO dungeon (name, monster_capacity, monster_count, party_capacity, level, gold_reward, world_id, status)
+            VALUES ('spawn test dungeon', :capacity, 0, 4, 1, 10, :world_id, 'open')
+            RETURNING id
+        """), {"capacity": capacity, "world_id": world_id}).scalar_one()
+
+
+def monster(type, health=10):
+    return {"type": type, "health": health, "power": 1, "level": 1}
+
+
+def monsters_in(engine, dungeon_id):
+    with engine.connect() as connection:
+        return connection.execute(sqlalchemy.text("""
+            SELECT (SELECT monster_count FROM dungeon WHERE id = :dungeon_id),
+                   ARRAY(SELECT type FROM monster WHERE dungeon_id = :dungeon_id ORDER BY id)
+        """), {"dungeon_id": dungeon_id}).one()
+
+
+def test_monsters_are_admitted_in_request_order_up_to_capacity(engine, client, world):
+    dungeon_id = add_dungeon(engine, world, 3)
+
+    first = client.post(f"/dungeon/create_monster/{dungeon_id}", json=[monster("a"), monster("b")]).json()
+    second = client.post(f"/dungeon/create_monster/{dungeon_id}", json=[monster("c"), monster("d"), monster("e")]).json()
+    full = client.post(f"/dungeon/create_monster/{dungeon_id}", json=[monster("f")])
+
+    assert len(first["monster_ids"]) == 2 and first["message"] == "Created 2 of 2 monsters"
+    assert len(second["monster_ids"]) == 1 and second["message"] == "Created 1 of 3 monsters"
+    assert first["monster_ids"] < second["monster_ids"]
+    assert full.status_code == 400
+    assert tuple(monsters_in(engine, dungeon_id)) == (3, ["a", "b", "c"])
+
+
+def test_dead_monsters_do_not_use_capacity(engine, client, world):
+    dungeon_id = add_dungeon(engine, world, 2)
+
+    response = client.post(f"/dungeon/create_monster/{dungeon_id}", json=[monster("corpse", health=0), monster("a")])
+
+    assert len(response.json()["monster_ids"]) == 2
+    assert tuple(monsters_in(engine, dungeon_id)) == (1, ["corpse", "a"])
+
+
+def test_concurrent_spawns_do_not_overfill_the_dungeon(engine, world):
+    dungeon_id = add_dungeon(engine, world, 5)
+    batches = [[dungeon.Monster(**monster(f"{batch}-{n}")) for n in range(2)] for batch in range(6)]
+
+    def spawn(batch):
+        try:
+            return dungeon.create_monster(dungeon_id, batch).monster_ids
+        except dungeon.HTTPException:
+            return []
+
+    with ThreadPoolExecutor(len(batches)) as pool:
+        created = [monster_id for ids in pool.map(spawn, batches) for monster_id in ids]
+
+    count, types = monsters_in(engine, dungeon_id)
+    assert len(created) == count == len(types) == 5
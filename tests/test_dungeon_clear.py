@@ -0,0 +1,110 @@
+import time
+import pytest
+import sqlalchemy
+from src import dungeon_clear
+
+
+@pytest.fixture
+def dungeon(connection, monkeypatch):
+    monkeypatch.setattr(dungeon_clear, "DUNGEON_CLEAR_BASE_SECONDS", 10)
+    monkeypatch.setattr(dungeon_clear, "DUNGEON_CLEAR_SECONDS_PER_ROUND", 100)
+    monkeypatch.setattr(dungeon_clear, "DUNGEON_CLEAR_MAX_SECONDS", 1000)
+    world_id = connection.execute(sqlalchemy.text("""
+        INSERT INTO world (name, dungeon_capacity, guild_capacity) VALUES ('clear test world', 1, 1) RETURNING id
+    """)).scalar_one()
+    dungeon_id = connection.execute(sqlalchemy.text("""
+        INSERT INTO dungeon (name, monster_capacity, party_capacity, level, gold_reward, world_id, status)
+        VALUES ('clear test dungeon', 10, 4, 1, 10, :world_id, 'open')
+        RETURNING id
+    """), {"world_id": world_id}).scalar_one()
+    # 60 health in all
+    connection.execute(sqlalchemy.text("""
+        INSERT INTO monster (type, level, health, power, dungeon_id)
+        VALUES ('Slime', 1, 30, 1, :dungeon_id), ('Slime', 1, 30, 1, :dungeon_id), ('Slime', 1, 0, 1, :dungeon_id)
+    """), {"dungeon_id": dungeon_id})
+
+    def send(*heroes):
+        for n, (power, health) in enumerate(heroes):
+            connection.execute(sqlalchemy.text("""
+                INSERT INTO hero (name, class, power, health, world_id, dungeon_id)
+                VALUES (:name, 'Warrior', :power, :health, :world_id, :dungeon_id)
+            """), {"name": f"clear test hero {n}", "power": power, "health": health,
+                   "world_id": world_id, "dungeon_id": dungeon_id})
+        dungeon_clear.schedule(connection, dungeon_id)
+        return connection.execute(sqlalchemy.text("""
+            SELECT round(EXTRACT(EPOCH FROM clear_at - now())) FROM dungeon_clear WHERE dungeon_id = :dungeon_id
+        """), {"dungeon_id": dungeon_id}).scalar()
+
+    return send
+
+
+@pytest.mark.parametrize("party, seconds", [
+    # More power than the monsters' health still takes a round
+    ([(100, 10)], 110),
+    # 60 / 25 rounds up to 3
+    ([(20, 10), (5, 10)], 310),
+    # Dead heroes do not fight
+    ([(60, 10), (1000, 0)], 110),
+    ([(100, 0)], 1000),
+])
+def test_clear_time_counts_partial_rounds(dungeon, party, seconds):
+    assert dungeon(*party) == seconds
+
+
+def test_scheduler_takes_due_clears_in_order_and_skips_rescheduled_ones():
+    now = time.time()
+    scheduler = dungeon_clear.ClearScheduler(batch=2, resync_seconds=60)
+    scheduler.add([(1, now - 3), (2, now - 1), (3, now - 2), (4, now + 60)])
+    # Dungeon 1 was loaded again with a later time, so its old entry is stale
+    scheduler.add([(1, now + 30)])
+
+    assert scheduler._take_due() == [3, 2]
+    assert scheduler._take_due() == []
+    assert scheduler.pending() == 2
+
+
+def test_send_party_closes_only_the_dungeon_in_the_guilds_world(engine):
+    from fastapi.testclient import TestClient
+    from src.api import auth
+    from src.api.server import app
+
+    with engine.begin() as connection:
+        world_ids = connection.execute(sqlalchemy.text("""
+            INSERT INTO world (name, dungeon_capacity, guild_capacity)
+            VALUES ('party test world a', 1, 1), ('party test world b', 1, 1)
+            RETURNING id
+        """)).scalars().all()
+        dungeon_ids = connection.execute(sqlalchemy.text("""
+            INSERT INTO dungeon (name, monster_capacity, party_capacity, level, gold_reward, world_id, status)
+            SELECT 'party test dungeon', 10, 4, 1, 10, world_id, 'open' FROM unnest(CAST(:world_ids AS BIGINT[])) AS world_id
+            RETURNING id
+        """), {"world_ids": world_ids}).scalars().all()
+        guild_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO guild (name, player_capacity, gold, world_id) VALUES ('party test guild', 5, 0, :world_id) RETURNING id
+        """), {"world_id": world_ids[1]}).scalar_one()
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO hero (name, power, health, guild_id, world_id) VALUES ('party test hero', 10, 10, :guild_id, :world_id)
+        """), {"guild_id": guild_id, "world_id": world_ids[1]})
+    app.dependency_overrides[auth.get_api_key] = lambda: None
+    try:
+        response = TestClient(app).post(
+            f"/guild/send_party/{guild_id}",
+            params={"dungeon_name": "party test dungeon"},
+            json=[{"hero_name": "party test hero"}],
+        )
+        assert response.status_code == 200
+        with engine.connect() as connection:
+            statuses = connection.execute(sqlalchemy.text("""
+                SELECT d.status, EXISTS (SELECT 1 FROM dungeon_clear c WHERE c.dungeon_id = d.id)
+                FROM dungeon d WHERE d.id = ANY(:ids) ORDER BY d.id
+            """), {"ids": dungeon_ids}).fetchall()
+        assert [tuple(row) for row in statuses] == [("open", False), ("closed", True)]
+    finally:
+        app.dependency_overrides.clear()
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text("DELETE FROM dungeon_clear WHERE dungeon_id = ANY(:ids)"), {"ids": dungeon_ids})
+            connection.execute(sqlalchemy.text("DELETE FROM hero WHERE guild_id = :id"), {"id": guild_id})
+            connection.execute(sqlalchemy.text("DELETE FROM guild_stats WHERE guild_id = :id"), {"id": guild_id})
+            connection.execute(sqlalchemy.text("DELETE FROM guild WHERE id = :id"), {"id": guild_id})
+            connection.execute(sqlalchemy.text("DELETE FROM dungeon WHERE id = ANY(:ids)"), {"ids": dungeon_ids})
+            connection.execute(sqlalchemy.text("DELETE FROM world WHERE id = ANY(:ids)"), {"ids": world_ids})
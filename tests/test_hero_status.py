@@ -0,0 +1,35 @@
+import sqlalchemy
+
+
+def test_status_selectors_combine(engine, client, world):
+    with engine.begin() as connection:
+        guild_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO guild (name, player_capacity, gold, world_id) VALUES ('status test guild', 10, 0, :world_id) RETURNING id
+        """), {"world_id": world}).scalar_one()
+        dungeon_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO dungeon (name, monster_capacity, party_capacity, level, gold_reward, world_id, status)
+            VALUES ('status test dungeon', 10, 4, 1, 10, :world_id, 'closed')
+            RETURNING id
+        """), {"world_id": world}).scalar_one()
+        # Two guild heroes in the dungeon, one guild hero outside it, one unguilded hero
+        heroes = connection.execute(sqlalchemy.text("""
+            INSERT INTO hero (name, power, health, xp, level, guild_id, dungeon_id, world_id)
+            SELECT :prefix || n, 1, 10 * n, n, n, CASE WHEN n < 4 THEN :guild_id END, CASE WHEN n < 3 THEN :dungeon_id END, :world_id
+            FROM generate_series(1, 4) AS n
+            ORDER BY n
+            RETURNING id
+        """), {"prefix": f"status test {world} ", "guild_id": guild_id, "dungeon_id": dungeon_id, "world_id": world}).scalars().all()
+    heroes.sort()
+
+    def status(**params):
+        return client.get("/hero/status", params=params).json()
+
+    by_guild = status(guild_id=guild_id)
+    assert [hero["id"] for hero in by_guild] == heroes[:3]
+    assert [(hero["health"], hero["xp"], hero["level"]) for hero in by_guild] == [(10, 1, 1), (20, 2, 2), (30, 3, 3)]
+    assert [hero["dungeon_id"] for hero in by_guild] == [dungeon_id, dungeon_id, None]
+
+    assert [hero["id"] for hero in status(guild_id=guild_id, dungeon_id=dungeon_id)] == heroes[:2]
+    assert [hero["id"] for hero in status(hero_ids=[heroes[3], heroes[0], heroes[2]])] == [heroes[0], heroes[2], heroes[3]]
+    assert [hero["id"] for hero in status(hero_ids=heroes, dungeon_id=dungeon_id)] == heroes[:2]
+    assert client.get("/hero/status").status_code == 400
@@ -0,0 +1,69 @@
+import sqlalchemy
+
+# (gold, hero_count, power_sum), with ties across pages
+GUILDS = [(300, 0, 0), (100, 2, 20), (100, 2, 20), (100, 1, 20), (50, 0, 0), (100, 2, 20), (100, 3, 30)]
+
+
+def add_guilds(engine, world_id):
+    with engine.begin() as connection:
+        return connection.execute(sqlalchemy.text("""
+            WITH new_guilds AS (
+                INSERT INTO guild (name, player_capacity, gold, world_id)
+                SELECT 'leaderboard test guild ' || n, 10, gold, :world_id
+                FROM unnest(CAST(:golds AS INT[])) WITH ORDINALITY AS g(gold, n)
+                RETURNING id, gold, name
+            )
+            INSERT INTO guild_stats (guild_id, world_id, gold, hero_count, power_sum)
+            SELECT g.id, :world_id, g.gold, s.hero_count, s.power_sum
+            FROM new_guilds g
+            JOIN unnest(CAST(:hero_counts AS INT[]), CAST(:power_sums AS INT[])) WITH ORDINALITY AS s(hero_count, power_sum, n)
+                ON g.name = 'leaderboard test guild ' || s.n
+            RETURNING guild_id
+        """), {
+            "world_id": world_id,
+            "golds": [gold for gold, _, _ in GUILDS],
+            "hero_counts": [hero_count for _, hero_count, _ in GUILDS],
+            "power_sums": [power_sum for _, _, power_sum in GUILDS],
+        }).scalars().all()
+
+
+def expected_ranks(engine, world_id):
+    with engine.connect() as connection:
+        return dict(connection.execute(sqlalchemy.text("""
+            SELECT guild_id, RANK() OVER (ORDER BY gold DESC, avg_hero_power DESC, hero_count DESC)
+            FROM guild_stats
+            WHERE world_id = :world_id
+        """), {"world_id": world_id}).fetchall())
+
+
+def test_keyset_pages_match_rank_over_the_whole_world(engine, client, world):
+    add_guilds(engine, world)
+    expected = expected_ranks(engine, world)
+
+    entries, cursor = [], None
+    while True:
+        params = {"world_id": world, "limit": 2}
+        if cursor is not None:
+            params["after_guild_id"] = cursor
+        page = client.get("/guild/leaderboard", params=params).json()
+        entries += page["leaderboard"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(entries) == len(GUILDS)
+    assert len({entry["guild_id"] for entry in entries}) == len(GUILDS)
+    assert {entry["guild_id"]: entry["rank"] for entry in entries} == expected
+    assert [entry["rank"] for entry in entries] == sorted(expected.values())
+
+
+def test_guild_rank_matches_rank_and_lists_its_neighbors(engine, client, world):
+    guild_ids = add_guilds(engine, world)
+    expected = expected_ranks(engine, world)
+
+    for guild_id in guild_ids:
+        response = client.get(f"/guild/leaderboard/{guild_id}/rank", params={"neighbors": 1}).json()
+        assert response["rank"] == expected[guild_id]
+        assert {entry["guild_id"]: entry["rank"] for entry in response["leaderboard"]}.items() <= expected.items()
+        assert guild_id in [entry["guild_id"] for entry in response["leaderboard"]]
+        assert 2 <= len(response["leaderboard"]) <= 3
@@ -0,0 +1,41 @@
+import threading
+from src import instrumentation
+from src import slow_queries
+from src.metrics import HistogramFamily
+
+
+def test_render_snapshots_children_under_the_family_lock():
+    family = HistogramFamily("test_seconds", "Test.", ("route",))
+    family.labels("/a").observe(0.1)
+    rendered = []
+    render = threading.Thread(target=lambda: rendered.append(family.render()))
+
+    # labels() adds children under this lock, so render must not iterate without it
+    with family._lock:
+        render.start()
+        render.join(0.1)
+        assert rendered == []
+    render.join(5)
+
+    assert 'test_seconds_count{route="/a"} 1' in rendered[0]
+
+
+def test_fingerprint_ignores_in_list_length_and_whitespace():
+    two = "SELECT * FROM hero WHERE name IN (%(names_1)s, %(names_2)s)"
+    three = "SELECT *\n  FROM hero WHERE name IN (%(names_1)s, %(names_2)s, %(names_3)s)"
+    other = "SELECT * FROM guild WHERE name IN (%(names_1)s)"
+
+    assert slow_queries.fingerprint(two) == slow_queries.fingerprint(three)
+    assert slow_queries.fingerprint(two) != slow_queries.fingerprint(other)
+    assert slow_queries.fingerprint("SELECT $1, $2") == slow_queries.fingerprint("SELECT $1, $2, $3")
+
+
+def test_slowest_statement_gauge_is_labeled_by_fingerprint(monkeypatch):
+    statement = "SELECT * FROM hero WHERE id = %(hero_id)s"
+    monkeypatch.setattr(instrumentation, "slowest_statements", {})
+    stats = instrumentation.RequestStats({})
+    stats.statements, stats.slowest_seconds, stats.slowest_statement = 1, 0.25, statement
+    instrumentation._record("GET", "/hero/{hero_id}", 200, 0.3, stats)
+
+    [(name, kind, help, samples)] = list(instrumentation._slowest_statements())
+    assert samples == [((("route", "/hero/{hero_id}"), ("fingerprint", slow_queries.fingerprint(statement))), 0.25)]
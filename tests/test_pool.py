@@ -0,0 +1,33 @@
+import pytest
+import sqlalchemy
+from src import database as db
+
+
+def test_checkout_timeouts_and_occupancy_are_counted(engine, monkeypatch):
+    monkeypatch.setitem(db.pool_metrics, "test", db.PoolMetrics())
+    options = {**db.pool_options("test"), "pool_size": 1, "max_overflow": 0, "pool_timeout": 0.1}
+    test_engine = sqlalchemy.create_engine(db.database_connection_url(), poolclass=db.TimedQueuePool, **options)
+    try:
+        with test_engine.connect():
+            status = db.pool_status(test_engine)
+            assert (status["size"], status["checked_out"], status["overflow"]) == (1, 1, 0)
+            with pytest.raises(sqlalchemy.exc.TimeoutError):
+                test_engine.connect()
+
+        status = db.pool_status(test_engine)
+        assert (status["checked_out"], status["checked_in"]) == (0, 1)
+        assert status["checkout_timeouts"] == 1
+        # Both checkouts waited, the second for the whole timeout
+        wait = status["checkout_wait_seconds"]
+        assert wait["count"] == 2 and wait["sum"] >= 0.1
+    finally:
+        test_engine.dispose()
+
+
+def test_admin_pool_reports_every_engine(client):
+    client.get("/hero/status", params={"hero_ids": [0]})
+    pools = client.get("/admin/pool").json()
+
+    assert {"primary", "primary_async"} <= pools.keys()
+    assert pools["primary"]["size"] == db.DB_POOL_SIZE
+    assert pools["primary_async"]["checked_in"] >= 1
@@ -0,0 +1,67 @@
+import cProfile
+import pytest
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from src import profiling
+
+
+def sync_endpoint():
+    return sum(range(1000))
+
+
+async def async_endpoint():
+    return sum(range(1000))
+
+
+def test_profiled_routes_record_sync_and_async_endpoints(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_ROUTES", {"/sync", "/async"})
+    monkeypatch.setattr(profiling, "profiles", profiling.RouteProfiles())
+    router = APIRouter(route_class=profiling.ProfiledRoute)
+    router.get("/sync")(sync_endpoint)
+    router.get("/async")(async_endpoint)
+    app = FastAPI()
+    app.include_router(router)
+
+    with TestClient(app) as client:
+        for path in ("/sync", "/async"):
+            response = client.get(path)
+            assert response.status_code == 200 and response.json() == 499500
+
+    for path, endpoint in (("/sync", sync_endpoint), ("/async", async_endpoint)):
+        stats = profiling.profiles._stats[("GET", path)]
+        assert any(name == endpoint.__name__ for _, _, name in stats.stats), path
+
+
+class ProcessWideProfile(cProfile.Profile):
+    """Allows one enabled profiler at a time, like cProfile from Python 3.12."""
+
+    active = None
+
+    def enable(self, *args, **kwargs):
+        if ProcessWideProfile.active not in (None, self):
+            raise ValueError("Another profiling tool is already active")
+        ProcessWideProfile.active = self
+        super().enable(*args, **kwargs)
+
+    def disable(self):
+        super().disable()
+        if ProcessWideProfile.active is self:
+            ProcessWideProfile.active = None
+
+
+@pytest.mark.parametrize("per_thread", [True, False])
+def test_sync_routes_nest_profilers_only_when_they_are_per_thread(monkeypatch, per_thread):
+    monkeypatch.setattr(cProfile, "Profile", ProcessWideProfile)
+    monkeypatch.setattr(profiling, "PROFILER_PER_THREAD", per_thread)
+    monkeypatch.setattr(profiling, "PROFILE_ROUTES", {"/sync"})
+    monkeypatch.setattr(profiling, "profiles", profiling.RouteProfiles())
+    router = APIRouter(route_class=profiling.ProfiledRoute)
+    router.get("/sync")(sync_endpoint)
+    app = FastAPI()
+    app.include_router(router)
+
+    with TestClient(app, raise_server_exceptions=False) as client:
+        response = client.get("/sync")
+
+    # A nested profiler fails with process-wide profiling
+    assert response.status_code == (500 if per_thread else 200)
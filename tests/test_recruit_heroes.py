@@ -0,0 +1,79 @@
+import sqlalchemy
+
+
+def add_guild_and_heroes(engine, world_id, other_world_id):
+    prefix = f"recruit test {world_id} "
+    with engine.begin() as connection:
+        guild_id, other_guild_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO guild (name, player_capacity, gold, world_id)
+            VALUES ('recruit test guild', 10, 0, :world_id), ('recruit test rival', 10, 0, :world_id)
+            RETURNING id
+        """), {"world_id": world_id}).scalars().all()
+        heroes = connection.execute(sqlalchemy.text("""
+            INSERT INTO hero (name, class, power, health, guild_id, world_id)
+            VALUES (:prefix || 'free', 'Mage', 1, 1, NULL, :world_id),
+                   (:prefix || 'by id', 'Mage', 1, 1, NULL, :world_id),
+                   (:prefix || 'pending', 'Mage', 1, 1, NULL, :world_id),
+                   (:prefix || 'guilded', 'Mage', 1, 1, :other_guild_id, :world_id),
+                   (:prefix || 'abroad', 'Mage', 1, 1, NULL, :other_world_id)
+            RETURNING name, id
+        """), {
+            "prefix": prefix,
+            "world_id": world_id,
+            "other_world_id": other_world_id,
+            "other_guild_id": other_guild_id,
+        }).all()
+        heroes = {name.removeprefix(prefix): hero_id for name, hero_id in heroes}
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO recruitment (hero_id, guild_id, status, request_date) VALUES (:hero_id, :guild_id, 'pending', now())
+        """), {"hero_id": heroes["pending"], "guild_id": guild_id})
+    return prefix, guild_id, heroes
+
+
+def test_recruit_heroes_reports_each_hero(engine, client, world):
+    with engine.begin() as connection:
+        other_world_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO world (name, dungeon_capacity, guild_capacity) VALUES (:name, 1, 1) RETURNING id
+        """), {"name": f"recruit test abroad {world}"}).scalar_one()
+    try:
+        prefix, guild_id, heroes = add_guild_and_heroes(engine, world, other_world_id)
+
+        response = client.post(f"/guild/recruit_heroes/{guild_id}", json={
+            "hero_names": [prefix + "free", prefix + "pending", prefix + "guilded", prefix + "abroad",
+                           prefix + "nobody", prefix + "free"],
+            "hero_ids": [heroes["by id"], heroes["free"], -1],
+        })
+        assert response.status_code == 200
+        body = response.json()
+
+        assert body["invited"] == 2
+        results = [(result["hero_id"], result["hero_name"], result["status"]) for result in body["results"]]
+        assert results == [
+            (heroes["free"], prefix + "free", "invited"),
+            (heroes["by id"], prefix + "by id", "invited"),
+            (heroes["pending"], prefix + "pending", "already_invited"),
+            (None, prefix + "guilded", "not_eligible"),
+            (None, prefix + "abroad", "not_eligible"),
+            (None, prefix + "nobody", "not_eligible"),
+            (-1, None, "not_eligible"),
+        ]
+        with engine.connect() as connection:
+            invites = connection.execute(sqlalchemy.text("""
+                SELECT hero_id, COUNT(*) FROM recruitment WHERE guild_id = :guild_id AND status = 'pending' GROUP BY hero_id
+            """), {"guild_id": guild_id}).all()
+        assert dict(invites) == {heroes["free"]: 1, heroes["by id"]: 1, heroes["pending"]: 1}
+
+        again = client.post(f"/guild/recruit_heroes/{guild_id}", json={"hero_ids": [heroes["free"]]}).json()
+        assert again["invited"] == 0 and again["results"][0]["status"] == "already_invited"
+    finally:
+        with engine.begin() as connection:
+            for statement in (
+                "DELETE FROM recruitment WHERE hero_id IN (SELECT id FROM hero WHERE world_id = :world_id)",
+                "DELETE FROM hero WHERE world_id = :world_id",
+                "DELETE FROM world WHERE id = :world_id",
+            ):
+                connection.execute(sqlalchemy.text(statement), {"world_id": other_world_id})
+
+
+def test_recruit_heroes_for_unknown_guild_is_not_found(client):
+    assert client.post("/guild/recruit_heroes/-1", json={"hero_ids": [1]}).status_code == 404
@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+import pytest
+import sqlalchemy
+from src import cache
+from src import database as db
+
+
+class FakeEngine:
+    """Engine whose connections return a fixed row for every statement."""
+
+    def __init__(self, row):
+        self.row = row
+        self.parameters = []
+
+    def connect(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, parameters=None):
+        self.parameters.append(parameters)
+        return self
+
+    def scalar_one(self):
+        return self.row
+
+    def one(self):
+        return self.row
+
+
+def router(primary_lsn, replica_row, max_lag=5):
+    primary = FakeEngine(primary_lsn)
+    replica = FakeEngine(SimpleNamespace(**replica_row))
+    return db.ReplicaRouter(primary, replica, max_lag, check_interval=0, retry_interval=10), replica
+
+
+def test_replica_behind_the_primary_is_not_used_even_if_it_replayed_all_it_received():
+    # A disconnected WAL receiver: everything received was replayed an hour ago
+    replica_router, replica = router("0/5000000", {"in_recovery": True, "caught_up": False, "replay_age": 3600})
+
+    assert not replica_router.usable()
+    assert replica_router.lag_seconds == 3600
+    assert replica.parameters == [{"primary_lsn": "0/5000000"}]
+
+
+def test_replica_with_unknown_lag_is_not_used():
+    replica_router, _ = router("0/5000000", {"in_recovery": True, "caught_up": False, "replay_age": None})
+
+    assert not replica_router.usable()
+    assert replica_router.lag_seconds is None
+
+
+def test_caught_up_replica_is_used():
+    replica_router, _ = router("0/5000000", {"in_recovery": True, "caught_up": True, "replay_age": 3600})
+
+    assert replica_router.usable()
+    assert replica_router.lag_seconds == 0
+
+
+def test_lag_query_runs_against_postgres(connection):
+    # The database is both primary and replica, which is never in recovery
+    try:
+        engine = sqlalchemy.create_engine(db.database_connection_url(), poolclass=sqlalchemy.pool.NullPool)
+        replica_router = db.ReplicaRouter(engine, engine, 5, check_interval=0, retry_interval=10)
+        assert replica_router.usable()
+        assert replica_router.lag_seconds == 0
+    finally:
+        engine.dispose()
+
+
+def test_reload_after_invalidation_reads_from_the_primary():
+    read_cache = cache.ReadCache(max_entries=10, ttl=60, primary_window=60)
+    from_primary = []
+
+    def load():
+        from_primary.append(db._read_from_primary.get())
+        return len(from_primary)
+
+    assert read_cache.get_or_load(("leaderboard", 1), load) == 1
+    read_cache.invalidate("leaderboard")
+    assert read_cache.get_or_load(("leaderboard", 1), load) == 2
+    assert from_primary == [False, True]
+    assert db._read_from_primary.get() is False
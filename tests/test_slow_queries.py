@@ -0,0 +1,32 @@
+import sqlalchemy
+from src import slow_queries
+
+
+def test_slow_statements_are_captured_and_explained(engine, client, monkeypatch):
+    log = slow_queries.SlowQueryLog(10, explain_sample=1)
+    monkeypatch.setattr(slow_queries, "log", log)
+    monkeypatch.setattr(slow_queries, "SLOW_QUERY_SECONDS", 0.05)
+    log.start()
+    try:
+        with engine.connect() as connection:
+            connection.execute(sqlalchemy.text("SELECT 1"))
+            connection.execute(sqlalchemy.text("SELECT pg_sleep(:seconds)"), {"seconds": 0.06})
+    finally:
+        # Waits for the queued EXPLAIN
+        log.stop()
+
+    response = client.get("/admin/slow_queries", params={"limit": 5})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["captured"], body["explained"]) == (1, 1)
+    [entry] = body["queries"]
+    assert entry["route"] == "background"
+    assert entry["statement"].startswith("SELECT pg_sleep(")
+    assert entry["fingerprint"] == slow_queries.fingerprint(entry["statement"])
+    assert entry["duration_seconds"] >= 0.05
+    # Plain SELECTs are run with ANALYZE
+    assert "actual time" in entry["plan"] and entry["plan_error"] is None
+
+
+def test_admin_slow_queries_rejects_invalid_limit(client):
+    assert client.get("/admin/slow_queries", params={"limit": 0}).status_code == 400
@@ -0,0 +1,85 @@
+import pytest
+import sqlalchemy
+from src import spawner
+
+
+@pytest.fixture
+def dungeons(engine):
+    with engine.begin() as connection:
+        world_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO world (name, dungeon_capacity, guild_capacity) VALUES ('spawn test world', 2, 1) RETURNING id
+        """)).scalar_one()
+        dungeon_ids = connection.execute(sqlalchemy.text("""
+            INSERT INTO dungeon (name, monster_capacity, monster_count, party_capacity, level, gold_reward, world_id, status)
+            VALUES ('spawn test open', 3, 0, 4, 2, 10, :world_id, 'open'),
+                   ('spawn test closed', 3, 0, 4, 2, 10, :world_id, 'closed')
+            RETURNING id
+        """), {"world_id": world_id}).scalars().all()
+    try:
+        yield dungeon_ids
+    finally:
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text("DELETE FROM monster WHERE dungeon_id = ANY(:ids)"), {"ids": dungeon_ids})
+            connection.execute(sqlalchemy.text("DELETE FROM dungeon WHERE id = ANY(:ids)"), {"ids": dungeon_ids})
+            connection.execute(sqlalchemy.text("DELETE FROM world WHERE id = :id"), {"id": world_id})
+
+
+def test_spawn_fills_open_dungeons_up_to_capacity(engine, dungeons, monkeypatch):
+    open_id, closed_id = dungeons
+    # Only look at the test dungeons
+    monkeypatch.setattr(spawner, "_next_after_id", open_id - 1)
+    monkeypatch.setattr(spawner, "MONSTER_SPAWN_MAX_DUNGEONS", 2)
+    monkeypatch.setattr(spawner, "MONSTER_SPAWN_MAX_PER_DUNGEON", 2)
+
+    assert spawner.spawn()["monsters"] == 2
+    monkeypatch.setattr(spawner, "_next_after_id", open_id - 1)
+    assert spawner.spawn()["monsters"] == 1
+    monkeypatch.setattr(spawner, "_next_after_id", open_id - 1)
+    assert spawner.spawn()["monsters"] == 0
+
+    with engine.connect() as connection:
+        rows = connection.execute(sqlalchemy.text("""
+            SELECT d.id, d.monster_count, COUNT(m.id), MIN(m.level), MIN(m.health), MIN(m.power)
+            FROM dungeon d LEFT JOIN monster m ON m.dungeon_id = d.id
+            WHERE d.id = ANY(:ids)
+            GROUP BY d.id
+            ORDER BY d.id
+        """), {"ids": dungeons}).fetchall()
+    assert [tuple(row) for row in rows] == [
+        (open_id, 3, 3, 2, 2 * spawner.MONSTER_SPAWN_HEALTH_PER_LEVEL, 2 * spawner.MONSTER_SPAWN_POWER_PER_LEVEL),
+        (closed_id, 0, 0, None, None, None),
+    ]
+
+
+def test_monsters_killed_in_battle_are_respawned(engine, dungeons, monkeypatch):
+    from src import battle
+
+    open_id, _ = dungeons
+    monkeypatch.setattr(spawner, "MONSTER_SPAWN_MAX_DUNGEONS", 1)
+    monkeypatch.setattr(spawner, "_next_after_id", open_id - 1)
+    assert spawner.spawn()["monsters"] == 3
+
+    with engine.begin() as connection:
+        hero_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO hero (name, power, health, dungeon_id, world_id, level, xp)
+            SELECT 'spawn test hero', 1000, 1000, id, world_id, 1, 0 FROM dungeon WHERE id = :id
+            RETURNING id
+        """), {"id": open_id}).scalar_one()
+    try:
+        with engine.begin() as connection:
+            outcome = battle.resolve_dungeons(connection, [open_id])
+        assert outcome[open_id]["monsters_remaining"] == 0
+
+        monkeypatch.setattr(spawner, "_next_after_id", open_id - 1)
+        assert spawner.spawn()["monsters"] == 3
+        with engine.connect() as connection:
+            living = connection.execute(sqlalchemy.text("""
+                SELECT monster_count, (SELECT COUNT(*) FROM monster WHERE dungeon_id = :id AND health > 0)
+                FROM dungeon WHERE id = :id
+            """), {"id": open_id}).one()
+        assert tuple(living) == (3, 3)
+    finally:
+        with engine.begin() as connection:
+            for table in ("targeting", "targeting_rollup", "hero_battle_summary"):
+                connection.execute(sqlalchemy.text(f"DELETE FROM {table} WHERE hero_id = :id"), {"id": hero_id})
+            connection.execute(sqlalchemy.text("DELETE FROM hero WHERE id = :id"), {"id": hero_id})
@@ -0,0 +1,43 @@
+import json
+import sqlalchemy
+from src import streaming
+
+NDJSON = {"accept": streaming.NDJSON_MEDIA_TYPE}
+
+
+def test_ndjson_streams_the_same_rows_as_the_json_list(engine, client, world, monkeypatch):
+    # Several batches, the last one partial
+    monkeypatch.setattr(streaming, "STREAM_BATCH_ROWS", 2)
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO hero (name, power, health, world_id)
+            SELECT :prefix || n, n, 10, :world_id FROM generate_series(1, 5) AS n
+        """), {"prefix": f"stream test {world} ", "world_id": world})
+
+    listed = client.get(f"/world/view_heroes/{world}").json()
+    response = client.get(f"/world/view_heroes/{world}", headers=NDJSON)
+
+    assert response.headers["content-type"].startswith(streaming.NDJSON_MEDIA_TYPE)
+    assert response.text.endswith("\n")
+    assert [json.loads(line) for line in response.text.splitlines()] == listed
+    assert len(listed) == 5
+
+
+def test_ndjson_leaderboard_is_not_capped(engine, client, world, monkeypatch):
+    from src.api import guild
+
+    monkeypatch.setattr(guild, "MAX_LEADERBOARD_LIMIT", 2)
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("""
+            WITH g AS (
+                INSERT INTO guild (name, player_capacity, gold, world_id)
+                SELECT 'stream test guild ' || n, 10, n, :world_id FROM generate_series(1, 3) AS n
+                RETURNING id, gold
+            )
+            INSERT INTO guild_stats (guild_id, world_id, gold) SELECT id, :world_id, gold FROM g
+        """), {"world_id": world})
+
+    params = {"world_id": world, "limit": 3}
+    assert client.get("/guild/leaderboard", params=params).status_code == 400
+    lines = client.get("/guild/leaderboard", params=params, headers=NDJSON).text.splitlines()
+    assert [(entry["rank"], entry["guild_gold"]) for entry in map(json.loads, lines)] == [(1, 3), (2, 2), (3, 1)]
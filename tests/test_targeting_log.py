@@ -0,0 +1,139 @@
+import time
+import pytest
+import sqlalchemy
+from src import database as db
+from src import targeting_log
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_poison_row_is_dropped_and_later_rows_flush(monkeypatch):
+    written = []
+
+    def flush(rows):
+        if any(hero_id == 13 for hero_id, _, _, _ in rows):
+            raise sqlalchemy.exc.IntegrityError("INSERT", {}, Exception("hero 13 was deleted"))
+        written.extend(rows)
+
+    monkeypatch.setattr(targeting_log, "flush", flush)
+    buffer = targeting_log.TargetingBuffer(capacity=100, flush_rows=10, flush_seconds=0.01, flush_retries=2)
+    rows = [(hero_id, 1, 5, None) for hero_id in range(10, 30)]
+    buffer.start()
+    try:
+        assert buffer.reserve(len(rows), timeout=1)
+        buffer.add(rows)
+        wait_for(lambda: buffer.rows_flushed + buffer.rows_dropped == len(rows))
+    finally:
+        buffer.stop()
+
+    assert buffer.rows_dropped == 1
+    assert sorted(written) == [row for row in rows if row[0] != 13]
+    assert buffer.stats()["reserved_rows"] == 0
+
+
+def test_commit_hooks_run_only_after_a_commit_succeeds():
+    committed, discarded = [], []
+
+    def collect(into):
+        def hook(info):
+            if "marker" in info:
+                into.append(info.pop("marker"))
+        return hook
+
+    engine = sqlalchemy.create_engine(db.database_connection_url(), poolclass=sqlalchemy.pool.NullPool)
+    db.on_commit(engine, collect(committed), collect(discarded))
+    try:
+        connection = engine.connect()
+    except sqlalchemy.exc.OperationalError:
+        pytest.skip("database not available")
+
+    with connection:
+        connection.execute(sqlalchemy.text(
+            "CREATE TEMP TABLE deferred_unique (x INT UNIQUE DEFERRABLE INITIALLY DEFERRED)"
+        ))
+        connection.commit()
+
+        # The duplicate is only detected by the commit itself
+        connection.execute(sqlalchemy.text("INSERT INTO deferred_unique VALUES (1), (1)"))
+        connection.info["marker"] = "duplicate"
+        with pytest.raises(sqlalchemy.exc.IntegrityError):
+            connection.commit()
+        connection.rollback()
+        assert committed == [] and discarded == ["duplicate"]
+
+        connection.execute(sqlalchemy.text("INSERT INTO deferred_unique VALUES (1)"))
+        connection.info["marker"] = "unique"
+        connection.commit()
+        # Confirmed by the next transaction beginning
+        connection.execute(sqlalchemy.text("SELECT 1"))
+        assert committed == ["unique"]
+
+        connection.info["marker"] = "rolled back"
+        connection.rollback()
+        assert discarded == ["duplicate", "rolled back"]
+
+        connection.execute(sqlalchemy.text("INSERT INTO deferred_unique VALUES (2)"))
+        connection.info["marker"] = "last"
+        connection.commit()
+        assert committed == ["unique"]
+    # ...or by the connection being checked in
+    assert committed == ["unique", "last"]
+
+    # A connection closed without a transaction drops what was left on it
+    with engine.connect() as connection:
+        connection.info["marker"] = "never begun"
+    assert discarded == ["duplicate", "rolled back", "never begun"]
+
+
+class FakeAsyncConnection:
+    def __init__(self):
+        self.info = {}
+        self.inserted = []
+
+    async def run_sync(self, fn, *args):
+        self.inserted.append(args)
+
+
+def test_record_async_waits_for_capacity_off_the_event_loop(monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(targeting_log, "flush", lambda rows: None)
+    monkeypatch.setattr(targeting_log, "TARGETING_ENQUEUE_TIMEOUT", 0.3)
+    buffer = targeting_log.TargetingBuffer(capacity=1, flush_rows=10, flush_seconds=10)
+    monkeypatch.setattr(targeting_log, "buffer", buffer)
+    buffer.start()
+    assert buffer.reserve(1, timeout=0)
+
+    async def main():
+        ticks = 0
+        connection = FakeAsyncConnection()
+        task = asyncio.ensure_future(targeting_log.record_async(connection, [1], [2], [3]))
+        while not task.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        return ticks, connection
+
+    try:
+        ticks, connection = asyncio.run(main())
+    finally:
+        buffer.release(1)
+        buffer.stop()
+
+    # The loop kept running while the buffer was full, then the rows were inserted directly
+    assert ticks > 10
+    assert connection.inserted == [([1], [2], [3])]
+    assert buffer.sync_fallbacks == 1
+
+
+def test_buffer_reports_heroes_with_rows_not_yet_written():
+    buffer = targeting_log.TargetingBuffer(capacity=10, flush_rows=10, flush_seconds=10)
+    assert buffer.reserve(2, timeout=0)
+    buffer.add([(7, 1, 5, None), (8, 1, 0, None)])
+
+    assert buffer.has_rows_for(7) and buffer.has_rows_for(8)
+    assert not buffer.has_rows_for(9)
@@ -0,0 +1,67 @@
+import sqlalchemy
+
+# (class, power, level, guilded)
+HEROES = [
+    ("Warrior", 10, 1, False), ("Mage", 20, 5, False), ("Warrior", 30, 9, False), ("Mage", 5, 2, True),
+    ("Warrior", 25, 4, False), ("Rogue", 15, 7, False), ("Warrior", 40, 3, False),
+]
+
+
+def add_heroes(engine, world_id):
+    with engine.begin() as connection:
+        guild_id = connection.execute(sqlalchemy.text("""
+            INSERT INTO guild (name, player_capacity, gold, world_id) VALUES ('view test guild', 10, 0, :world_id) RETURNING id
+        """), {"world_id": world_id}).scalar_one()
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO hero (name, class, power, health, level, guild_id, world_id)
+            SELECT :prefix || n, class, power, 10, level, CASE WHEN guilded THEN :guild_id END, :world_id
+            FROM unnest(CAST(:classes AS TEXT[]), CAST(:powers AS INT[]), CAST(:levels AS INT[]), CAST(:guilded AS BOOLEAN[]))
+                WITH ORDINALITY AS h(class, power, level, guilded, n)
+            ORDER BY n
+        """), {
+            "prefix": f"view test {world_id} ",
+            "guild_id": guild_id,
+            "world_id": world_id,
+            "classes": [hero[0] for hero in HEROES],
+            "powers": [hero[1] for hero in HEROES],
+            "levels": [hero[2] for hero in HEROES],
+            "guilded": [hero[3] for hero in HEROES],
+        })
+
+
+def expected(engine, world_id, where="TRUE"):
+    with engine.connect() as connection:
+        return connection.execute(sqlalchemy.text(f"""
+            SELECT id FROM hero WHERE world_id = :world_id AND guild_id IS NULL AND {where} ORDER BY id
+        """), {"world_id": world_id}).scalars().all()
+
+
+def all_pages(client, world_id, **filters):
+    ids, after_id = [], None
+    while True:
+        params = {"limit": 2, **filters}
+        if after_id is not None:
+            params["after_id"] = after_id
+        page = client.get(f"/world/view_heroes/{world_id}", params=params).json()
+        if not page:
+            return ids
+        assert len(page) <= 2
+        ids += [hero["id"] for hero in page]
+        after_id = page[-1]["id"]
+
+
+def test_pages_cover_every_unguilded_hero_once(engine, client, world):
+    add_heroes(engine, world)
+
+    assert all_pages(client, world) == expected(engine, world)
+    assert len(expected(engine, world)) == 6
+
+
+def test_filters_apply_across_pages(engine, client, world):
+    add_heroes(engine, world)
+
+    assert all_pages(client, world, hero_class="Warrior", min_power=20) == expected(
+        engine, world, "class = 'Warrior' AND power >= 20"
+    )
+    assert all_pages(client, world, min_level=3, max_level=7) == expected(engine, world, "level BETWEEN 3 AND 7")
+    assert client.get(f"/world/view_heroes/{world}", params={"limit": 0}).status_code == 400
@@ -0,0 +1,89 @@
+import pytest
+import sqlalchemy
+from src import world_tick
+
+# Above the INT range, as advisory lock keys must handle
+WORLD_ID = 3_000_000_000
+
+
+@pytest.fixture
+def world(engine):
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO world (id, name, dungeon_capacity, guild_capacity) VALUES (:world_id, 'tick test world', 1, 1)
+        """), {"world_id": WORLD_ID})
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO hero (name, class, power, health, xp, age, level, world_id)
+            SELECT 'tick test hero ' || n, 'Warrior', 1, health, 150, 20, 1, :world_id
+            FROM unnest(ARRAY[50, 98, 150, 0, 10]) WITH ORDINALITY AS h(health, n)
+        """), {"world_id": WORLD_ID})
+    try:
+        yield WORLD_ID
+    finally:
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text("DELETE FROM hero WHERE world_id = :world_id"), {"world_id": WORLD_ID})
+            connection.execute(sqlalchemy.text("DELETE FROM world WHERE id = :world_id"), {"world_id": WORLD_ID})
+
+
+def heroes(engine):
+    with engine.connect() as connection:
+        return connection.execute(sqlalchemy.text("""
+            SELECT age, health, level, xp FROM hero WHERE world_id = :world_id ORDER BY id
+        """), {"world_id": WORLD_ID}).fetchall()
+
+
+def test_failed_tick_resumes_where_it_stopped(engine, world, monkeypatch):
+    monkeypatch.setattr(world_tick, "WORLD_TICK_CHUNK", 2)
+    sql_tick_heroes = world_tick.sql_tick_heroes
+    # Fail every chunk after the first
+    monkeypatch.setattr(world_tick, "sql_tick_heroes", sql_tick_heroes.replace(
+        "AND id > :after_id", "AND id > :after_id AND (CAST(:after_id AS BIGINT) = 0 OR 1 / 0 = 1)"
+    ))
+    with engine.connect() as tick_connection:
+        with pytest.raises(sqlalchemy.exc.DataError):
+            world_tick.tick_world(tick_connection, world, min_interval=3600)
+
+    assert [hero.age for hero in heroes(engine)] == [21, 21, 20, 20, 20]
+
+    # The interval has not passed, but the unfinished tick still completes
+    monkeypatch.setattr(world_tick, "sql_tick_heroes", sql_tick_heroes)
+    with engine.connect() as tick_connection:
+        assert world_tick.tick_world(tick_connection, world, min_interval=3600) == {"heroes": 3, "levels_gained": 3}
+        assert world_tick.tick_world(tick_connection, world, min_interval=3600) is None
+
+    assert heroes(engine) == [
+        (21, 55, 2, 50),
+        (21, 100, 2, 50),
+        # Above the cap, so no regen and no loss either
+        (21, 150, 2, 50),
+        (21, 0, 2, 50),
+        (21, 15, 2, 50),
+    ]
+    with engine.connect() as connection:
+        tick, after_id = connection.execute(sqlalchemy.text(
+            "SELECT tick, tick_after_id FROM world WHERE id = :world_id"
+        ), {"world_id": world}).one()
+    assert (tick, after_id) == (1, None)
+
+
+def test_failed_unlock_keeps_the_tick_error_and_releases_the_lock(engine, world, monkeypatch):
+    monkeypatch.setattr(world_tick, "sql_tick_heroes", "SELECT 1 / 0")
+    with engine.connect() as tick_connection:
+        execute = tick_connection.execute
+
+        def execute_failing_unlock(statement, *args, **kwargs):
+            if "pg_advisory_unlock" in str(statement):
+                raise sqlalchemy.exc.OperationalError(str(statement), {}, Exception("connection lost"))
+            return execute(statement, *args, **kwargs)
+
+        monkeypatch.setattr(tick_connection, "execute", execute_failing_unlock)
+        with pytest.raises(sqlalchemy.exc.DataError):
+            world_tick.tick_world(tick_connection, world, min_interval=3600)
+        assert tick_connection.invalidated
+
+    with engine.connect() as connection:
+        assert connection.execute(
+            sqlalchemy.text("SELECT pg_try_advisory_lock(CAST(:world_id AS BIGINT))"), {"world_id": world}
+        ).scalar_one()
+        connection.execute(sqlalchemy.text("SELECT pg_advisory_unlock(CAST(:world_id AS BIGINT))"), {"world_id": world})
+        connection.commit()